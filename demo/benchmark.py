@@ -0,0 +1,264 @@
+# Benchmark matrix runner: replaces the commented-out command lines in infer-batch.sh with a
+# declarative config. Every cell of the matrix is one engine configuration; each cell is warmed up,
+# run `repeats` times over the same documents, and every run is appended as one JSON line. vLLM
+# cells each run in a process of their own, so one cell's model is off the GPU before the next loads.
+#
+#   python demo/benchmark.py demo/benchmark-matrix.json --results bench-results.jsonl
+#
+# Config (JSON):
+#   {
+#     "inputs": "/hfcache/input",          directory of .txt passages (or a list of files)
+#     "prefix_file": "prompt-prefix.txt",  instruction, relative to the project root
+#     "max_documents": 8, "repeats": 3, "warmup": 1,
+#     "batch": false,                      true: submit all documents in one generate call
+#     "baseline": "<cell name>",           default: the first cell
+#     "references": "/hfcache/reference",  optional directory of reference outputs, named like the inputs
+#     "matrix": {"backend": ["llama_cpp"], "model": ["./models/x.gguf"], "n_threads": [4, 8], "draft_tokens": [0, 3]},
+#     "cells": [{"name": "...", "backend": "...", "model": "...", ...}]   explicit cells, added after the matrix
+#   }
+#
+# With --latency DIR every run streams tokens (engine.generate_traced) and each record gets a
+# "latency" field (TTFT, prefill, inter-token latency, decode tok/s, draft acceptance); the
+# per-request traces go to DIR/<cell>-<repeat>.json, plus a Chrome trace with --chrome-trace.
+# Batch cells only get per-document latencies (the mean/p50/p95 columns) with --latency.
+#
+# Every record also gets a "quality" field (quality.py: changed-word and forbidden-edit rates, and
+# with references the reference accuracy), so a faster cell that changes the output shows up next
+# to its speedup. llama_cpp cells with "grammar": true decode under an input-constrained grammar
+# (input_grammar.py); their records get a "grammar" field with the forced share and rejection counts.
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+
+from engines import create_engine
+from input_grammar import format_report
+from latency import TraceRecorder, percentile
+from prompting import format_prompt, split_passage
+from quality import format_summary, load_references, score_corpus
+from runaway import BLANK_RUN_STOP
+from scheduling import max_tokens_for
+
+MAX_TOKENS = 2048
+SYSTEM_MESSAGE = "Je bent een tekstredacteur."
+
+
+def expand_cells(config):
+    cells = []
+    matrix = config.get("matrix", {})
+    if matrix:
+        keys = list(matrix)
+        for values in itertools.product(*(matrix[key] for key in keys)):
+            cells.append(dict(zip(keys, values)))
+    cells.extend(dict(cell) for cell in config.get("cells", []))
+    for cell in cells:
+        if "name" not in cell:
+            cell["name"] = "-".join(f"{key}={os.path.basename(str(value))}" for key, value in cell.items())
+    return cells
+
+
+def load_documents(config, base_dir):
+    inputs = config.get("inputs", "/hfcache/input")
+    if isinstance(inputs, str):
+        files = sorted(os.path.join(inputs, f) for f in os.listdir(inputs) if f.endswith(".txt"))
+    else:
+        files = [os.path.join(base_dir, f) for f in inputs]
+    files = files[:config.get("max_documents", len(files))]
+    documents = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            # Prompt files with their own rules are reduced to the passage
+            documents.append((os.path.basename(path), split_passage(f.read().strip())[1]))
+    return documents
+
+
+def run_once(engine, prompts, passages, sampling, batch, recorder=None):
+    # Returns per-document latencies and results. In batch mode a document's latency is when its
+    # request finished, counted from the submission of the batch; only the traces know that, so
+    # without a recorder the latencies are None rather than the batch time repeated per document.
+    def generate(prompts, sampling, passages):
+        if recorder is not None:
+            return engine.generate_traced(prompts, sampling, recorder, passages)
+        return engine.generate(prompts, sampling, passages)
+    if batch:
+        start = time.perf_counter()
+        results = generate(prompts, sampling, passages)
+        if recorder is None:
+            return None, results
+        return [trace.finished - start for trace in recorder.traces[-len(prompts):]], results
+    latencies = []
+    results = []
+    for prompt, passage, params in zip(prompts, passages, sampling):
+        start = time.time()
+        results.extend(generate([prompt], [params], [passage]))
+        latencies.append(time.time() - start)
+    return latencies, results
+
+
+def run_cell(cell, documents, instruction, config, results_file, latency_dir=None, chrome_trace=False, references=None):
+    options = {key: value for key, value in cell.items() if key not in ("name", "backend", "model", "batch")}
+    start_init = time.time()
+    engine = create_engine(cell["backend"], cell.get("model"), **options)
+    init_seconds = time.time() - start_init
+
+    passages = [text for _, text in documents]
+    prompts = [format_prompt(SYSTEM_MESSAGE, instruction, text, cell.get("model")) for text in passages]
+    sampling = [
+        {"temperature": 0, "max_tokens": max_tokens_for(engine.count_tokens(text), MAX_TOKENS), "stop": [BLANK_RUN_STOP]}
+        for text in passages
+    ]
+    batch = cell.get("batch", config.get("batch", False))
+
+    warmup_start = time.time()
+    for _ in range(config.get("warmup", 1)):
+        run_once(engine, prompts[:1], passages[:1], sampling[:1], batch)
+    warmup_seconds = time.time() - warmup_start
+
+    records = []
+    for repeat in range(config.get("repeats", 3)):
+        recorder = TraceRecorder(cell["name"]) if latency_dir else None
+        grammar_stats = getattr(engine, "grammar_stats", None)
+        if grammar_stats is not None:
+            grammar_stats.reset()
+        start = time.time()
+        latencies, results = run_once(engine, prompts, passages, sampling, batch, recorder)
+        seconds = time.time() - start
+        completion_tokens = sum(result["completion_tokens"] for result in results)
+        record = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "host": platform.node(),
+            "cell": cell["name"],
+            "params": cell,
+            "repeat": repeat,
+            "documents": [name for name, _ in documents],
+            "init_seconds": init_seconds,
+            "warmup_seconds": warmup_seconds,
+            "seconds": seconds,
+            "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": completion_tokens / seconds if seconds else 0.0,
+            "latencies": latencies,
+            "quality": score_corpus(passages, [result["text"] for result in results], references)["summary"],
+        }
+        if grammar_stats is not None:
+            record["grammar"] = engine.grammar_report()
+        if recorder is not None:
+            for trace, (name, _) in zip(recorder.traces, documents):
+                trace.request_id = name
+            record["latency"] = recorder.aggregate()
+            trace_base = os.path.join(latency_dir, f"{cell['name']}-{repeat}")
+            recorder.write_json(trace_base + ".json")
+            if chrome_trace:
+                recorder.write_chrome_trace(trace_base + ".trace.json")
+        results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results_file.flush()
+        records.append(record)
+        latency = record.get("latency")
+        ttft = f", TTFT {latency['ttft_mean']:.3f}s, ITL p95 {latency['itl_p95'] * 1000:.1f}ms" if latency else ""
+        print(f"{cell['name']} run {repeat + 1}: {seconds:.2f}s, {record['tokens_per_second']:.1f} tok/s{ttft}, {format_summary(record['quality'])}")
+        if grammar_stats is not None:
+            print(f"{cell['name']} run {repeat + 1} grammar: {format_report(record['grammar'])}")
+    del engine
+    return records
+
+
+def run_cell_in_process(cell, documents, instruction, config, results_path, latency_dir=None, chrome_trace=False, references=None):
+    # vLLM keeps GPU memory and its worker processes after `del engine`, so a second 32B cell in the
+    # same process would not fit; a spawned process per vLLM cell gives everything back when it exits
+    import benchmark  # by name, so the child can unpickle it also when this file runs as __main__ or via run.py
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(benchmark.run_cell_to_file, cell, documents, instruction, config, results_path,
+                           latency_dir, chrome_trace, references).result()
+
+
+def run_cell_to_file(cell, documents, instruction, config, results_path, latency_dir=None, chrome_trace=False, references=None):
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        return run_cell(cell, documents, instruction, config, results_file, latency_dir, chrome_trace, references)
+
+
+def summarize(cells, records_by_cell, baseline):
+    rows = []
+    for cell in cells:
+        records = records_by_cell[cell["name"]]
+        latencies = [latency for record in records for latency in record["latencies"] or []]
+        rows.append({
+            "cell": cell["name"],
+            "tokens_per_second": statistics.mean(record["tokens_per_second"] for record in records),
+            "seconds": statistics.mean(record["seconds"] for record in records),
+            "mean": statistics.mean(latencies) if latencies else None,
+            "p50": percentile(latencies, 50) if latencies else None,
+            "p95": percentile(latencies, 95) if latencies else None,
+            "changed": statistics.mean(record["quality"]["changed_word_rate"] for record in records),
+            "forbidden": statistics.mean(record["quality"]["forbidden_edit_rate"] for record in records),
+            "accuracy": statistics.mean(record["quality"]["reference_accuracy"] for record in records) if "reference_accuracy" in records[0]["quality"] else None,
+        })
+    base = next((row for row in rows if row["cell"] == baseline), rows[0])
+    for row in rows:
+        row["speedup"] = base["seconds"] / row["seconds"] if row["seconds"] else 0.0
+    return rows
+
+
+def print_table(rows, baseline):
+    width = max(len("cell"), *(len(row["cell"]) for row in rows))
+    print(f"{'cell':<{width}}  {'tok/s':>8}  {'mean s':>8}  {'p50 s':>8}  {'p95 s':>8}  {'speedup':>8}  {'changed':>8}  {'forbid':>8}  {'ref acc':>8}")
+    for row in rows:
+        marker = " (baseline)" if row["cell"] == baseline else ""
+        accuracy = f"{row['accuracy']:>8.1%}" if row["accuracy"] is not None else f"{'-':>8}"
+        mean, p50, p95 = (f"{row[key]:>8.2f}" if row[key] is not None else f"{'-':>8}" for key in ("mean", "p50", "p95"))
+        print(f"{row['cell']:<{width}}  {row['tokens_per_second']:>8.1f}  {mean}  {p50}  {p95}  {row['speedup']:>7.2f}x"
+              f"  {row['changed']:>8.1%}  {row['forbidden']:>8.2%}  {accuracy}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a benchmark matrix and compare configurations")
+    parser.add_argument("config", help="JSON benchmark config")
+    parser.add_argument("--results", dest="results", default="bench-results.jsonl", help="JSONL file to append one record per run to")
+    parser.add_argument("--only", dest="only", nargs="+", default=None, help="Run only these cells")
+    parser.add_argument("--latency", dest="latency_dir", default=None, metavar="DIR", help="Stream tokens and write per-request latency traces to DIR")
+    parser.add_argument("--chrome-trace", dest="chrome_trace", action="store_true", help="With --latency, also write Chrome trace files")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    with open(os.path.join(base_dir, config.get("prefix_file", "prompt-prefix.txt")), "r", encoding="utf-8") as f:
+        instruction = f.read().strip()
+    documents = load_documents(config, base_dir)
+    if not documents:
+        print("No documents to benchmark.")
+        return
+
+    references = load_references(config["references"], [name for name, _ in documents]) if config.get("references") else None
+
+    cells = expand_cells(config)
+    if args.only:
+        cells = [cell for cell in cells if cell["name"] in args.only]
+    if not cells:
+        names = ", ".join(cell["name"] for cell in expand_cells(config))
+        raise SystemExit(f"No cells match --only {' '.join(args.only)}; the config has: {names}")
+    baseline = config.get("baseline", cells[0]["name"])
+
+    if args.latency_dir:
+        os.makedirs(args.latency_dir, exist_ok=True)
+    records_by_cell = {}
+    with open(args.results, "a", encoding="utf-8") as results_file:
+        for cell in cells:
+            print(f"Running {cell['name']} on {len(documents)} documents...")
+            if cell["backend"] == "vllm":
+                results_file.flush()
+                records_by_cell[cell["name"]] = run_cell_in_process(cell, documents, instruction, config, args.results, args.latency_dir, args.chrome_trace, references)
+            else:
+                records_by_cell[cell["name"]] = run_cell(cell, documents, instruction, config, results_file, args.latency_dir, args.chrome_trace, references)
+
+    print_table(summarize(cells, records_by_cell, baseline), baseline)
+    print(f"Results appended to {args.results}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Model cascade: every chunk goes to the smallest configured model first, and only chunks whose
+# output fails validation (validation.py: word counts, Latin, edit distance, runaway) move on to the
+# next model. Most of a scholastic text is routine spelling work a small model gets right; the
+# large model is only paid for on the passages that need it.
+#
+#   python demo/cascade.py demo/cascade.json [--output-prefix X]
+#
+# Config (JSON):
+#   {
+#     "inputs": "/hfcache/input",          directory of .txt passages (or a list of files)
+#     "prefix_file": "prompt-prefix.txt",  instruction, relative to the project root
+#     "max_documents": 100,
+#     "chunk_tokens": 1024,                chunk size, counted with the first stage's tokenizer
+#     "stages": [{"backend": "llama_cpp", "model": "./models/x.gguf", "cost": 1, ...engine options}, ...]
+#   }
+# "cost" is the relative price of one token on that stage (e.g. parameter count in billions); the
+# report compares the cascade's cost with running every chunk on the last stage. Stages run one after
+# the other over all chunks still open, and each engine is released before the next one loads, so a
+# single GPU holds one model at a time: llama_cpp frees its model when the engine is dropped, while
+# vLLM keeps GPU memory and worker processes until its process exits, so every vLLM stage runs in a
+# spawned child process. Stage options are checked against the backends before the first model loads.
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import time
+
+from benchmark import MAX_TOKENS, SYSTEM_MESSAGE, load_documents
+from chunking import chunk_budget, chunk_text
+from engines import create_engine, unknown_options
+from latin import mask_latin
+from pipeline import FileJob, write_text
+from prompting import format_prompt
+from runaway import BLANK_RUN_STOP
+from scheduling import max_tokens_for
+from validation import validate
+
+DEFAULT_OUTPUT_DIR = "/hfcache/output"
+CHUNK_TOKENS = 1024
+STAGE_KEYS = ("backend", "model", "cost", "name")  # everything else is an engine option
+
+
+def run_stage(engine, stage, texts, instruction):
+    # One result per chunk text
+    model = stage.get("model")
+    prompts = [format_prompt(SYSTEM_MESSAGE, instruction, text, model) for text in texts]
+    sampling = [
+        {"temperature": 0, "max_tokens": max_tokens_for(engine.count_tokens(text), MAX_TOKENS), "stop": [BLANK_RUN_STOP]}
+        for text in texts
+    ]
+    return engine.generate(prompts, sampling, texts)
+
+
+def load_and_run_stage(stage, texts, instruction, engine=None):
+    # (results, init seconds, seconds); the engine is dropped on return
+    start_init = time.time()
+    engine = engine or create_stage_engine(stage)
+    init_seconds = time.time() - start_init
+    start = time.time()
+    results = run_stage(engine, stage, texts, instruction)
+    return results, init_seconds, time.time() - start
+
+
+def run_stage_in_process(stage, texts, instruction):
+    # vLLM keeps GPU memory and its worker processes after `del engine`, so the next stage's model
+    # would not fit next to it; a spawned process per vLLM stage gives everything back when it exits
+    import cascade  # by name, so the child can unpickle it also when this file runs as __main__
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(cascade.load_and_run_stage, stage, texts, instruction).result()
+
+
+def stage_options(stage):
+    return {key: value for key, value in stage.items() if key not in STAGE_KEYS}
+
+
+def check_stages(stages):
+    # Before any stage runs: a bad option on the last stage would otherwise only fail after the
+    # cheaper stages have spent their time
+    if not stages:
+        raise ValueError("The cascade config has no stages")
+    for number, stage in enumerate(stages):
+        if stage.get("backend") != "mock" and not stage.get("model"):
+            raise ValueError(f"Stage {number} has no model")
+        if not isinstance(stage.get("cost", 1), (int, float)):
+            raise ValueError(f"Stage {number}: cost must be a number, got {stage['cost']!r}")
+        if "batch" in stage:
+            raise ValueError(f"Stage {number}: 'batch' is a benchmark option; every stage already submits its chunks as one batch")
+        unknown = unknown_options(stage.get("backend"), stage_options(stage))
+        if unknown:
+            raise ValueError(f"Stage {number} ({stage['backend']}): unknown engine option(s) {', '.join(unknown)}")
+
+
+def create_stage_engine(stage):
+    return create_engine(stage["backend"], stage.get("model"), **stage_options(stage))
+
+
+def cascade(stages, jobs, instruction, engines=None):
+    """Run every open chunk through the stages in order; returns per-stage statistics.
+
+    engines may hold already loaded engines by stage number; they are taken out, so the caller
+    keeps no reference and each model is freed before the next one loads. vLLM stages always load
+    in a child process (run_stage_in_process).
+
+    A chunk that fails on the last stage keeps the last stage's output (FileJob.output_text still falls
+    back to the input for lost Latin) and is counted as unresolved.
+    """
+    open_items = [(job, index) for job in jobs for index, chunk in enumerate(job.chunks) if job.results[index] is None]
+    engines = engines if engines is not None else {}
+    report = []
+    for number, stage in enumerate(stages):
+        if not open_items:
+            break
+        texts = [job.chunks[index].text for job, index in open_items]
+        if stage["backend"] == "vllm":
+            results, init_seconds, seconds = run_stage_in_process(stage, texts, instruction)
+        else:
+            results, init_seconds, seconds = load_and_run_stage(stage, texts, instruction, engines.pop(number, None))
+        last = number == len(stages) - 1
+        failed = []
+        reasons = collections.Counter()
+        for (job, index), result in zip(open_items, results):
+            reason = validate(job.chunks[index].text, result["text"])
+            if reason is None or last:
+                job.fill(index, dict(result, stage=number, failed=reason))
+            if reason is not None:
+                reasons[reason.split(":")[0]] += 1
+                failed.append((job, index))
+        tokens = sum(result["prompt_tokens"] + result["completion_tokens"] for result in results)
+        report.append({
+            "stage": number,
+            "model": stage.get("model") or stage["backend"],
+            "chunks": len(open_items),
+            "passed": len(open_items) - len(failed),
+            "failed": len(failed),
+            "reasons": dict(reasons),
+            "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+            "completion_tokens": sum(result["completion_tokens"] for result in results),
+            "cost": tokens * stage.get("cost", 1),
+            "init_seconds": init_seconds,
+            "seconds": seconds,
+        })
+        print(f"Stage {number} ({report[-1]['model']}): {len(open_items)} chunks, {len(failed)} failed validation in {seconds:.2f} seconds")
+        open_items = [] if last else failed
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run chunks through a cascade of models, escalating only those that fail validation")
+    parser.add_argument("config", help="JSON cascade config")
+    parser.add_argument("--output-dir", dest="output_dir", default=DEFAULT_OUTPUT_DIR, help="Where outputs and the report are written")
+    parser.add_argument("--output-prefix", dest="output_prefix", default="cascade", help="Prefix for the output files")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    stages = config["stages"]
+    check_stages(stages)
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    with open(os.path.join(base_dir, config.get("prefix_file", "prompt-prefix.txt")), "r", encoding="utf-8") as f:
+        instruction = f.read().strip()
+    documents = load_documents(config, base_dir)
+    if not documents:
+        print("No documents to process.")
+        return
+
+    # Chunk with the first stage's tokenizer; later stages see the same chunks. A first llama_cpp or
+    # mock stage keeps the engine loaded here, a vLLM stage loads in its own process, so only its
+    # tokenizer is needed
+    start_init = time.time()
+    engines = {}
+    if stages[0]["backend"] == "vllm":
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(stages[0]["model"], cache_dir=stages[0].get("download_dir", "/hfcache/hub/"))
+        count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    else:
+        engines[0] = create_stage_engine(stages[0])
+        count_tokens = engines[0].count_tokens
+    first_init_seconds = time.time() - start_init
+    overhead_tokens = count_tokens(format_prompt(SYSTEM_MESSAGE, instruction, "", stages[0].get("model")))
+    budget = min(chunk_budget(config.get("max_model_len", 4096), overhead_tokens, MAX_TOKENS), config.get("chunk_tokens", CHUNK_TOKENS))
+    jobs = []
+    for name, text in documents:
+        masked, latin = mask_latin(text)
+        jobs.append(FileJob(name, chunk_text(masked, count_tokens, budget), latin))
+    del count_tokens  # a bound method would keep the first engine alive
+
+    report = cascade(stages, jobs, instruction, engines)
+    report[0]["init_seconds"] += first_init_seconds
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    prefix = args.output_prefix + "_" if args.output_prefix else ""
+    for job in jobs:
+        write_text(os.path.join(args.output_dir, prefix + job.name), job.output_text())
+
+    chunks = report[0]["chunks"]
+    escalated = report[0]["failed"]
+    unresolved = sum(1 for job in jobs for result in job.results if result.get("failed"))
+    cost = sum(stage["cost"] for stage in report)
+    # What the last model alone would have cost: every chunk at the token count of its first pass
+    single_cost = (report[0]["prompt_tokens"] + report[0]["completion_tokens"]) * stages[-1].get("cost", 1)
+    for stage in report:
+        print(f"  stage {stage['stage']} {stage['model']}: {stage['passed']}/{stage['chunks']} passed, cost {stage['cost']:.0f}" + (f", failures: {stage['reasons']}" if stage["reasons"] else ""))
+    print(f"Escalation rate: {escalated / chunks:.1%} ({escalated} of {chunks} chunks), {unresolved} still failing after the last stage")
+    print(f"Cost: {cost:.0f} vs {single_cost:.0f} for the last model alone ({cost / single_cost:.1%})" if single_cost else f"Cost: {cost:.0f}")
+
+    report_path = os.path.join(args.output_dir, f"{prefix}cascade.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": datetime.datetime.now().isoformat(),
+            "documents": [job.name for job in jobs],
+            "chunks": chunks,
+            "escalation_rate": escalated / chunks if chunks else 0.0,
+            "unresolved": unresolved,
+            "cost": cost,
+            "single_model_cost": single_cost,
+            "stages": report,
+        }, f, indent=2)
+    print(f"Report written to {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import re
+from typing import NamedTuple, Optional
+
+# Paragraphs are separated by blank lines; sentences end in . ! or ? (optionally followed by a
+# closing quote or bracket) and the next one starts with a capital, a quote or a dash.
+# Abbreviations such as "nl." or "Kw. 6°" are followed by lowercase text or digits and don't split.
+PARAGRAPH_BREAK = re.compile(r'(\n\s*\n)')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])([»"\')\]]*)(\s+)(?=[A-ZÀ-Ý«"\'(\[—])')
+
+# Output length relative to the input for a spelling pass, plus room for the odd extra token
+OUTPUT_RATIO = 1.2
+OUTPUT_MARGIN = 64
+
+
+class Unit(NamedTuple):
+    text: str
+    sep: str  # whitespace that followed the unit in the original text
+
+
+class Chunk(NamedTuple):
+    text: str
+    sep: str
+    tokens: int
+    resolved: Optional[str] = None  # output already known without the model (see lexicon.py)
+
+
+def split_units(text):
+    # Split into sentences, keeping the exact whitespace between them so outputs can be stitched
+    units = []
+    parts = PARAGRAPH_BREAK.split(text)
+    for i in range(0, len(parts), 2):
+        paragraph = parts[i]
+        paragraph_sep = parts[i + 1] if i + 1 < len(parts) else ""
+        pieces = SENTENCE_BREAK.split(paragraph)
+        # split() yields sentence, closing punctuation, whitespace, sentence, ...
+        sentence = pieces[0]
+        for j in range(1, len(pieces), 3):
+            units.append(Unit(sentence + pieces[j], pieces[j + 1]))
+            sentence = pieces[j + 2]
+        if sentence or paragraph_sep:
+            units.append(Unit(sentence, paragraph_sep))
+    return units
+
+
+def chunk_budget(max_model_len, overhead_tokens, max_tokens=None):
+    # Largest input chunk whose prompt and expected output both fit in the context window
+    budget = (max_model_len - overhead_tokens - OUTPUT_MARGIN) / (1 + OUTPUT_RATIO)
+    if max_tokens is not None:
+        budget = min(budget, (max_tokens - OUTPUT_MARGIN) / OUTPUT_RATIO)
+    if budget < 1:
+        raise ValueError(f"Prompt overhead of {overhead_tokens} tokens leaves no room in a context of {max_model_len}")
+    return int(budget)
+
+
+def _split_long_unit(unit, count_tokens, budget):
+    # Last resort for a single sentence over budget: cut it on word boundaries
+    words = re.split(r'(\s+)', unit.text)
+    pieces = []
+    current = ""
+    for k in range(0, len(words), 2):
+        word = words[k]
+        space = words[k + 1] if k + 1 < len(words) else ""
+        if current and count_tokens(current + word) > budget:
+            text, trailing = current.rstrip(), current[len(current.rstrip()):]
+            pieces.append(Unit(text, trailing))
+            current = ""
+        current += word + space
+    pieces.append(Unit(current, unit.sep))
+    return pieces
+
+
+def _paragraphs(units):
+    paragraph = []
+    for unit in units:
+        paragraph.append(unit)
+        if "\n" in unit.sep:
+            yield paragraph
+            paragraph = []
+    if paragraph:
+        yield paragraph
+
+
+def build_chunks(units, count_tokens, budget, resolve=None, isolate=None):
+    # Pack whole paragraphs into chunks while they fit, fall back to sentences for paragraphs that
+    # are too large on their own, and to words for sentences that are too large on their own.
+    # resolve(text) may return the output of a unit directly; such a unit becomes a chunk of its
+    # own with tokens=0, breaking the run of units around it. Units for which isolate(text) is true
+    # (recurring sentences, see dedup.py) also get a chunk of their own but still go to the model.
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            text = "".join(u.text + u.sep for u in current[:-1]) + current[-1].text
+            chunks.append(Chunk(text, current[-1].sep, current_tokens))
+        current = []
+        current_tokens = 0
+
+    for paragraph in _paragraphs(units):
+        resolutions = [resolve(u.text) if resolve is not None else None for u in paragraph]
+        sizes = [count_tokens(u.text) if resolved is None else 0 for u, resolved in zip(paragraph, resolutions)]
+        alone = [isolate is not None and resolved is None and isolate(u.text) for u, resolved in zip(paragraph, resolutions)]
+        if current_tokens + sum(sizes) <= budget and all(resolved is None for resolved in resolutions) and not any(alone):
+            current.extend(paragraph)
+            current_tokens += sum(sizes)
+            continue
+        flush()
+        for unit, size, resolved, single in zip(paragraph, sizes, resolutions, alone):
+            if resolved is not None:
+                flush()
+                chunks.append(Chunk(unit.text, unit.sep, 0, resolved))
+                continue
+            if single and size <= budget:
+                flush()
+                chunks.append(Chunk(unit.text, unit.sep, size))
+                continue
+            if size > budget:
+                flush()
+                for piece in _split_long_unit(unit, count_tokens, budget):
+                    current = [piece]
+                    current_tokens = count_tokens(piece.text)
+                    flush()
+                continue
+            if current_tokens + size > budget:
+                flush()
+            current.append(unit)
+            current_tokens += size
+    flush()
+    return chunks
+
+
+def chunk_text(text, count_tokens, budget, resolve=None, isolate=None):
+    return build_chunks(split_units(text), count_tokens, budget, resolve, isolate)
+
+
+def reassemble(chunks, outputs):
+    # Stitch chunk outputs back together with the whitespace that separated the inputs
+    return "".join(output.strip() + chunk.sep for chunk, output in zip(chunks, outputs))
@@ -0,0 +1,90 @@
+# CPU topology for pinning llama_cpp worker processes. One decode stream is bound by memory
+# bandwidth long before it runs out of cores, so a many-core node is used best by several workers,
+# each on its own physical cores within one NUMA node (its memory controller and its slice of L3).
+#
+# Linux only: topology comes from /sys, pinning from os.sched_setaffinity. Elsewhere every CPU is
+# treated as one node and pinning is skipped.
+import glob
+import os
+import re
+
+NODE_DIR = "/sys/devices/system/node"
+CPU_DIR = "/sys/devices/system/cpu"
+
+
+def parse_cpu_list(text):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _read_cpu_list(path):
+    try:
+        with open(path, "r") as f:
+            return parse_cpu_list(f.read())
+    except OSError:
+        return None
+
+
+def available_cpus():
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+
+def physical_cpus(cpus):
+    # First hardware thread of every core; SMT siblings share the core's execution units and add
+    # nothing to matrix-vector throughput
+    kept = []
+    seen = set()
+    for cpu in cpus:
+        siblings = _read_cpu_list(os.path.join(CPU_DIR, f"cpu{cpu}", "topology", "thread_siblings_list")) or [cpu]
+        core = min(siblings)
+        if core not in seen:
+            seen.add(core)
+            kept.append(cpu)
+    return kept
+
+
+def numa_nodes(cpus=None):
+    # Lists of usable CPUs per NUMA node, nodes without usable CPUs left out
+    cpus = set(available_cpus() if cpus is None else cpus)
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(NODE_DIR, "node*", "cpulist")), key=lambda p: int(re.search(r'node(\d+)', p).group(1))):
+        node = [cpu for cpu in _read_cpu_list(path) or [] if cpu in cpus]
+        if node:
+            nodes.append(node)
+    return nodes or [sorted(cpus)]
+
+
+def core_sets(workers, physical=True):
+    """Split the usable CPUs into one core set per worker.
+
+    Workers are spread over the NUMA nodes round-robin and never straddle a node; each node's cores
+    are divided evenly among the workers placed on it. Returns [(node index, [cpus])].
+    """
+    nodes = numa_nodes(physical_cpus(available_cpus()) if physical else None)
+    per_node = [0] * len(nodes)
+    for worker in range(workers):
+        per_node[worker % len(nodes)] += 1
+    sets = []
+    for node_index, (node, count) in enumerate(zip(nodes, per_node)):
+        if count > len(node):
+            raise ValueError(f"{count} workers on NUMA node {node_index} with only {len(node)} cores")
+        size = len(node) // count if count else 0
+        for k in range(count):
+            sets.append((node_index, node[k * size:(k + 1) * size]))
+    # Interleave back into worker order (worker i went to node i % len(nodes))
+    by_node = [[s for s in sets if s[0] == n] for n in range(len(nodes))]
+    return [by_node[worker % len(nodes)][worker // len(nodes)] for worker in range(workers)]
+
+
+def pin(cpus):
+    # Pin the calling process; returns False where the platform can't
+    if not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
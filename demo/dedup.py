@@ -0,0 +1,94 @@
+# Corpus-wide deduplication. Scholastic translations repeat the same formulae and scaffolding
+# across articles, so identical chunks are sent to the model once and the output is fanned out to
+# every occurrence. Sentences that recur often enough are cut out as chunks of their own first, so
+# they can be shared even when the paragraphs around them differ.
+#
+# Latin placeholders ([L<n>], see latin.py) are numbered per file; they are canonicalized for the
+# key and renumbered when an output is copied to another occurrence.
+import unicodedata
+from collections import Counter, OrderedDict
+
+from chunking import OUTPUT_RATIO
+from latin import PLACEHOLDER, PLACEHOLDER_PATTERN
+from result_cache import content_hash
+
+DEDUP_MEMORY = 100000  # completed chunks remembered for later copies
+
+
+def canonical(text):
+    # (key, placeholder numbers in order of appearance)
+    numbers = []
+
+    def number(match):
+        numbers.append(int(match.group(1)))
+        return PLACEHOLDER.format(len(numbers))
+    text = PLACEHOLDER_PATTERN.sub(number, unicodedata.normalize("NFC", text.strip()))
+    return content_hash(text), numbers
+
+
+def renumber(output, source_numbers, target_numbers):
+    # Output of the chunk with source_numbers, rewritten for the occurrence with target_numbers
+    mapping = dict(zip(source_numbers, target_numbers))
+    return PLACEHOLDER_PATTERN.sub(lambda match: PLACEHOLDER.format(mapping.get(int(match.group(1)), int(match.group(1)))), output)
+
+
+def recurring_sentences(texts, count_tokens, overhead_tokens):
+    # Keys of sentences worth a chunk of their own: every occurrence after the first saves reading and
+    # writing the sentence, every occurrence costs one extra prompt for the text around it. texts may
+    # be a stream over the whole corpus; only a 64-bit prefix of each key is kept while counting.
+    counts = Counter()
+    repeated = {}  # key -> tokens, for sentences seen at least twice
+    for text in texts:
+        key = canonical(text)[0]
+        short = int(key[:16], 16)
+        counts[short] += 1
+        if counts[short] == 2:
+            repeated[key] = count_tokens(text)
+    return {
+        key for key, tokens in repeated.items()
+        if (counts[int(key[:16], 16)] - 1) * tokens * (1 + OUTPUT_RATIO) > counts[int(key[:16], 16)] * overhead_tokens
+    }
+
+
+class Deduplicator:
+    """Shares outputs between identical chunks of a stream.
+
+    add() returns None for the first copy of a chunk (the caller runs it and reports back with
+    complete()), WAITING for copies of a chunk that is still running, and a ready result for copies
+    of one completed recently; the most recent `remember` completions are kept.
+    """
+
+    WAITING = object()
+
+    def __init__(self, remember=DEDUP_MEMORY):
+        self.remember = remember
+        self.waiting = {}           # key -> [(placeholder numbers, target)] behind a running chunk
+        self.done = OrderedDict()   # key -> (placeholder numbers, result)
+        self.chunks = 0
+        self.copies = 0
+
+    def add(self, text, target):
+        self.chunks += 1
+        key, numbers = canonical(text)
+        if key in self.done:
+            self.copies += 1
+            self.done.move_to_end(key)
+            source_numbers, result = self.done[key]
+            return dict(result, text=renumber(result["text"], source_numbers, numbers))
+        if key in self.waiting:
+            self.copies += 1
+            self.waiting[key].append((numbers, target))
+            return self.WAITING
+        self.waiting[key] = []
+        return None
+
+    def complete(self, text, result):
+        # [(target, result)] for the copies that were waiting on this chunk
+        key, numbers = canonical(text)
+        self.done[key] = (numbers, result)
+        if len(self.done) > self.remember:
+            self.done.popitem(last=False)
+        return [
+            (target, dict(result, text=renumber(result["text"], numbers, target_numbers)))
+            for target_numbers, target in self.waiting.pop(key, [])
+        ]
@@ -0,0 +1,285 @@
+# Thin wrappers around the inference backends with one calling convention:
+#   engine.generate(prompts, sampling, passages=None) -> [{"text", "prompt_tokens", "completion_tokens"}, ...]
+# where sampling is a list of dicts (temperature, max_tokens, stop) with one entry per prompt and
+# passages optionally gives the bare input text of each prompt (used by input-aligned drafting).
+# engine.generate_traced(prompts, sampling, recorder, passages=None) does the same while streaming
+# tokens, so a latency.TraceRecorder sees every request's first token and inter-token gaps.
+# The llama_cpp engine also stops degenerate generations (runaway.py); its results carry the reason
+# as "runaway" (None when the output is sane).
+# Backends are imported when an engine is created, so importing this module stays cheap.
+import itertools
+import time
+
+
+class StubEngine:
+    """Stand-in for a model, for exercising the service and benchmark code without a GPU.
+
+    Echoes each passage (or prompt, or transform(prompt)) after sleeping delay seconds per batch
+    plus token_seconds per generated token, roughly like a batched decoder would.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay=0.0, token_seconds=0.0, transform=None):
+        self.delay = delay
+        self.token_seconds = token_seconds
+        self.transform = transform or (lambda prompt: prompt)
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, prompts, sampling, passages=None):
+        texts = passages if passages is not None else [self.transform(prompt) for prompt in prompts]
+        texts = [" ".join(text.split(" ")[:params["max_tokens"]]) for text, params in zip(texts, sampling)]
+        longest = max((self.count_tokens(text) for text in texts), default=0)
+        time.sleep(self.delay + self.token_seconds * longest)
+        return [
+            {"text": text, "prompt_tokens": self.count_tokens(prompt), "completion_tokens": self.count_tokens(text)}
+            for prompt, text in zip(prompts, texts)
+        ]
+
+    def generate_traced(self, prompts, sampling, recorder, passages=None):
+        # All prompts of the batch prefill together, then decode one token per step
+        texts = passages if passages is not None else [self.transform(prompt) for prompt in prompts]
+        texts = [" ".join(text.split(" ")[:params["max_tokens"]]) for text, params in zip(texts, sampling)]
+        traces = [recorder.start() for _ in prompts]
+        lengths = [self.count_tokens(text) for text in texts]
+        time.sleep(self.delay)
+        for step in range(max(lengths, default=0)):
+            time.sleep(self.token_seconds)
+            now = time.perf_counter()
+            for trace, length in zip(traces, lengths):
+                if step < length:
+                    trace.tokens(1, now)
+                if step == length - 1:
+                    trace.finish(now)
+        for trace, prompt, length in zip(traces, prompts, lengths):
+            trace.prompt_tokens = self.count_tokens(prompt)
+            if trace.finished is None:
+                trace.finish()
+        return [
+            {"text": text, "prompt_tokens": trace.prompt_tokens, "completion_tokens": length}
+            for trace, text, length in zip(traces, texts, lengths)
+        ]
+
+
+class VllmEngine:
+    name = "vllm"
+
+    def __init__(self, model, download_dir="/hfcache/hub/", **llm_kwargs):
+        from vllm import LLM, SamplingParams
+        self._sampling_params = SamplingParams
+        self.llm = LLM(model=model, download_dir=download_dir, **llm_kwargs)
+        self.tokenizer = self.llm.get_tokenizer()
+        self._request_ids = itertools.count()
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def generate(self, prompts, sampling, passages=None):
+        outputs = self.llm.generate(prompts, [self._sampling_params(**params) for params in sampling])
+        return [
+            {
+                "text": output.outputs[0].text,
+                "prompt_tokens": len(output.prompt_token_ids),
+                "completion_tokens": len(output.outputs[0].token_ids),
+            }
+            for output in outputs
+        ]
+
+    def generate_traced(self, prompts, sampling, recorder, passages=None):
+        # Drive the engine step by step instead of llm.generate, so every new token is seen when it is
+        # produced. Outputs are cumulative: a step can add several tokens when speculation is accepted.
+        engine = self.llm.llm_engine
+        clock_offset = time.time() - time.perf_counter()   # vLLM's request metrics use wall-clock time
+        traces = {}
+        finished = {}
+        order = []
+        for prompt, params in zip(prompts, sampling):
+            request_id = f"traced-{next(self._request_ids)}"
+            traces[request_id] = recorder.start()
+            order.append(request_id)
+            engine.add_request(request_id, prompt, self._sampling_params(**params))
+        while engine.has_unfinished_requests():
+            for output in engine.step():
+                now = time.perf_counter()
+                trace = traces[output.request_id]
+                new_tokens = len(output.outputs[0].token_ids) - len(trace.token_times)
+                if new_tokens > 0:
+                    trace.tokens(new_tokens, now)
+                if output.finished:
+                    trace.finish(now)
+                    trace.prompt_tokens = len(output.prompt_token_ids)
+                    # V0 reports when the scheduler first picked the request up; V1 has no per-request metrics
+                    metrics = getattr(output, "metrics", None)
+                    if metrics is not None and getattr(metrics, "first_scheduled_time", None):
+                        trace.scheduled = metrics.first_scheduled_time - clock_offset
+                    finished[output.request_id] = output
+        return [
+            {
+                "text": finished[request_id].outputs[0].text,
+                "prompt_tokens": len(finished[request_id].prompt_token_ids),
+                "completion_tokens": len(finished[request_id].outputs[0].token_ids),
+            }
+            for request_id in order
+        ]
+
+
+class LlamaCppEngine:
+    name = "llama_cpp"
+
+    def __init__(self, model_path, n_ctx=4096, n_threads=8, n_batch=512, draft_tokens=0, logits_all=False, grammar=False, **llama_kwargs):
+        from llama_cpp import Llama
+        self.draft_model = None
+        self.grammar_stats = None
+        if grammar:
+            from input_grammar import GrammarStats
+            self.grammar_stats = GrammarStats()
+        if draft_tokens:
+            from input_draft import InputAlignedDraftModel
+            self.draft_model = InputAlignedDraftModel(num_pred_tokens=draft_tokens)
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_batch=n_batch,
+            draft_model=self.draft_model,
+            logits_all=logits_all,
+            verbose=False,
+            **llama_kwargs,
+        )
+        from runaway import llama_cpp_whitespace_token_ids
+        self.whitespace_ids = llama_cpp_whitespace_token_ids(self.llm)
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _runaway_detector(self, text):
+        from runaway import RunawayDetector
+        return RunawayDetector(self.count_tokens(text), whitespace_ids=self.whitespace_ids)
+
+    def _constraints(self, passage, detector):
+        # Runaway guard, plus the grammar allowing only the passage with words respelled (input_grammar.py)
+        # and the processor counting its rejections
+        from llama_cpp import StoppingCriteriaList
+        constraints = {"stopping_criteria": StoppingCriteriaList([detector.llama_cpp_stopping_criteria()])}
+        if self.grammar_stats is None or passage is None:
+            return constraints
+        from llama_cpp import LlamaGrammar, LogitsProcessorList
+        from input_grammar import chunk_grammar
+        gbnf, stats = chunk_grammar(passage)
+        self.grammar_stats.add_chunk(stats)
+        return dict(constraints,
+                    grammar=LlamaGrammar.from_string(gbnf, verbose=False),
+                    logits_processor=LogitsProcessorList([self.grammar_stats.logits_processor()]))
+
+    def grammar_report(self):
+        detokenize = lambda token: self.llm.detokenize([token]).decode("utf-8", errors="replace")
+        return self.grammar_stats.report(detokenize) if self.grammar_stats is not None else None
+
+    def generate(self, prompts, sampling, passages=None):
+        # llama_cpp runs one sequence at a time
+        results = []
+        for i, (prompt, params) in enumerate(zip(prompts, sampling)):
+            passage = passages[i] if passages is not None else None
+            detector = self._runaway_detector(passage if passage is not None else prompt)
+            if self.draft_model is not None:
+                self.draft_model.set_input(self.llm.tokenize((passage if passage is not None else prompt).encode("utf-8"), add_bos=False))
+            output = self.llm(
+                prompt=prompt,
+                max_tokens=params["max_tokens"],
+                temperature=params.get("temperature", 0),
+                stop=params.get("stop") or [],
+                **self._constraints(passage, detector),
+            )
+            results.append({
+                "text": output['choices'][0]['text'],
+                "prompt_tokens": output['usage']['prompt_tokens'],
+                "completion_tokens": output['usage']['completion_tokens'],
+                "runaway": detector.reason,
+            })
+        return results
+
+    def generate_traced(self, prompts, sampling, recorder, passages=None):
+        # Streamed completion: one chunk per sampled token, so the first chunk marks the end of prefill
+        results = []
+        for i, (prompt, params) in enumerate(zip(prompts, sampling)):
+            passage = passages[i] if passages is not None else None
+            detector = self._runaway_detector(passage if passage is not None else prompt)
+            if self.draft_model is not None:
+                self.draft_model.set_input(self.llm.tokenize((passage if passage is not None else prompt).encode("utf-8"), add_bos=False))
+                proposed, accepted = self.draft_model.proposed_tokens, self.draft_model.accepted_tokens
+            trace = recorder.start()
+            pieces = []
+            for chunk in self.llm(
+                prompt=prompt,
+                max_tokens=params["max_tokens"],
+                temperature=params.get("temperature", 0),
+                stop=params.get("stop") or [],
+                stream=True,
+                **self._constraints(passage, detector),
+            ):
+                trace.tokens(1)
+                pieces.append(chunk['choices'][0]['text'])
+            trace.finish()
+            # Raw completions are tokenized with BOS and special tokens, as Llama.__call__ does
+            trace.prompt_tokens = len(self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True))
+            if self.draft_model is not None:
+                trace.draft_proposed = self.draft_model.proposed_tokens - proposed
+                trace.draft_accepted = self.draft_model.accepted_tokens - accepted
+            results.append({
+                "text": "".join(pieces),
+                "prompt_tokens": trace.prompt_tokens,
+                "completion_tokens": len(trace.token_times),
+                "runaway": detector.reason,
+            })
+        return results
+
+
+def _vllm_options(options):
+    # Benchmark-style names to vLLM's LLM arguments
+    options = dict(options)
+    draft_tokens = options.pop("draft_tokens", 0)
+    if draft_tokens:
+        options["speculative_config"] = {"method": "ngram", "num_speculative_tokens": draft_tokens, "prompt_lookup_max": 4}
+    if "prefix_caching" in options:
+        options["enable_prefix_caching"] = options.pop("prefix_caching")
+    return options
+
+
+def _named_parameters(function):
+    import inspect
+    return {parameter.name for parameter in inspect.signature(function).parameters.values()
+            if parameter.kind not in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)} - {"self"}
+
+
+def unknown_options(backend, options):
+    # Options the backend would reject, so a config can be checked before any model loads. Imports the
+    # backend; the wrappers' own **kwargs go to Llama / LLM, and LLM's on to EngineArgs. Llama.__init__
+    # also takes **kwargs, but only to warn about and drop what it does not know, so only its named
+    # parameters count.
+    if backend == "mock":
+        return []
+    if backend == "llama_cpp":
+        from llama_cpp import Llama
+        accepted = _named_parameters(Llama.__init__) | _named_parameters(LlamaCppEngine.__init__)
+        return sorted(key for key in options if key not in accepted)
+    if backend == "vllm":
+        import dataclasses
+        from vllm import LLM, EngineArgs
+        accepted = _named_parameters(LLM.__init__) | _named_parameters(VllmEngine.__init__)
+        accepted |= {field.name for field in dataclasses.fields(EngineArgs)}
+        return sorted(key for key in _vllm_options(options) if key not in accepted)
+    raise ValueError(f"Unknown backend '{backend}', expected one of: vllm, llama_cpp, mock")
+
+
+def create_engine(backend, model, **options):
+    # Build an engine from a benchmark cell / command-line style description
+    if backend == "mock":
+        # The mock has no runtime knobs; other options (n_threads, draft_tokens, ...) only label the cell
+        return StubEngine(**{key: options[key] for key in ("delay", "token_seconds") if key in options})
+    if backend == "llama_cpp":
+        return LlamaCppEngine(model, **options)
+    if backend == "vllm":
+        return VllmEngine(model, **_vllm_options(options))
+    raise ValueError(f"Unknown backend '{backend}', expected one of: vllm, llama_cpp, mock")
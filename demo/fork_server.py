@@ -0,0 +1,148 @@
+# Fork server for GGUF models. The parent imports llama_cpp, maps the weights (optionally mlocked),
+# evaluates the shared prompt prefix once and then only waits on a Unix socket; every job is handled
+# by a child forked from it. fork() copies no weights: they are shared page cache, and the context's
+# KV buffers are copied on write, so a job starts in milliseconds with the prefix already in its KV
+# cache, instead of the minutes a fresh process spends importing and loading.
+# CPU only: a CUDA context does not survive fork().
+#
+#   python demo/run.py serve --model ./models/Mistral-7B-Instruct-v0.3-Q4_K_M.gguf [--mlock]
+#   python demo/run.py submit /hfcache/input/a.txt ... [--output-prefix X]
+#
+# Protocol (newline-delimited JSON, one job per connection):
+#   -> {"inputs": ["/hfcache/input/a.txt", ...], "output_dir": "/hfcache/output", "output_prefix": "x"}
+#   <- {"file": "a.txt", "chunks": 2, "seconds": ..., "prompt_tokens": ..., "completion_tokens": ...}   per file
+#   <- {"done": true, "files": 1, "fork_seconds": ..., "first_file_seconds": ..., "seconds": ..., "startup": {...}}
+#   <- {"error": "..."}
+# fork_seconds runs from accepting the connection to the child starting, including any wait for a
+# free job slot.
+import json
+import os
+import socket
+import time
+
+from benchmark import MAX_TOKENS, SYSTEM_MESSAGE
+from chunking import chunk_budget, chunk_text
+from latin import mask_latin
+from pipeline import FileJob, write_text
+from prompting import PASSAGE_SENTINEL, format_prompt, split_passage
+from runaway import BLANK_RUN_STOP
+from scheduling import max_tokens_for
+
+SOCKET_PATH = "/tmp/fork-server.sock"
+DEFAULT_OUTPUT_DIR = "/hfcache/output"
+MAX_JOBS = 1  # children running at once; each uses all of the engine's threads
+
+
+class ForkServer:
+    def __init__(self, engine, model, instruction, n_ctx, phases, max_jobs=MAX_JOBS):
+        self.engine = engine
+        self.model = model
+        self.instruction = instruction
+        self.phases = phases
+        self.max_jobs = max_jobs
+        self.children = set()
+        overhead_tokens = engine.count_tokens(format_prompt(SYSTEM_MESSAGE, instruction, "", model))
+        self.budget = chunk_budget(n_ctx, overhead_tokens, MAX_TOKENS)
+
+    def prefix_text(self):
+        # The prompt text every chunk starts with; its KV state is built once in the parent
+        prompt = format_prompt(SYSTEM_MESSAGE, self.instruction, PASSAGE_SENTINEL, self.model)
+        return prompt[:prompt.index(PASSAGE_SENTINEL)]
+
+    def _reap(self, block=False):
+        while self.children:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            if pid == 0:
+                return
+            self.children.discard(pid)
+            if block:
+                return
+
+    def serve(self, socket_path=SOCKET_PATH):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen()
+        print(f"Fork server ready on {socket_path}")
+        try:
+            while True:
+                connection, _ = server.accept()
+                accepted = time.perf_counter()
+                self._reap()
+                # Further jobs wait in the listen backlog while max_jobs children run
+                while len(self.children) >= self.max_jobs:
+                    self._reap(block=True)
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    status = 0
+                    try:
+                        self.handle(connection, time.perf_counter() - accepted)
+                    except BaseException:
+                        status = 1
+                    finally:
+                        # Skip the parent's atexit handlers and buffered state
+                        os._exit(status)
+                self.children.add(pid)
+                connection.close()
+        finally:
+            server.close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    def handle(self, connection, fork_seconds):
+        # Runs in the child
+        with connection, connection.makefile("rw", encoding="utf-8") as stream:
+            def send(message):
+                stream.write(json.dumps(message) + "\n")
+                stream.flush()
+            try:
+                job = json.loads(stream.readline())
+                output_dir = job.get("output_dir", DEFAULT_OUTPUT_DIR)
+                prefix = job["output_prefix"] + "_" if job.get("output_prefix") else ""
+                os.makedirs(output_dir, exist_ok=True)
+                start = time.perf_counter()
+                first_file_seconds = None
+                for path in job["inputs"]:
+                    file_start = time.perf_counter()
+                    with open(path, "r", encoding="utf-8") as f:
+                        masked, latin = mask_latin(split_passage(f.read().strip())[1])
+                    chunks = chunk_text(masked, self.engine.count_tokens, self.budget)
+                    file_job = FileJob(os.path.basename(path), chunks, latin)
+                    prompts = [format_prompt(SYSTEM_MESSAGE, self.instruction, chunk.text, self.model) for chunk in chunks]
+                    sampling = [{"temperature": 0, "max_tokens": max_tokens_for(chunk.tokens, MAX_TOKENS), "stop": [BLANK_RUN_STOP]} for chunk in chunks]
+                    results = self.engine.generate(prompts, sampling, [chunk.text for chunk in chunks])
+                    if first_file_seconds is None:
+                        first_file_seconds = fork_seconds + time.perf_counter() - start
+                    for index, result in enumerate(results):
+                        file_job.fill(index, result)
+                    write_text(os.path.join(output_dir, prefix + file_job.name), file_job.output_text())
+                    send({
+                        "file": file_job.name,
+                        "chunks": len(chunks),
+                        "seconds": time.perf_counter() - file_start,
+                        "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+                        "completion_tokens": sum(result["completion_tokens"] for result in results),
+                    })
+                send({
+                    "done": True,
+                    "files": len(job["inputs"]),
+                    "fork_seconds": fork_seconds,
+                    "first_file_seconds": first_file_seconds,
+                    "seconds": fork_seconds + time.perf_counter() - start,
+                    "startup": dict(self.phases.phases),
+                })
+            except Exception as e:
+                send({"error": f"{type(e).__name__}: {e}"})
+
+
+def submit(job, socket_path=SOCKET_PATH):
+    # Client side: yields the server's messages for one job
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile("rw", encoding="utf-8") as stream:
+            stream.write(json.dumps(job) + "\n")
+            stream.flush()
+            for line in stream:
+                yield json.loads(line)
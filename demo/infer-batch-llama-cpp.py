@@ -0,0 +1,387 @@
+import argparse
+import datetime
+import multiprocessing
+import os
+import queue
+import re
+import time
+from chunking import chunk_budget, chunk_text
+from cpus import available_cpus, core_sets, physical_cpus, pin
+from latin import mask_latin
+from lexicon import DEFAULT_LEXICON_PATH, Lexicon
+from manifest import Manifest, settings_hash
+from pipeline import FileJob, list_inputs, read_inputs, write_text
+from prompting import format_prompt, get_template, llama_cpp_tokenize, prompt_tokens
+from result_cache import DEFAULT_CACHE_DIR, DEFAULT_SIZE_LIMIT_GB, ResultCache, content_hash
+from runaway import BLANK_RUN_STOP, RunawayDetector, llama_cpp_whitespace_token_ids
+from scheduling import max_tokens_for
+from tuning import load_profile
+
+# Batch mode for the llama_cpp backend: the same inputs, outputs and manifest as infer-batch.py, but
+# served by N CPU worker processes that each load the GGUF file (mmap'd, so the weights sit in the
+# page cache once), run on their own cores and pull documents from a shared queue.
+
+PIN_WORKERS = True
+SPECULATIVE_DECODING = True
+RUNAWAY_GUARD = True
+LEXICON_PREPASS = False
+LATIN_PASSTHROUGH = False
+INPUT_GRAMMAR = False
+THREADS_PER_WORKER = 8
+MAX_TOKENS = 2048
+N_CTX = 4096
+N_BATCH = 512
+DRAFT_TOKENS = 3
+
+def sanitize_filename(s: str, replacement: str = "_") -> str:
+    # Keep letters, numbers, dash, underscore, dot
+    return re.sub(r'[^A-Za-z0-9._-]', replacement, s)
+
+def worker(worker_id, cpus, config, tasks, results):
+    # Runs in its own process: pin, load the model, then process documents until the queue says stop
+    from llama_cpp import Llama, LlamaGrammar, LogitsProcessorList, StoppingCriteriaList
+    from prefix_state import restore_prefix
+    if cpus and config["pin"]:
+        pin(cpus)
+    start_init = time.time()
+    draft_model = None
+    if config["speculative_decoding"] and config["draft_tokens"]:
+        from input_draft import InputAlignedDraftModel
+        draft_model = InputAlignedDraftModel(num_pred_tokens=config["draft_tokens"])
+    threads = len(cpus) or config["n_threads"]
+    llm = Llama(
+        model_path=config["model_path"],
+        n_ctx=config["n_ctx"],
+        n_threads=threads,
+        n_threads_batch=threads,
+        n_batch=config["n_batch"],
+        use_mmap=True,
+        draft_model=draft_model,
+        logits_all=draft_model is not None or config["logits_all"],
+        verbose=False,
+    )
+    system_message = config["system_message"]
+    prefix = config["prefix"]
+    model = config["model"]
+    count_tokens = lambda text: len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+    whitespace_ids = llama_cpp_whitespace_token_ids(llm)
+    # ----
+    # PERFORMANCE IMPROVEMENT: PRE-TOKENIZED PROMPTS
+    # The system message and rules are tokenized once; each request is their token IDs plus the tokens
+    # of its chunk, so llama_cpp gets a token list instead of re-tokenizing the whole prompt
+    prompts = prompt_tokens(system_message, prefix, model, llama_cpp_tokenize(llm))
+    # ------
+    overhead_tokens = len(prompts.ids(""))
+    budget = chunk_budget(config["n_ctx"], overhead_tokens, MAX_TOKENS)
+    # ----
+    # PERFORMANCE IMPROVEMENT: PREFIX STATE
+    # Every worker starts prefill after the shared system message and rules; the first one to get
+    # there saves the state for the others and for later runs
+    prefix_status, prefix_seconds = restore_prefix(llm, prompts.head[:prompts.cut])
+    # ------
+    # Lexicon read-only here: workers can't merge what they learn, infer-batch.py keeps it up to date
+    lexicon = Lexicon(config["lexicon"]) if config["lexicon_prepass"] or config["input_grammar"] else None
+    resolve = lexicon.resolve if config["lexicon_prepass"] else None
+    grammar_stats = None
+    if config["input_grammar"]:
+        from input_grammar import GrammarStats, chunk_grammar
+        grammar_stats = GrammarStats()
+    cache = ResultCache(config["cache_dir"], config["cache_size_gb"]) if config["use_cache"] else None
+    template = get_template(model)
+    init_seconds = time.time() - start_init
+    results.put(("ready", worker_id, {"init_seconds": init_seconds, "prefix": prefix_status, "prefix_seconds": prefix_seconds, "threads": threads}))
+
+    while (name := tasks.get()) is not None:
+        with open(os.path.join(config["input_dir"], name), "r", encoding="utf-8") as f:
+            user_input = f.read().strip()
+        text_hash = content_hash(user_input)
+        # ----
+        # PERFORMANCE IMPROVEMENT: LATIN PASSTHROUGH (overridable via CLI)
+        masked, latin = mask_latin(user_input) if config["latin_passthrough"] else (user_input, [])
+        # ------
+        chunks = chunk_text(masked, count_tokens, budget, resolve)
+        job = FileJob(name, chunks, latin, text_hash)
+        start = time.time()
+        sent = []
+        runaway = []
+        cached = 0
+        for index, chunk in enumerate(chunks):
+            if chunk.resolved is not None:
+                job.fill(index, {"text": chunk.resolved, "prompt_tokens": 0, "completion_tokens": 0, "runaway": None})
+                continue
+            params = {"temperature": 0, "max_tokens": max_tokens_for(chunk.tokens, MAX_TOKENS)}
+            if config["runaway_guard"]:
+                params["stop"] = [BLANK_RUN_STOP]
+            if grammar_stats is not None:
+                params["input_grammar"] = True
+            key = ResultCache.key(model, template, system_message + "\n" + prefix, params, chunk.text) if cache is not None else None
+            result = cache.get(key) if cache is not None else None
+            if result is not None:
+                cached += 1
+                job.fill(index, result)
+                continue
+            sent.append(chunk.text)
+            if draft_model is not None:
+                draft_model.set_input(llm.tokenize(chunk.text.encode("utf-8"), add_bos=False))
+            detector = RunawayDetector(chunk.tokens, whitespace_ids=whitespace_ids)
+            # ----
+            # PERFORMANCE IMPROVEMENT: INPUT-CONSTRAINED GRAMMAR (overridable via CLI)
+            # The output may only be the chunk with words respelled: punctuation, whitespace and Latin
+            # placeholders are forced, so the draft model's copies are accepted and nothing can run on
+            constraints = {}
+            if grammar_stats is not None:
+                gbnf, grammar_chunk = chunk_grammar(chunk.text, lexicon)
+                grammar_stats.add_chunk(grammar_chunk)
+                constraints = {
+                    "grammar": LlamaGrammar.from_string(gbnf, verbose=False),
+                    "logits_processor": LogitsProcessorList([grammar_stats.logits_processor()]),
+                }
+            # ------
+            output = llm(
+                prompt=prompts.ids(chunk.text),
+                max_tokens=params["max_tokens"],
+                temperature=0,
+                stop=params.get("stop") or [],
+                stopping_criteria=StoppingCriteriaList([detector.llama_cpp_stopping_criteria()]) if config["runaway_guard"] else None,
+                **constraints,
+            )
+            result = {
+                "text": output['choices'][0]['text'],
+                "prompt_tokens": output['usage']['prompt_tokens'],
+                "completion_tokens": output['usage']['completion_tokens'],
+                "runaway": detector.reason,
+            }
+            if result["runaway"] is None and output['choices'][0]['finish_reason'] == "length":
+                result["runaway"] = f"stopped at max_tokens ({result['completion_tokens']} tokens)"
+            if result["runaway"]:
+                runaway.append(f"{name} chunk {index + 1}: {result['runaway']}")
+            if cache is not None:
+                cache.set(key, result)
+            job.fill(index, result, fresh=True)
+        seconds = time.time() - start
+        prefix_path = os.path.join(config["output_dir"], config["output_prefix"] + os.path.splitext(name)[0])
+        write_text(prefix_path + "_prompt.txt", "".join(
+            (f"# ---- chunk {n + 1}/{len(sent)} ----\n" if len(sent) > 1 else "") + text + "\n" for n, text in enumerate(sent)
+        ))
+        output_path = os.path.join(config["output_dir"], config["output_prefix"] + name)
+        write_text(output_path, job.output_text())
+        results.put(("file", worker_id, {
+            "name": name,
+            "hash": text_hash,
+            "output": output_path,
+            "chunks": len(chunks),
+            "resolved": sum(1 for chunk in chunks if chunk.resolved is not None),
+            "cached": cached,
+            "prompt_tokens": sum(job.results[i]["prompt_tokens"] for i in job.fresh),
+            "completion_tokens": sum(job.results[i]["completion_tokens"] for i in job.fresh),
+            "seconds": seconds,
+            "runaway": runaway,
+        }))
+    if cache is not None:
+        cache.close()
+    detokenize = lambda token: llm.detokenize([token]).decode("utf-8", errors="replace")
+    results.put(("done", worker_id, {
+        "draft": draft_model.report() if draft_model is not None else None,
+        "grammar": grammar_stats.state(detokenize) if grammar_stats is not None else None,
+    }))
+
+
+def main():
+    # Configuration
+    # Assumes script is run from project root where ./models exists
+    model_path = f"./models/Mistral-7B-Instruct-v0.3-Q4_K_M.gguf"
+    input_dir = "/hfcache/input"
+    output_dir = "/hfcache/output"
+    os.makedirs(output_dir, exist_ok=True)
+    # Command-line arguments to override hardcoded switches
+    parser = argparse.ArgumentParser(description="Batch inference runner for llama_cpp with a pool of pinned CPU workers")
+    parser.add_argument("--model-path", dest="model_path", type=str, default=model_path, help="GGUF model file")
+    parser.add_argument("--workers", dest="workers", type=int, default=None, help=f"Worker processes (default: physical cores / {THREADS_PER_WORKER})")
+    parser.add_argument("--n-ctx", dest="n_ctx", type=int, default=None, help=f"Context length per worker; chunks are sized to fit it (default: tuned profile or {N_CTX})")
+
+    parser.add_argument("--pin-workers", dest="pin", action="store_true", help="Pin every worker to its own physical cores within one NUMA node")
+    parser.add_argument("--no-pin-workers", dest="pin", action="store_false", help="Let the OS scheduler place the workers")
+    parser.set_defaults(pin=PIN_WORKERS)
+
+    parser.add_argument("--speculative-decoding", dest="speculative_decoding", action="store_true", help="Draft tokens from the input passage")
+    parser.add_argument("--no-speculative-decoding", dest="speculative_decoding", action="store_false", help="Decode without a draft model")
+    parser.set_defaults(speculative_decoding=SPECULATIVE_DECODING)
+
+    parser.add_argument("--runaway-guard", dest="runaway_guard", action="store_true", help="Stop generations that loop or run far past the input length")
+    parser.add_argument("--no-runaway-guard", dest="runaway_guard", action="store_false", help="Let every generation run until EOS or max_tokens")
+    parser.set_defaults(runaway_guard=RUNAWAY_GUARD)
+
+    parser.add_argument("--lexicon-prepass", dest="lexicon_prepass", action="store_true", help="Rewrite sentences the spelling lexicon fully resolves without the model")
+    parser.add_argument("--no-lexicon-prepass", dest="lexicon_prepass", action="store_false", help="Send every sentence to the model")
+    parser.set_defaults(lexicon_prepass=LEXICON_PREPASS)
+    parser.add_argument("--lexicon", dest="lexicon", type=str, default=DEFAULT_LEXICON_PATH, help="Spelling lexicon file (read only in this script)")
+
+    parser.add_argument("--latin-passthrough", dest="latin_passthrough", action="store_true", help="Replace Latin passages by placeholders before prompting and restore them afterwards")
+    parser.add_argument("--no-latin-passthrough", dest="latin_passthrough", action="store_false", help="Send Latin passages to the model like any other text")
+    parser.set_defaults(latin_passthrough=LATIN_PASSTHROUGH)
+
+    parser.add_argument("--input-grammar", dest="input_grammar", action="store_true", help="Constrain decoding to the input chunk with words respelled (original or spelling variants)")
+    parser.add_argument("--no-input-grammar", dest="input_grammar", action="store_false", help="Let the model generate freely")
+    parser.set_defaults(input_grammar=INPUT_GRAMMAR)
+
+    parser.add_argument("--output-prefix", dest="output_prefix", type=str, default=None, help="Prefix for the output files in the output directory")
+    parser.add_argument("--resume", dest="resume", action="store_true", help="Skip input files the run manifest records as done with unchanged contents and settings")
+
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Directory of the persistent result cache")
+    parser.add_argument("--cache-size-gb", dest="cache_size_gb", type=float, default=DEFAULT_SIZE_LIMIT_GB, help="Evict least recently used results beyond this size")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="Always run inference, ignoring and not updating the result cache")
+
+    args = parser.parse_args()
+
+    # If an output prefix is provided, use it
+    output_prefix = ""
+    if args.output_prefix:
+        output_prefix = sanitize_filename(args.output_prefix) + "_"
+    model = os.path.basename(args.model_path)
+    # ----
+    # PERFORMANCE IMPROVEMENT: TUNED PARAMETERS
+    # Use what tuning.py found fastest on this machine for this model, if it was tuned here. Pinned
+    # workers size their thread pool to their core set instead of the tuned n_threads.
+    tuned = load_profile(args.model_path)
+    if tuned:
+        print(f"Using tuned parameters: {tuned}")
+    args.n_ctx = args.n_ctx or tuned.get("n_ctx", N_CTX)
+    # ------
+
+    # Read prefix
+    prefix_file = os.path.join(os.path.dirname(__file__), '..', 'prompt-prefix.txt')
+    if not os.path.exists(prefix_file):
+        print(f"Error: '{prefix_file}' not found.")
+        return
+    with open(prefix_file, "r", encoding="utf-8") as f:
+        prefix = f.read().strip()
+
+    # Get list of txt files
+    if not os.path.exists(input_dir):
+        print(f"Error: '{input_dir}' not found.")
+        return
+    txt_files = list_inputs(input_dir)
+    if not txt_files:
+        print(f"No .txt files found in '{input_dir}'.")
+        return
+
+    system_message = "Je bent een tekstredacteur."
+    settings = settings_hash(model=model, prompt=system_message + "\n" + prefix, max_tokens=MAX_TOKENS, n_ctx=args.n_ctx,
+                             runaway_guard=args.runaway_guard, lexicon_prepass=args.lexicon_prepass,
+                             latin_passthrough=args.latin_passthrough, input_grammar=args.input_grammar)
+    manifest = Manifest(os.path.join(output_dir, f"{output_prefix}_manifest.jsonl"), settings, args.resume)
+    todo = []
+    skipped = 0
+    for txt_file, user_input in read_inputs(input_dir, txt_files):
+        if manifest.status(txt_file, content_hash(user_input)) == "done":
+            skipped += 1
+        else:
+            todo.append(txt_file)
+    if args.resume:
+        print(f"Resume: skipped {skipped} files already done")
+    if not todo:
+        print("Nothing left to process.")
+        manifest.close()
+        return
+    write_text(os.path.join(output_dir, f"{output_prefix}_prompt_template.txt"), format_prompt(system_message, prefix, "{input}", model))
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: CPU WORKER POOL (overridable via CLI)
+    # Workers never straddle a NUMA node and never share a physical core; the weights are mmap'd,
+    # so every worker after the first maps the same page-cache pages instead of loading a copy.
+    workers = args.workers or max(1, len(physical_cpus(available_cpus())) // THREADS_PER_WORKER)
+    workers = min(workers, len(todo))
+    placement = core_sets(workers) if args.pin else [(None, [])] * workers
+    # ------
+    config = {
+        "model_path": args.model_path, "model": model, "n_ctx": args.n_ctx, "pin": args.pin,
+        "n_threads": tuned.get("n_threads", THREADS_PER_WORKER), "n_batch": tuned.get("n_batch", N_BATCH),
+        "draft_tokens": tuned.get("draft_tokens", DRAFT_TOKENS), "logits_all": tuned.get("logits_all", False),
+        "speculative_decoding": args.speculative_decoding, "runaway_guard": args.runaway_guard,
+        "lexicon_prepass": args.lexicon_prepass, "lexicon": args.lexicon, "latin_passthrough": args.latin_passthrough,
+        "input_grammar": args.input_grammar,
+        "use_cache": args.use_cache, "cache_dir": args.cache_dir, "cache_size_gb": args.cache_size_gb,
+        "system_message": system_message, "prefix": prefix,
+        "input_dir": input_dir, "output_dir": output_dir, "output_prefix": output_prefix,
+    }
+    # Spawned, not forked: every worker gets a clean llama.cpp runtime and its own threads
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue()
+    for txt_file in todo:
+        tasks.put(txt_file)
+    for _ in range(workers):
+        tasks.put(None)
+    start_init = time.time()
+    processes = [context.Process(target=worker, args=(i, cpus, config, tasks, results), name=f"llama-worker-{i}") for i, (_, cpus) in enumerate(placement)]
+    for process in processes:
+        process.start()
+
+    per_worker = [{"files": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0, "draft": None} for _ in range(workers)]
+    totals = {"files": 0, "chunks": 0, "resolved": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "runaway": 0}
+    grammar_stats = None
+    if args.input_grammar:
+        from input_grammar import GrammarStats
+        grammar_stats = GrammarStats()
+    init_seconds = 0
+    start_infer = None
+    running = workers
+    while running:
+        try:
+            kind, worker_id, message = results.get(timeout=5)
+        except queue.Empty:
+            dead = [p.name for p in processes if p.exitcode not in (None, 0)]
+            if dead:
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError(f"Worker(s) {', '.join(dead)} died; the manifest keeps the files finished so far, rerun with --resume")
+            continue
+        if kind == "ready":
+            node, cpus = placement[worker_id]
+            where = f"NUMA node {node}, cores {cpus}" if cpus else "unpinned"
+            print(f"Worker {worker_id} ({where}, {message['threads']} threads) ready in {message['init_seconds']:.2f} seconds, prefix state {message['prefix']} in {message['prefix_seconds']:.2f} seconds")
+            # Inference starts with the first worker; the others join as they come up
+            if start_infer is None:
+                start_infer = time.time()
+                init_seconds = start_infer - start_init
+        elif kind == "file":
+            stats = per_worker[worker_id]
+            stats["files"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "seconds"):
+                stats[key] += message[key]
+            for key in ("chunks", "resolved", "cached", "prompt_tokens", "completion_tokens"):
+                totals[key] += message[key]
+            totals["files"] += 1
+            totals["runaway"] += len(message["runaway"])
+            for line in message["runaway"]:
+                print(f"Runaway output in {line}")
+            manifest.record(message["name"], message["hash"], message["output"], message["prompt_tokens"], message["completion_tokens"])
+            print(f"Token Usage for {message['name']} (worker {worker_id}, {message['chunks']} chunks, {message['resolved']} by lexicon, {message['cached']} cached): Prompt: {message['prompt_tokens']}, Completion: {message['completion_tokens']}, Total: {message['prompt_tokens'] + message['completion_tokens']}")
+            print(f"Success! Output written to {message['output']}")
+        else:
+            per_worker[worker_id]["draft"] = message["draft"]
+            if message["grammar"] is not None:
+                grammar_stats.merge(message["grammar"])
+            running -= 1
+    for process in processes:
+        process.join()
+    total_infer_seconds = time.time() - start_infer if start_infer is not None else 0
+    manifest.close()
+
+    for worker_id, stats in enumerate(per_worker):
+        rate = stats["completion_tokens"] / stats["seconds"] if stats["seconds"] else 0
+        print(f"Worker {worker_id}: {stats['files']} files, {stats['completion_tokens']} completion tokens in {stats['seconds']:.2f} seconds ({rate:.1f} tok/s)" + (f", {stats['draft']}" if stats["draft"] else ""))
+    rate = totals["completion_tokens"] / total_infer_seconds if total_infer_seconds else 0
+    print(f"Processed {totals['files']} files in {totals['chunks']} chunks on {workers} workers: {totals['completion_tokens']} completion tokens in {total_infer_seconds:.2f} seconds ({rate:.1f} tok/s overall)")
+    if grammar_stats is not None:
+        from input_grammar import format_report
+        print(f"Input grammar: {format_report(grammar_stats.report())}")
+
+    log_file_path = os.path.join(output_dir, f"{output_prefix}_inference_log.txt")
+    with open(log_file_path, "w", encoding="utf-8") as log_file:
+        # Log summary, same columns as infer-batch.py; warmup is part of the worker init here
+        cache_misses = totals["chunks"] - totals["resolved"] - totals["cached"]
+        log_file.write(f"{datetime.datetime.now()},{model},CPU,{init_seconds:.2f},0.00,{total_infer_seconds:.2f},{totals['prompt_tokens']},{totals['completion_tokens']},BACKEND=llama_cpp;WORKERS={workers};PIN_WORKERS={args.pin};SPECULATIVE_DECODING={args.speculative_decoding};RUNAWAY_GUARD={args.runaway_guard};LEXICON_PREPASS={args.lexicon_prepass};LATIN_PASSTHROUGH={args.latin_passthrough};INPUT_GRAMMAR={args.input_grammar},{totals['cached']},{cache_misses},{totals['runaway']}\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,37 @@
 import argparse
 import datetime
+import itertools
 import os
 import time
-import torch
-from vllm import LLM, SamplingParams
 import re
+from chunking import chunk_budget, chunk_text, split_units
+from dedup import Deduplicator, canonical, recurring_sentences
+from latin import mask_latin
+from lexicon import DEFAULT_LEXICON_PATH, Lexicon
+from manifest import Manifest, settings_hash
+from pipeline import FileJob, Writer, list_inputs, read_inputs, write_text
+from prompting import format_prompt, get_template, hf_tokenize, prompt_tokens
+from result_cache import DEFAULT_CACHE_DIR, DEFAULT_SIZE_LIMIT_GB, ResultCache, content_hash
+from runaway import BLANK_RUN_STOP, RunawayDetector, hf_whitespace_token_ids
+from scheduling import max_tokens_for, windowed_length_order
+from startup import Phases
 
 PREFIX_CACHING = False
 CONTINUOUS_BATCHING = True
 SPECULATIVE_DECODING = False
+RUNAWAY_GUARD = True
+LEXICON_PREPASS = False
+LATIN_PASSTHROUGH = False
+DEDUP = False
+MAX_TOKENS = 2048
+MAX_MODEL_LEN = 8192
+MAX_IN_FLIGHT = 256     # requests handed to the engine at once (vLLM's default max_num_seqs)
+SCHEDULE_WINDOW = 1024  # chunks sorted by length together
 
 def sanitize_filename(s: str, replacement: str = "_") -> str:
     # Keep letters, numbers, dash, underscore, dot
     return re.sub(r'[^A-Za-z0-9._-]', replacement, s)
 
-def format_prompt(system_message, instruction, input_text, model_name):
-    templates = {
-        "Qwen/Qwen2.5-32B-Instruct-AWQ": """<|im_start|>system
-{system}
-<|im_end|>
-<|im_start|>user
-{instruction}
-
-{input}
-<|im_end|>
-<|im_start|>assistant
-""",
-        "unsloth/gemma-3-27b-it-bnb-4bit": """<start_of_turn>user
-{system}
-{instruction}
-
-{input}
-<end_of_turn>
-<start_of_turn>model
-""",
-    }
-    if model_name in templates:
-        template = templates[model_name]
-        return template.format(system=system_message, instruction=instruction, input=input_text)
-    else:
-        # Default to old Mistral style
-        return f"[INST] {system_message}\n\n{instruction}\n\n{input_text} [/INST]"
-
-
 def main():
     # Configuration
     #model = "mistralai/Mistral-7B-Instruct-v0.3"
@@ -68,10 +57,49 @@ def main():
     parser.add_argument("--speculative-encoding", dest="speculative_decoding", action="store_true", help=argparse.SUPPRESS)
     parser.set_defaults(speculative_decoding=SPECULATIVE_DECODING)
 
+    parser.add_argument("--runaway-guard", dest="runaway_guard", action="store_true", help="Stop generations that loop or run far past the input length")
+    parser.add_argument("--no-runaway-guard", dest="runaway_guard", action="store_false", help="Let every generation run until EOS or max_tokens")
+    parser.set_defaults(runaway_guard=RUNAWAY_GUARD)
+
+    parser.add_argument("--lexicon-prepass", dest="lexicon_prepass", action="store_true", help="Rewrite sentences the spelling lexicon fully resolves without the model")
+    parser.add_argument("--no-lexicon-prepass", dest="lexicon_prepass", action="store_false", help="Send every sentence to the model")
+    parser.set_defaults(lexicon_prepass=LEXICON_PREPASS)
+    parser.add_argument("--lexicon", dest="lexicon", type=str, default=DEFAULT_LEXICON_PATH, help="Spelling lexicon file, updated with the outputs of this run")
+
+    parser.add_argument("--latin-passthrough", dest="latin_passthrough", action="store_true", help="Replace Latin passages by placeholders before prompting and restore them afterwards")
+    parser.add_argument("--no-latin-passthrough", dest="latin_passthrough", action="store_false", help="Send Latin passages to the model like any other text")
+    parser.set_defaults(latin_passthrough=LATIN_PASSTHROUGH)
+
+    parser.add_argument("--dedup", dest="dedup", action="store_true", help="Run identical chunks across all input files once and share the output")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false", help="Run every chunk, even repeated ones")
+    parser.set_defaults(dedup=DEDUP)
+
     parser.add_argument("--output-prefix", dest="output_prefix", type=str, default=None, help="Write outputs to a subdirectory under the output directory")
+    parser.add_argument("--max-model-len", dest="max_model_len", type=int, default=MAX_MODEL_LEN, help="Context length to reserve per sequence; chunks are sized to fit it")
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", type=int, default=None, help="Maximum input tokens per chunk (default: derived from the model's context length)")
+
+    parser.add_argument("--max-in-flight", dest="max_in_flight", type=int, default=MAX_IN_FLIGHT, help="Requests handed to the engine at once with continuous batching")
+    parser.add_argument("--schedule-window", dest="schedule_window", type=int, default=SCHEDULE_WINDOW, help="Chunks read ahead and sorted longest first before they are admitted")
+
+    parser.add_argument("--resume", dest="resume", action="store_true", help="Skip input files the run manifest records as done with unchanged contents and settings")
+
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Directory of the persistent result cache")
+    parser.add_argument("--cache-size-gb", dest="cache_size_gb", type=float, default=DEFAULT_SIZE_LIMIT_GB, help="Evict least recently used results beyond this size")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="Always run inference, ignoring and not updating the result cache")
 
     args = parser.parse_args()
 
+    # ----
+    # PERFORMANCE IMPROVEMENT: LAZY BACKEND IMPORTS
+    # torch, transformers and vllm take many seconds to import; they are imported once the arguments
+    # are valid, so --help and usage errors return at once, and the time shows up in the start-up report
+    phases = Phases("infer-batch")
+    with phases.phase("import backend"):
+        import torch
+        from transformers import AutoTokenizer
+        from vllm import LLM, SamplingParams, envs
+    # ------
+
     # If an output prefix is provided, use it
     output_prefix = ""
     if args.output_prefix:
@@ -93,105 +121,311 @@ def main():
         print(f"Error: '{input_dir}' not found.")
         return
     
-    txt_files = [f for f in os.listdir(input_dir) if f.endswith('.txt')]
+    txt_files = list_inputs(input_dir)
     if not txt_files:
         print(f"No .txt files found in '{input_dir}'.")
         return
     
-    # 1. Initialize the Model
-    start_init = time.time()
-    
+    # Split long inputs into chunks that fit the context window, measured with the model's own tokenizer.
+    # The tokenizer loads in seconds, so chunking and cache lookups happen before the engine is started.
+    with phases.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(model, cache_dir="/hfcache/hub/")
+    count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    # Runs of these need not be periodic to be a blank-line loop
+    whitespace_ids = hf_whitespace_token_ids(tokenizer)
+    system_message = "Je bent een tekstredacteur."
+    overhead_tokens = count_tokens(format_prompt(system_message, prefix, "", model))
     # ----
-    # PERFORMANCE IMPROVEMENT: PREFIX CACHING (overridable via CLI)
-    enable_prefix_caching = bool(args.prefix_caching)
+    # PERFORMANCE IMPROVEMENT: PRE-TOKENIZED PROMPTS
+    # The system message and rules are tokenized once; each request is their token IDs plus the tokens
+    # of its chunk, handed to the engine as a token prompt so vLLM skips tokenizing the whole prompt
+    prompts = prompt_tokens(system_message, prefix, model, hf_tokenize(tokenizer))
+    print(f"Prompt prefix: {len(prompts.prefix_ids)} tokens tokenized once")
+    # ------
+    budget = chunk_budget(args.max_model_len, overhead_tokens, MAX_TOKENS)
+    if args.chunk_tokens:
+        budget = min(budget, args.chunk_tokens)
+    print(f"Chunk budget: {budget} tokens (context {args.max_model_len}, prompt overhead {overhead_tokens})")
     # ----
-    # PERFORMANCE IMPROVEMENT: SPECULATIVE DECODING (overridable via CLI)
-    if args.speculative_decoding:
-        speculative_config = {
-            "method": "ngram",
-            "num_speculative_tokens": 5,
-            "prompt_lookup_max": 4,
-        }
-    else:
-        speculative_config = None
+    # PERFORMANCE IMPROVEMENT: LEXICON PRE-PASS (overridable via CLI)
+    # Sentences whose every word the lexicon and spelling rules can handle are rewritten here and never
+    # become prompts; only sentences with unknown archaic-looking words go to the model.
+    lexicon = Lexicon(args.lexicon) if args.lexicon_prepass else None
+    resolve = lexicon.resolve if lexicon is not None else None
     # ------
-    llm = LLM(model=model, download_dir="/hfcache/hub/", enable_prefix_caching=enable_prefix_caching, speculative_config=speculative_config)
-    end_init = time.time()
-    init_seconds = end_init - start_init
-    
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: RESUMABLE RUNS (overridable via CLI)
+    # Every finished file is recorded in a manifest as soon as its output is written; with --resume,
+    # files recorded with the same contents and settings are skipped, so an interrupted run or a grown
+    # corpus only costs the remaining or changed files.
+    settings = settings_hash(model=model, prompt=system_message + "\n" + prefix, max_tokens=MAX_TOKENS, max_model_len=args.max_model_len,
+                             chunk_tokens=args.chunk_tokens, runaway_guard=args.runaway_guard, lexicon_prepass=args.lexicon_prepass,
+                             latin_passthrough=args.latin_passthrough)
+    manifest = Manifest(os.path.join(output_dir, f"{output_prefix}_manifest.jsonl"), settings, args.resume)
+    # ------
+
+    def masked_inputs():
+        # (name, text, Latin originals, input hash, manifest status) per input file
+        for txt_file, user_input in read_inputs(input_dir, txt_files):
+            text_hash = content_hash(user_input)
+            status = manifest.status(txt_file, text_hash)
+            # ----
+            # PERFORMANCE IMPROVEMENT: LATIN PASSTHROUGH (overridable via CLI)
+            # Latin stays unchanged anyway, so the model neither reads nor re-types it
+            masked, latin = mask_latin(user_input) if args.latin_passthrough and status != "done" else (user_input, [])
+            # ------
+            yield txt_file, masked, latin, text_hash, status
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: CORPUS-WIDE DEDUP (overridable via CLI)
+    # Sentences that recur across the corpus often enough to pay for an extra prompt get a chunk of
+    # their own (one streaming pass over the corpus), and identical chunks are run once below
+    isolate = None
+    dedup = Deduplicator() if args.dedup else None
+    if args.dedup:
+        recurring = recurring_sentences((unit.text for _, text, _, _, status in masked_inputs() if status != "done" for unit in split_units(text)), count_tokens, overhead_tokens)
+        isolate = lambda text: canonical(text)[0] in recurring
+        print(f"Dedup: {len(recurring)} recurring sentences get chunks of their own")
+    # ------
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: RESULT CACHE (overridable via CLI)
+    # Chunks that were already processed with the same model, template, prefix and sampling
+    # parameters are served from disk and never reach the engine.
+    cache = ResultCache(args.cache_dir, args.cache_size_gb) if args.use_cache else None
+    template = get_template(model)
+    # ------
+
+    def chunk_sampling(chunk):
+        # ----
+        # PERFORMANCE IMPROVEMENT: LENGTH-PROPORTIONAL MAX_TOKENS
+        # The output of a spelling pass is about as long as its input, so each chunk gets its own limit
+        params = {"temperature": 0, "max_tokens": max_tokens_for(chunk.tokens, MAX_TOKENS)}
+        if args.runaway_guard:
+            params["stop"] = [BLANK_RUN_STOP]
+        return params
+        # ------
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: STREAMING PIPELINE
+    # Files are read, chunked and prompted lazily, fed to the engine as slots free up, and every file is
+    # written by a background thread as soon as its last chunk is done, so memory stays flat however large
+    # the corpus is and finished outputs are on disk while the rest is still generating. The prompt
+    # template is written once; the per-file _prompt.txt holds only the chunks sent to the model.
+    writer = Writer()
+    template_path = os.path.join(output_dir, f"{output_prefix}_prompt_template.txt")
+    writer.submit(write_text, template_path, format_prompt(system_message, prefix, "{input}", model))
+    stats = {"files": 0, "skipped": 0, "changed": 0, "chunks": 0, "resolved": 0, "cached": 0, "latin": 0, "latin_tokens": 0,
+             "prompt_tokens": 0, "completion_tokens": 0, "runaway": 0, "shared_completion_tokens": 0}
+
+    def finish_file(job):
+        # Runs on the writer thread
+        prompt_tokens = sum(job.results[i]["prompt_tokens"] for i in job.fresh)
+        completion_tokens = sum(job.results[i]["completion_tokens"] for i in job.fresh)
+        resolved = sum(1 for chunk in job.chunks if chunk.resolved is not None)
+        for chunk_index, result in enumerate(job.results):
+            if result.get("runaway"):
+                stats["runaway"] += 1
+                print(f"Runaway output in {job.name} chunk {chunk_index + 1}: {result['runaway']}")
+        print(f"Token Usage for {job.name} ({len(job.chunks)} chunks, {resolved} by lexicon, {len(job.chunks) - resolved - len(job.fresh)} cached or shared): Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {prompt_tokens + completion_tokens}")
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        # 4. Write to file (prefix filename if requested)
+        output_path = os.path.join(output_dir, output_prefix + job.name)  # Use input filename for output
+        write_text(output_path, job.output_text())
+        manifest.record(job.name, job.source_hash, output_path, prompt_tokens, completion_tokens)
+        print(f"Success! Output written to {output_path}")
+
+    def model_chunks():
+        # Reader and prompt builder: yields (job, chunk index, prompt, sampling, cache key) for every chunk
+        # that needs the model; resolved and cached chunks are filled in on the way
+        for txt_file, user_input, latin, text_hash, status in masked_inputs():
+            if status == "done":
+                stats["skipped"] += 1
+                continue
+            if status == "changed":
+                stats["changed"] += 1
+            chunks = chunk_text(user_input, count_tokens, budget, resolve, isolate)
+            job = FileJob(txt_file, chunks, latin, text_hash)
+            stats["files"] += 1
+            stats["chunks"] += len(chunks)
+            stats["latin"] += len(latin)
+            stats["latin_tokens"] += sum(count_tokens(span) for span in latin)
+            todo = []
+            for index, chunk in enumerate(chunks):
+                if chunk.resolved is not None:
+                    stats["resolved"] += 1
+                    job.fill(index, {"text": chunk.resolved, "prompt_tokens": 0, "completion_tokens": 0, "runaway": None})
+                    continue
+                params = chunk_sampling(chunk)
+                key = ResultCache.key(model, template, system_message + "\n" + prefix, params, chunk.text) if cache is not None else None
+                cached = cache.get(key) if cache is not None else None
+                if cached is not None:
+                    stats["cached"] += 1
+                    job.fill(index, cached)
+                    continue
+                todo.append((job, index, {"prompt_token_ids": prompts.ids(chunk.text)}, params, key))
+            # 2. Format Prompt (chunks resolved by the lexicon or the cache get none)
+            prompt_path = os.path.join(output_dir, output_prefix + os.path.splitext(txt_file)[0] + "_prompt.txt")
+            writer.submit(write_text, prompt_path, "".join(
+                (f"# ---- chunk {n + 1}/{len(todo)} ----\n" if len(todo) > 1 else "") + chunks[index].text + "\n"
+                for n, (_, index, _, _, _) in enumerate(todo)
+            ))
+            if job.remaining == 0:
+                writer.submit(finish_file, job)
+            yield from todo
+    # ------
+
+    def share(job, index, key, result):
+        # Output of an identical chunk, fanned out to this occurrence
+        stats["shared_completion_tokens"] += result["completion_tokens"]
+        if cache is not None:
+            cache.set(key, result)
+        if job.fill(index, result):
+            writer.submit(finish_file, job)
+
+    llm = None
+    init_seconds = 0
     warmup_duration = 0  # Initialize warmup duration
-    # Warm-up inference
-    warmup_prompt = "Warm-up request"
-    warmup_sampling_params = SamplingParams(temperature=0, max_tokens=1)
-    warmup_start = time.time()
-    llm.generate([warmup_prompt], warmup_sampling_params)
-    warmup_end = time.time()
-    warmup_duration = warmup_end - warmup_start
-    
-    # For each input file
-    all_prompts = []
-    all_txt_files = []
-    for txt_file in txt_files:
-        full_path = os.path.join(input_dir, txt_file)
-        with open(full_path, "r", encoding="utf-8") as f:
-            user_input = f.read().strip()
-        
-        # 2. Format Prompt
-        system_message = "Je bent een tekstredacteur."
-        prompt_text = format_prompt(system_message, prefix, user_input, model)
+    total_infer_seconds = 0
+
+    def start_engine():
+        nonlocal init_seconds, warmup_duration
+        # 1. Initialize the Model
+        start_init = time.time()
         
-        # Write prompt to file (prefix filename if requested)
-        prompt_basename = output_prefix + os.path.splitext(txt_file)[0] + "_prompt.txt"
-        prompt_path = os.path.join(output_dir, prompt_basename)
-        with open(prompt_path, "w", encoding="utf-8") as f:
-            f.write(prompt_text)
+        # ----
+        # PERFORMANCE IMPROVEMENT: PREFIX CACHING (overridable via CLI)
+        enable_prefix_caching = bool(args.prefix_caching)
+        # ----
+        # PERFORMANCE IMPROVEMENT: SPECULATIVE DECODING (overridable via CLI)
+        if args.speculative_decoding:
+            speculative_config = {
+                "method": "ngram",
+                "num_speculative_tokens": 5,
+                "prompt_lookup_max": 4,
+            }
+        else:
+            speculative_config = None
+        # ------
+        engine = LLM(model=model, download_dir="/hfcache/hub/", max_model_len=args.max_model_len, enable_prefix_caching=enable_prefix_caching, speculative_config=speculative_config)
+        end_init = time.time()
+        init_seconds = end_init - start_init
         
-        all_prompts.append(prompt_text)
-        all_txt_files.append(txt_file)
-    
+        # Warm-up inference
+        warmup_prompt = "Warm-up request"
+        warmup_sampling_params = SamplingParams(temperature=0, max_tokens=1)
+        warmup_start = time.time()
+        engine.generate([warmup_prompt], warmup_sampling_params)
+        warmup_end = time.time()
+        warmup_duration = warmup_end - warmup_start
+        print(f"Model initialized in {init_seconds:.2f} seconds, warmed up in {warmup_duration:.2f} seconds")
+        phases.add("load weights", init_seconds)
+        phases.add("warm-up", warmup_duration)
+        phases.report(model=model, backend="vllm", gpu=gpu_model, prefix_caching=enable_prefix_caching)
+        return engine
+
     # 3. Run Inference
-    print("Running inference...")
-    sampling_params = SamplingParams(temperature=0, max_tokens=2048)
-    start_infer = time.time()
     # ----
     # PERFORMANCE IMPROVEMENT: CONTINUOUS BATCHING (overridable via CLI)
-    if args.continuous_batching:
-        outputs = llm.generate(all_prompts, sampling_params)
-    else:
-        outputs = []
-        for prompt in all_prompts:
-            output = llm.generate([prompt], sampling_params)
-            outputs.append(output[0])
+    # The engine is fed request by request and stepped; with continuous batching up to --max-in-flight
+    # requests share the batch, without it they run one at a time.
+    max_in_flight = args.max_in_flight if args.continuous_batching else 1
+    # ----
+    # PERFORMANCE IMPROVEMENT: LENGTH-ORDERED SCHEDULING
+    # Requests are admitted in submission order; longest first within each window keeps similar lengths together
+    source = windowed_length_order(model_chunks(), lambda item: item[0].chunks[item[1]].tokens, args.schedule_window)
     # ------
-    end_infer = time.time()
-    total_infer_seconds = end_infer - start_infer
-    print(f"Inference completed in {total_infer_seconds:.2f} seconds")
-    
+    in_flight = {}  # request id -> (job, chunk index, cache key, runaway detector)
+    request_ids = itertools.count()
+    exhausted = False
+    start_infer = None
+    while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+            item = next(source, None)
+            if item is None:
+                exhausted = True
+                break
+            job, index, prompt, params, key = item
+            shared = dedup.add(job.chunks[index].text, (job, index, key)) if dedup is not None else None
+            if shared is Deduplicator.WAITING:
+                continue
+            if shared is not None:
+                share(job, index, key, shared)
+                continue
+            if llm is None:
+                llm = start_engine()
+                start_infer = time.time()
+            # ----
+            # PERFORMANCE IMPROVEMENT: RUNAWAY GUARD (overridable via CLI)
+            # Degenerate generations (blank-line or token loops, output far longer than the input) are stopped
+            # so their slots go back to useful work. The V0 engine accepts a per-request logits processor that
+            # forces EOS; V1 has no per-request processors, there the stop string and the post-hoc check remain.
+            detector = RunawayDetector(job.chunks[index].tokens, whitespace_ids=whitespace_ids)
+            if args.runaway_guard and not getattr(envs, "VLLM_USE_V1", False):
+                sampling_params = SamplingParams(**params, logits_processors=[detector.eos_logits_processor(tokenizer.eos_token_id)])
+            else:
+                sampling_params = SamplingParams(**params)
+            # ------
+            request_id = str(next(request_ids))
+            llm.llm_engine.add_request(request_id, prompt, sampling_params)
+            in_flight[request_id] = (job, index, key, detector)
+        if not in_flight:
+            break
+        for output in llm.llm_engine.step():
+            if not output.finished:
+                continue
+            job, index, key, detector = in_flight.pop(output.request_id)
+            runaway = detector.check(output.outputs[0].token_ids)
+            if output.outputs[0].stop_reason == BLANK_RUN_STOP:
+                runaway = "blank-line run"
+            elif runaway is None and output.outputs[0].finish_reason == "length":
+                runaway = f"stopped at max_tokens ({len(output.outputs[0].token_ids)} tokens)"
+            result = {
+                "text": output.outputs[0].text,
+                "prompt_tokens": len(output.prompt_token_ids),
+                "completion_tokens": len(output.outputs[0].token_ids),
+                "runaway": runaway,
+            }
+            if cache is not None:
+                cache.set(key, result)
+            # Every clean model output teaches the lexicon, so the next run resolves more on its own
+            if lexicon is not None and not runaway:
+                lexicon.learn(job.chunks[index].text, result["text"])
+            if job.fill(index, result, fresh=True):
+                writer.submit(finish_file, job)
+            if dedup is not None:
+                for (copy_job, copy_index, copy_key), copy in dedup.complete(job.chunks[index].text, result):
+                    share(copy_job, copy_index, copy_key, copy)
+    # ------
+    if start_infer is not None:
+        total_infer_seconds = time.time() - start_infer
+    writer.close()
+    if start_infer is not None:
+        print(f"Inference completed in {total_infer_seconds:.2f} seconds")
+        if lexicon is not None:
+            lexicon.save()
+    else:
+        print("Nothing left for the model (lexicon, result cache or manifest), skipping model initialization")
+
+    manifest.close()
+    if args.resume:
+        print(f"Resume: skipped {stats['skipped']} files already done, reprocessed {stats['changed']} changed since the last run")
+    print(f"Processed {stats['files']} files in {stats['chunks']} chunks: {stats['resolved']} resolved by the lexicon, {stats['cached']} from the result cache")
+    if args.latin_passthrough:
+        print(f"Latin passthrough: {stats['latin']} spans ({stats['latin_tokens']} tokens) kept out of the prompts")
+    if dedup is not None and dedup.chunks:
+        print(f"Dedup: {dedup.chunks} chunks, {dedup.chunks - dedup.copies} unique (ratio {dedup.chunks / (dedup.chunks - dedup.copies):.2f}), saved {stats['shared_completion_tokens']} completion tokens")
+
     log_file_path = os.path.join(output_dir, f"{output_prefix}_inference_log.txt")
     with open(log_file_path, "w", encoding="utf-8") as log_file:
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
-        for txt_file, output in zip(all_txt_files, outputs):
-            # Print usage statistics
-            prompt_tokens = len(output.prompt_token_ids)
-            completion_tokens = len(output.outputs[0].token_ids)
-            total_tokens = prompt_tokens + completion_tokens
-            print(f"Token Usage for {txt_file}: Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {total_tokens}")
-            
-            total_prompt_tokens += prompt_tokens
-            total_completion_tokens += completion_tokens
-            
-            # vLLM returns only the generated text, so we prepend the prompt to match echo=True behavior
-            full_text = output.outputs[0].text
-            
-            # 4. Write to file (prefix filename if requested)
-            output_path = os.path.join(output_dir, output_prefix + txt_file)  # Use input filename for output
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(full_text)
-                
-            print(f"Success! Output written to {output_path}")
         # Log summary
-        log_file.write(f"{datetime.datetime.now()},{model},{gpu_model},{init_seconds:.2f},{warmup_duration:.2f},{total_infer_seconds:.2f},{total_prompt_tokens},{total_completion_tokens},PREFIX_CACHING={args.prefix_caching};CONTINUOUS_BATCHING={args.continuous_batching};SPECULATIVE_DECODING={args.speculative_decoding}\n")
+        cache_hits = cache.hits if cache is not None else 0
+        cache_misses = cache.misses if cache is not None else stats["chunks"] - stats["resolved"]
+        log_file.write(f"{datetime.datetime.now()},{model},{gpu_model},{init_seconds:.2f},{warmup_duration:.2f},{total_infer_seconds:.2f},{stats['prompt_tokens']},{stats['completion_tokens']},PREFIX_CACHING={args.prefix_caching};CONTINUOUS_BATCHING={args.continuous_batching};SPECULATIVE_DECODING={args.speculative_decoding};RUNAWAY_GUARD={args.runaway_guard};LEXICON_PREPASS={args.lexicon_prepass};LATIN_PASSTHROUGH={args.latin_passthrough};DEDUP={args.dedup},{cache_hits},{cache_misses},{stats['runaway']}\n")
+    if cache is not None:
+        cache.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
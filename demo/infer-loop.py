@@ -1,101 +1,110 @@
+import argparse
+import asyncio
 import datetime
 import os
 import time
-import torch
-from vllm import LLM, SamplingParams
 import re
+from prompting import format_messages, join_passage, split_passage
+from service import BATCH_WINDOW_SECONDS, MAX_BATCH_SIZE, MicroBatcher, request, serve
+
+SOCKET_PATH = "/tmp/infer-loop.sock"
 
 def sanitize_filename(s: str, replacement: str = "_") -> str:
     # Keep letters, numbers, dash, underscore, dot
     return re.sub(r'[^A-Za-z0-9._-]', replacement, s)
 
-def format_prompt(messages):
-    eos_token = "</s>"
-    formatted_text = ""
-    for i, message in enumerate(messages):
-        if message["role"] == "user":
-            if i % 2 != 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += "[INST] " + message["content"] + " [/INST]"
-        elif message["role"] == "assistant":
-            if i % 2 == 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += message["content"] + eos_token
-        else:
-            raise Exception("Only user and assistant roles are supported!")
-    return formatted_text
+
+async def send(args):
+    # Client mode: submit prompt files to a running service and write timestamped responses as they arrive
+    prompts = []
+    for prompt_file in args.send:
+        with open(prompt_file, "r", encoding="utf-8") as f:
+            prompts.append(split_passage(f.read().strip()))
+    # One connection per instruction, so files with different rules can be sent together
+    async def send_group(instruction, indexes):
+        texts = [prompts[i][1] for i in indexes]
+        async for response in request(texts, args.socket, port=args.port, instruction=instruction or None, echo=True):
+            prompt_file = args.send[indexes[response['id']]]
+            if "error" in response:
+                print(f"Error for {prompt_file}: {response['error']}")
+                continue
+            print(f"Token Usage for {prompt_file}: Prompt: {response['prompt_tokens']}, Completion: {response['completion_tokens']}, Batch: {response['batch_size']}")
+            infer_seconds = response["queue_seconds"] + response["batch_seconds"]
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
+            # Several files finish in the same minute, so they get the prompt file name as a tag
+            tag = "-" + sanitize_filename(os.path.splitext(os.path.basename(prompt_file))[0]) if len(args.send) > 1 else ""
+            output_filename = f"infer-vllm-{timestamp}-{sanitize_filename(response['model'])}-{sanitize_filename(response['gpu_model'])}-{response['init_seconds']:.2f}-{infer_seconds:.2f}{tag}-response.txt"
+            with open(output_filename, "w", encoding="utf-8") as f:
+                f.write(f"# {response['model']}\n")
+                f.write(response["prompt"] + response["text"])
+            print(f"Success! Output written to {output_filename}")
+    groups = {}
+    for i, (instruction, _) in enumerate(prompts):
+        groups.setdefault(instruction, []).append(i)
+    await asyncio.gather(*(send_group(instruction, indexes) for instruction, indexes in groups.items()))
 
 
 def main():
     # Configuration
     #model = "mistralai/Mistral-7B-Instruct-v0.3"
     model = "Qwen/Qwen2.5-32B-Instruct-AWQ"
-    prompt_file = os.path.join(os.path.dirname(__file__), '..', 'prompt.txt')
-    
-    # Get GPU model
-    gpu_model = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "CPU"
-    
-    # Check if prompt file exists
-    if not os.path.exists(prompt_file):
-        print(f"Error: '{prompt_file}' not found in current working directory.")
+    prefix_file = os.path.join(os.path.dirname(__file__), '..', 'prompt-prefix.txt')
+
+    parser = argparse.ArgumentParser(description="Warm inference service: loads the model once and micro-batches concurrent requests")
+    parser.add_argument("--socket", dest="socket", type=str, default=SOCKET_PATH, help="Unix socket to serve on / connect to")
+    parser.add_argument("--port", dest="port", type=int, default=None, help="Use TCP on localhost instead of a Unix socket")
+    parser.add_argument("--window-ms", dest="window_ms", type=float, default=BATCH_WINDOW_SECONDS * 1000, help="How long to collect requests into one batch")
+    parser.add_argument("--max-batch", dest="max_batch", type=int, default=MAX_BATCH_SIZE, help="Maximum requests per batch")
+    parser.add_argument("--stub", dest="stub", action="store_true", help="Serve with a stub engine that echoes prompts (no model, no GPU)")
+    parser.add_argument("--send", dest="send", nargs="+", default=None, metavar="PROMPT_FILE", help="Client mode: send prompt files to a running service")
+    args = parser.parse_args()
+
+    if args.send:
+        asyncio.run(send(args))
         return
 
+    # Check if prefix file exists
+    if not os.path.exists(prefix_file):
+        print(f"Error: '{prefix_file}' not found.")
+        return
+    with open(prefix_file, "r", encoding="utf-8") as f:
+        default_instruction = f.read().strip()
+
     # 2. Initialize the Model
     start_init = time.time()
-    
-    llm = LLM(model=model, download_dir="/hfcache/hub/")
+    if args.stub:
+        from engines import StubEngine
+        engine = StubEngine(delay=0.1)
+        model = "stub"
+        gpu_model = "CPU"
+    else:
+        import torch
+        from engines import VllmEngine
+        # Get GPU model
+        gpu_model = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "CPU"
+        engine = VllmEngine(model)
     end_init = time.time()
     init_seconds = end_init - start_init
 
     # Warm-up inference
-    warmup_prompt = "Warm-up request"
-    warmup_sampling_params = SamplingParams(temperature=0, max_tokens=1)
-    llm.generate([warmup_prompt], warmup_sampling_params)
-
-    print("Model initialized and warmed up. Starting inference loop...")
-    
-    while True:
-        # 1. Read the prompt from file
-        with open(prompt_file, "r", encoding="utf-8") as f:
-            user_prompt = f.read().strip()
+    engine.generate(["Warm-up request"], [{"temperature": 0, "max_tokens": 1}])
 
-        # 3. Format Prompt (ChatML style)
-        system_message = "Je bent een tekstredacteur."
+    # 3. Format Prompt (Mistral instruct style)
+    system_message = "Je bent een tekstredacteur."
+    def build_prompt(text, instruction):
         messages = [
-            {"role": "user", "content": f"{system_message}\n\n{user_prompt}"}
+            {"role": "user", "content": f"{system_message}\n\n{join_passage(instruction or default_instruction, text)}"}
         ]
-        prompt_text = format_prompt(messages)
-
-        # 4. Run Inference
-        print("Running inference...")
-        sampling_params = SamplingParams(temperature=0, max_tokens=2048)
-        start_infer = time.time()
-        outputs = llm.generate([prompt_text], sampling_params)
-        end_infer = time.time()
-        infer_seconds = end_infer - start_infer
-        
-        # Print usage statistics
-        output = outputs[0]
-        prompt_tokens = len(output.prompt_token_ids)
-        completion_tokens = len(output.outputs[0].token_ids)
-        total_tokens = prompt_tokens + completion_tokens
-        print(f"Token Usage: Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {total_tokens}")
-
-        # vLLM returns only the generated text, so we prepend the prompt to match echo=True behavior
-        full_text = prompt_text + output.outputs[0].text
+        return format_messages(messages)
 
-        # 5. Write to timestamped file
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
-        output_filename = f"infer-vllm-{timestamp}-{sanitize_filename(model)}-{sanitize_filename(gpu_model)}-{init_seconds:.2f}-{infer_seconds:.2f}-response.txt"
-        
-        with open(output_filename, "w", encoding="utf-8") as f:
-            f.write(f"# {model}\n")
-            f.write(full_text)
-            
-        print(f"Success! Output written to {output_filename}")
-        
-        # Wait for user input to continue
-        input("Press Enter to run next inference (edit prompt.txt as needed)...")
+    info = {"model": model, "gpu_model": gpu_model, "init_seconds": init_seconds}
+    batcher = MicroBatcher(engine, build_prompt, window=args.window_ms / 1000, max_batch=args.max_batch, info=info)
+    where = f"port {args.port}" if args.port is not None else args.socket
+    print(f"Model initialized in {init_seconds:.2f} seconds and warmed up. Serving on {where}...")
+    try:
+        asyncio.run(serve(batcher, args.socket, port=args.port))
+    except KeyboardInterrupt:
+        print(f"Stopped after {batcher.requests} requests in {batcher.batches} batches")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,24 +1,14 @@
 import datetime
 import os
 import time
-from llama_cpp import Llama
-from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+from prompting import format_messages, join_passage, prefix_before_passage, split_passage
+from prefix_state import restore_prefix
+from runaway import RunawayDetector, llama_cpp_whitespace_token_ids
+from chunking import chunk_budget, chunk_text
+from startup import Phases
+from tuning import load_profile
 
-def format_prompt(messages):
-    eos_token = "</s>"
-    formatted_text = ""
-    for i, message in enumerate(messages):
-        if message["role"] == "user":
-            if i % 2 != 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += "[INST] " + message["content"] + " [/INST]"
-        elif message["role"] == "assistant":
-            if i % 2 == 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += message["content"] + eos_token
-        else:
-            raise Exception("Only user and assistant roles are supported!")
-    return formatted_text
+MAX_TOKENS = 2048
 
 def main():
     # Configuration
@@ -36,47 +26,100 @@ def main():
     with open(prompt_file, "r", encoding="utf-8") as f:
         user_prompt = f.read().strip()
 
+    # llama_cpp is imported only once there is work to do, and timed
+    phases = Phases("infer-raw-llama-cpp")
+    with phases.phase("import backend"):
+        from llama_cpp import Llama, StoppingCriteriaList
+        from input_draft import InputAlignedDraftModel
+
     # 2. Initialize the Model
     start_init = time.time()
-    n_ctx = 4096
+    # ----
+    # PERFORMANCE IMPROVEMENT: TUNED PARAMETERS
+    # Use what tuning.py found fastest on this machine for this model, if it was tuned here
+    tuned = load_profile(model_path)
+    if tuned:
+        print(f"Using tuned parameters: {tuned}")
+    n_ctx = tuned.get("n_ctx", 4096)
+    # ------
+    # ----
+    # PERFORMANCE IMPROVEMENT: SPECULATIVE DECODING
+    # The output is nearly a copy of the passage, so draft from the passage instead of the whole prompt
+    draft_tokens = tuned.get("draft_tokens", 3)
+    draft_model = InputAlignedDraftModel(num_pred_tokens=draft_tokens) if draft_tokens else None
+    # ------
     
     llm = Llama(
         model_path=model_path,
         n_ctx=n_ctx,
-        n_threads=8,
+        n_threads=tuned.get("n_threads", 8),
+        n_batch=tuned.get("n_batch", 512),
         temperature=0,
         chat_format=None,
-        draft_model=LlamaPromptLookupDecoding(num_pred_tokens=3),
-        # draft_k=10,
-        logits_all=True,
+        draft_model=draft_model,
+        logits_all=tuned.get("logits_all", True),
     )
     end_init = time.time()
     init_seconds = end_init - start_init
+    phases.add("load weights", init_seconds)
+    whitespace_ids = llama_cpp_whitespace_token_ids(llm)
 
     # 3. Format Prompt (ChatML style)
     system_message = "You are a text editor. You strictly preserve original wording and only correct spelling."
-    messages = [
-        {"role": "user", "content": f"{system_message}\n\n{user_prompt}"}
-    ]
-    prompt_text = format_prompt(messages)
+    def build_prompt(text):
+        messages = [
+            {"role": "user", "content": f"{system_message}\n\n{text}"}
+        ]
+        return format_messages(messages)
+
+    # Split long passages into chunks that fit n_ctx together with the prompt and the expected output
+    instruction, passage = split_passage(user_prompt)
+    count_tokens = lambda text: len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+    overhead_tokens = len(llm.tokenize(build_prompt(join_passage(instruction, "")).encode("utf-8")))
+    chunks = chunk_text(passage, count_tokens, chunk_budget(n_ctx, overhead_tokens, MAX_TOKENS))
+
+    # ----
+    # PERFORMANCE IMPROVEMENT: PREFIX STATE
+    # System message and rules are the same for every passage: evaluate them once, keep the KV state
+    # on disk and let later chunks and later runs start prefill after the prefix.
+    prefix_status, prefix_seconds = restore_prefix(llm, prefix_before_passage(build_prompt, instruction))
+    print(f"Prefix state {prefix_status} in {prefix_seconds:.2f} seconds")
+    phases.add("prefix", prefix_seconds)
+    phases.report(model=model, backend="llama_cpp", prefix=prefix_status)
+    # ------
 
     # 4. Run Inference
-    print("Running inference...")
+    print(f"Running inference on {len(chunks)} chunk(s)...")
     start_infer = time.time()
-    output = llm(
-        prompt=prompt_text,
-        max_tokens=2048,
-        temperature=0,
-        echo=True
-    )
+    texts = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for chunk in chunks:
+        if draft_model is not None:
+            draft_model.set_input(llm.tokenize(chunk.text.encode("utf-8"), add_bos=False))
+        # Stop blank-line and token loops instead of decoding them until max_tokens
+        detector = RunawayDetector(chunk.tokens, whitespace_ids=whitespace_ids)
+        output = llm(
+            prompt=build_prompt(join_passage(instruction, chunk.text)),
+            max_tokens=MAX_TOKENS,
+            temperature=0,
+            echo=True,
+            stopping_criteria=StoppingCriteriaList([detector.llama_cpp_stopping_criteria()]),
+        )
+        if detector.reason:
+            print(f"Runaway output stopped: {detector.reason}")
+        texts.append(output['choices'][0]['text'])
+        for key in usage:
+            usage[key] += output['usage'][key]
     end_infer = time.time()
     infer_seconds = end_infer - start_infer
     
     # Print usage statistics
-    usage = output['usage']
     print(f"Token Usage: Prompt: {usage['prompt_tokens']}, Completion: {usage['completion_tokens']}, Total: {usage['total_tokens']}")
+    if draft_model is not None:
+        print(draft_model.report())
 
-    full_text = output['choices'][0]['text']
+    # With echo=True every chunk carries its own prompt, so the chunks are written one after the other
+    full_text = "\n".join(texts)
 
     # 5. Write to timestamped file
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
@@ -1,40 +1,20 @@
 import datetime
 import os
 import time
-import torch
-from vllm import LLM, SamplingParams
 import re
+from prompting import format_messages
+from startup import Phases
 
 def sanitize_filename(s: str, replacement: str = "_") -> str:
     # Keep letters, numbers, dash, underscore, dot
     return re.sub(r'[^A-Za-z0-9._-]', replacement, s)
 
-def format_prompt(messages):
-    eos_token = "</s>"
-    formatted_text = ""
-    for i, message in enumerate(messages):
-        if message["role"] == "user":
-            if i % 2 != 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += "[INST] " + message["content"] + " [/INST]"
-        elif message["role"] == "assistant":
-            if i % 2 == 0:
-                raise Exception("Conversation roles must alternate user/assistant/user/assistant/...")
-            formatted_text += message["content"] + eos_token
-        else:
-            raise Exception("Only user and assistant roles are supported!")
-    return formatted_text
-
-
 def main():
     # Configuration
     #model = "mistralai/Mistral-7B-Instruct-v0.3"
     model = "Qwen/Qwen2.5-32B-Instruct-AWQ"
     prompt_file = os.path.join(os.path.dirname(__file__), '..', 'prompt.txt')
     
-    # Get GPU model
-    gpu_model = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "CPU"
-    
     # 1. Read the prompt from file
     if not os.path.exists(prompt_file):
         print(f"Error: '{prompt_file}' not found in current working directory.")
@@ -43,24 +23,36 @@ def main():
     with open(prompt_file, "r", encoding="utf-8") as f:
         user_prompt = f.read().strip()
 
+    # torch and vllm are imported only once there is work to do, and timed
+    phases = Phases("infer-vllm")
+    with phases.phase("import backend"):
+        import torch
+        from vllm import LLM, SamplingParams
+
+    # Get GPU model
+    gpu_model = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "CPU"
+
     # 2. Initialize the Model
     start_init = time.time()
     
     llm = LLM(model=model, download_dir="/hfcache/hub/")
     end_init = time.time()
     init_seconds = end_init - start_init
+    phases.add("load weights", init_seconds)
 
     # Warm-up inference
     warmup_prompt = "Warm-up request"
     warmup_sampling_params = SamplingParams(temperature=0, max_tokens=1)
-    llm.generate([warmup_prompt], warmup_sampling_params)
+    with phases.phase("warm-up"):
+        llm.generate([warmup_prompt], warmup_sampling_params)
+    phases.report(model=model, backend="vllm", gpu=gpu_model)
 
     # 3. Format Prompt (ChatML style)
     system_message = "Je bent een tekstredacteur."
     messages = [
         {"role": "user", "content": f"{system_message}\n\n{user_prompt}"}
     ]
-    prompt_text = format_prompt(messages)
+    prompt_text = format_messages(messages)
 
     # 4. Run Inference
     print("Running inference...")
@@ -0,0 +1,93 @@
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+
+class InputAlignedDraftModel(LlamaDraftModel):
+    """Draft model for copy-like tasks: proposes the continuation of the input passage.
+
+    Unlike LlamaPromptLookupDecoding, which matches n-grams anywhere in the prompt (rules block
+    included), this keeps a cursor into the passage that follows the generated text. When the
+    model makes an edit the cursor is resynchronized on the last generated n-gram, searching a
+    short window around the old position so common words don't make it jump.
+    """
+
+    def __init__(self, num_pred_tokens: int = 10, max_ngram_size: int = 3, lookahead: int = 32, lookbehind: int = 8):
+        self.num_pred_tokens = num_pred_tokens
+        self.max_ngram_size = max_ngram_size
+        self.lookahead = lookahead
+        self.lookbehind = lookbehind
+        self.passage = np.array([], dtype=np.intc)
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+        self.reset()
+
+    def reset(self):
+        self._gen_start = None   # length of input_ids at the first call, i.e. the prompt
+        self._cursor = 0         # passage position aligned with the end of the generated text
+        self._seen = 0           # length of input_ids at the previous call
+        self._last_draft = np.array([], dtype=np.intc)
+
+    def set_input(self, passage_tokens):
+        # Call before each generation with the tokenized passage (no BOS)
+        self.passage = np.asarray(passage_tokens, dtype=np.intc)
+        self.reset()
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted_tokens / self.proposed_tokens if self.proposed_tokens else 0.0
+
+    def report(self):
+        return f"Draft acceptance: {self.accepted_tokens}/{self.proposed_tokens} ({self.acceptance_rate:.1%})"
+
+    def _count_accepted(self, new_tokens):
+        # Tokens produced since the previous call start with the accepted part of the last draft
+        n = min(len(new_tokens), len(self._last_draft))
+        mismatch = np.nonzero(new_tokens[:n] != self._last_draft[:n])[0]
+        self.accepted_tokens += int(mismatch[0]) if len(mismatch) else n
+
+    def _resync(self, generated):
+        lo = max(0, self._cursor - self.lookbehind)
+        hi = min(len(self.passage), self._cursor + self.lookahead)
+        for ngram_size in range(min(self.max_ngram_size, len(generated), hi - lo), 0, -1):
+            window = self.passage[lo:hi]
+            views = np.lib.stride_tricks.sliding_window_view(window, (ngram_size,))
+            matches = np.nonzero(np.all(views == generated[-ngram_size:], axis=1))[0]
+            if len(matches):
+                # Prefer the match closest to where we expected to be
+                ends = lo + matches + ngram_size
+                self._cursor = int(ends[np.argmin(np.abs(ends - self._cursor))])
+                return True
+        return False
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        length = input_ids.shape[0]
+        if self._gen_start is None or length <= self._seen:
+            # New generation: input_ids is the prompt plus the first sampled token
+            self.reset()
+            self._gen_start = length - 1
+            self._seen = length - 1
+        else:
+            self._count_accepted(input_ids[self._seen:length])
+
+        # Advance the cursor over the tokens that are new since the previous call
+        in_sync = True
+        for token in input_ids[self._seen:length]:
+            if self._cursor < len(self.passage) and self.passage[self._cursor] == token:
+                self._cursor += 1
+            else:
+                in_sync = False
+        if not in_sync:
+            in_sync = self._resync(input_ids[self._gen_start:length])
+        self._seen = length
+
+        if in_sync:
+            draft = self.passage[self._cursor:self._cursor + self.num_pred_tokens]
+        else:
+            # Mid-edit: wait for the next token instead of proposing a draft that gets rejected
+            draft = np.array([], dtype=np.intc)
+        self._last_draft = draft
+        self.proposed_tokens += len(draft)
+        return draft
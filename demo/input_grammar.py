@@ -0,0 +1,163 @@
+# Input-constrained decoding for llama_cpp. A spelling pass may only respell words: the output is the
+# input chunk with the same words in the same order, the same punctuation and whitespace, and Latin
+# and placeholders verbatim. chunk_grammar() turns a chunk into a GBNF grammar that allows exactly
+# that: at each word the original or a few candidate spellings (lexicon, spelling rules), everything
+# in between as a fixed literal. Under the grammar a generation cannot loop or run on (once the chunk
+# is complete only EOS is allowed), and forced spans are pure copying, which the input-aligned draft
+# model (input_draft.py) proposes and one batched forward pass verifies.
+#
+# GrammarStats counts, through a logits processor that sees the scores before the grammar does, how
+# often the model's own choice was rejected by the grammar, and which tokens it wanted instead.
+import collections
+import re
+
+import numpy as np
+
+from latin import PLACEHOLDER_PATTERN, latin_spans
+from lexicon import MODERN_ISCH, RULES, SEED, WORD, match_case
+
+MAX_VARIANTS = 6  # candidate spellings per word, the original included
+
+# Old-to-modern changes that are likely but not certain; each is offered as a candidate and the model chooses
+SPELLING_CHANGES = [
+    (re.compile(r'(ee|oo|aa|uu)(?=[bcdfgklmnprstvwz][aeiou])'), lambda m: m.group(1)[0]),  # deelen, hooren
+    (re.compile(r'ph'), lambda m: "f"),                                                       # photographie
+    (re.compile(r'ae'), lambda m: "e"),                                                       # paedagogie
+    (re.compile(r'ck'), lambda m: "k"),                                                       # publieck
+    (re.compile(r'^([bcdfghjklmnpqrstvwz]+)y(?=[^aeiou]*$)'), lambda m: m.group(1) + "ij"),   # hy, zyn, myn (not typisch)
+    (re.compile(r'([aeiouy])sch(e|en)?$'), lambda m: m.group(0) if MODERN_ISCH.search(m.string)   # vleesch, visch, frisch
+     else m.group(1) + "s" + (m.group(2) or "")),                                              # (not logisch)
+]
+
+
+def spelling_variants(word, lexicon=None, max_variants=MAX_VARIANTS):
+    # The word itself first, then spellings it may be modernized to. Unlike the lexicon pre-pass, the
+    # rewrites are also offered for capitalized words: the original stays a candidate, so names keep
+    # their spelling if the model wants, while proper adjectives (Fransche, Duitsche) can be modernized.
+    candidates = [word]
+
+    def add(candidate):
+        if candidate and candidate not in candidates and len(candidates) < max_variants:
+            candidates.append(candidate)
+    lower = word.lower()
+    replacement = lexicon.lookup(lower) if lexicon is not None else SEED.get(lower)
+    add(match_case(word, replacement) if replacement else None)
+    for pattern, substitution in RULES:
+        add(match_case(word, pattern.sub(substitution, lower)) if pattern.search(lower) else None)
+    combined = lower
+    for pattern, substitution in SPELLING_CHANGES:
+        if pattern.search(lower):
+            add(match_case(word, pattern.sub(substitution, lower)))
+            combined = pattern.sub(substitution, combined)
+    add(match_case(word, combined))
+    return candidates
+
+
+def gbnf_literal(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t") + '"'
+
+
+def chunk_grammar(text, lexicon=None, max_variants=MAX_VARIANTS):
+    """GBNF grammar whose sentences are text with some words respelled, and its statistics.
+
+    Returns (grammar, {"forced_chars", "choice_chars", "words", "choices", "candidates"}); a single
+    leading space is allowed, since most tokenizers start the answer with one.
+    """
+    protected = latin_spans(text) + [(match.start(), match.end()) for match in PLACEHOLDER_PATTERN.finditer(text)]
+    parts = []
+    stats = {"forced_chars": 0, "choice_chars": 0, "words": 0, "choices": 0, "candidates": 0}
+    position = 0
+    for match in WORD.finditer(text):
+        stats["words"] += 1
+        if any(start <= match.start() < end for start, end in protected):
+            continue
+        candidates = spelling_variants(match.group(), lexicon, max_variants)
+        if len(candidates) == 1:
+            continue
+        if match.start() > position:
+            parts.append(gbnf_literal(text[position:match.start()]))
+            stats["forced_chars"] += match.start() - position
+        parts.append("(" + " | ".join(gbnf_literal(candidate) for candidate in candidates) + ")")
+        stats["choices"] += 1
+        stats["candidates"] += len(candidates)
+        stats["choice_chars"] += len(match.group())
+        position = match.end()
+    if position < len(text):
+        parts.append(gbnf_literal(text[position:]))
+        stats["forced_chars"] += len(text) - position
+    return "root ::= \" \"? " + " ".join(parts or ['""']) + "\n", stats
+
+
+class GrammarStats:
+    """Totals over the chunks decoded under a grammar: how much was forced and how often the grammar
+    overruled the model."""
+
+    def __init__(self):
+        self.totals = collections.Counter()
+        self.rejections = collections.Counter()  # (wanted token, chosen token) -> times
+
+    def add_chunk(self, stats):
+        self.totals.update(stats)
+        self.totals["chunks"] += 1
+
+    def logits_processor(self):
+        # One per generation. llama_cpp applies logits processors before the grammar, so the argmax here
+        # is what the model would have picked; the next call's input_ids end with the token the grammar
+        # let through (drafted tokens are only kept up to the first one that differs from it).
+        wanted = None
+
+        def process(input_ids, scores):
+            nonlocal wanted
+            if wanted is not None:
+                chosen = int(input_ids[-1])
+                self.totals["steps"] += 1
+                if chosen != wanted:
+                    self.totals["rejected"] += 1
+                    self.rejections[(wanted, chosen)] += 1
+            wanted = int(np.argmax(scores))
+            return scores
+        return process
+
+    def report(self, detokenize=None, top=5):
+        # detokenize maps token IDs to text; merged totals from workers are already text
+        totals = self.totals
+        chars = totals["forced_chars"] + totals["choice_chars"]
+        name = detokenize or (lambda token: token)
+        return {
+            "chunks": totals["chunks"],
+            "forced_share": totals["forced_chars"] / chars if chars else 0.0,
+            "words_with_choices": totals["choices"],
+            "mean_candidates": totals["candidates"] / totals["choices"] if totals["choices"] else 0.0,
+            "steps": totals["steps"],
+            "rejected": totals["rejected"],
+            "rejection_rate": totals["rejected"] / totals["steps"] if totals["steps"] else 0.0,
+            "top_rejections": [
+                {"wanted": name(wanted), "chosen": name(chosen), "times": times}
+                for (wanted, chosen), times in self.rejections.most_common(top)
+            ],
+        }
+
+    def state(self, detokenize):
+        # Picklable totals for another process to merge(), with the tokens as text
+        return {
+            "totals": dict(self.totals),
+            "rejections": [[detokenize(wanted), detokenize(chosen), times] for (wanted, chosen), times in self.rejections.items()],
+        }
+
+    def merge(self, state):
+        self.totals.update(state["totals"])
+        for wanted, chosen, times in state["rejections"]:
+            self.rejections[(wanted, chosen)] += times
+
+    def reset(self):
+        self.totals.clear()
+        self.rejections.clear()
+
+
+def format_report(report):
+    text = (f"{report['forced_share']:.1%} of the output forced, {report['words_with_choices']} words with "
+            f"{report['mean_candidates']:.1f} candidates on average, model overruled at {report['rejected']} of "
+            f"{report['steps']} steps ({report['rejection_rate']:.2%})")
+    if report.get("top_rejections"):
+        text += "; most often wanted " + ", ".join(f"{r['wanted']!r} for {r['chosen']!r} ({r['times']}x)" for r in report["top_rejections"])
+    return text
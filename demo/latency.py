@@ -0,0 +1,129 @@
+# Per-request latency instrumentation. Engines report token arrivals through a TraceRecorder
+# (see generate_traced in engines.py); each request's trace yields time to first token, prefill
+# time, the inter-token latency distribution, decode tokens/sec and draft acceptance when the
+# backend exposes it. Traces export as JSON and as a Chrome trace (chrome://tracing, Perfetto).
+import json
+import os
+import statistics
+import time
+
+
+def percentile(values, q):
+    # Linear interpolation between closest ranks, q in [0, 100]
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RequestTrace:
+    def __init__(self, request_id, submitted):
+        self.request_id = request_id
+        self.submitted = submitted
+        self.scheduled = None       # when the engine started on the request, if known
+        self.prefill_done = None    # when the prompt was evaluated, if the engine reports it separately
+        self.token_times = []       # one entry per generated token
+        self.finished = None
+        self.prompt_tokens = 0
+        self.draft_proposed = None
+        self.draft_accepted = None
+
+    def tokens(self, count, now=None):
+        # Several tokens can arrive at once (speculative decoding, batched engine steps)
+        now = time.perf_counter() if now is None else now
+        self.token_times.extend([now] * count)
+
+    def finish(self, now=None):
+        self.finished = time.perf_counter() if now is None else now
+
+    def summary(self):
+        first = self.token_times[0] if self.token_times else self.finished
+        start = self.scheduled if self.scheduled is not None else self.submitted
+        gaps = [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+        decode_seconds = self.token_times[-1] - first if len(self.token_times) > 1 else 0.0
+        summary = {
+            "id": self.request_id,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": len(self.token_times),
+            "queue_seconds": start - self.submitted,
+            "ttft_seconds": first - self.submitted,
+            "prefill_seconds": (self.prefill_done if self.prefill_done is not None else first) - start,
+            "decode_seconds": decode_seconds,
+            "decode_tokens_per_second": (len(self.token_times) - 1) / decode_seconds if decode_seconds else 0.0,
+            "total_seconds": self.finished - self.submitted,
+            "itl_mean": statistics.mean(gaps) if gaps else 0.0,
+            "itl_p50": percentile(gaps, 50),
+            "itl_p95": percentile(gaps, 95),
+            "itl_p99": percentile(gaps, 99),
+            "itl_max": max(gaps, default=0.0),
+        }
+        if self.draft_proposed is not None:
+            summary["draft_proposed"] = self.draft_proposed
+            summary["draft_accepted"] = self.draft_accepted
+            summary["draft_acceptance"] = self.draft_accepted / self.draft_proposed if self.draft_proposed else 0.0
+        return summary
+
+
+class TraceRecorder:
+    def __init__(self, label=""):
+        self.label = label
+        self.origin = time.perf_counter()
+        self.traces = []
+
+    def start(self, request_id=None, now=None):
+        # Requests are numbered in submission order unless the caller names them
+        request_id = len(self.traces) if request_id is None else request_id
+        trace = RequestTrace(request_id, time.perf_counter() if now is None else now)
+        self.traces.append(trace)
+        return trace
+
+    def summaries(self):
+        return [trace.summary() for trace in self.traces if trace.finished is not None]
+
+    def aggregate(self):
+        # Run-level numbers for a benchmark record
+        summaries = self.summaries()
+        if not summaries:
+            return {}
+        gaps = [b - a for trace in self.traces for a, b in zip(trace.token_times, trace.token_times[1:])]
+        aggregate = {
+            "ttft_mean": statistics.mean(s["ttft_seconds"] for s in summaries),
+            "ttft_p95": percentile([s["ttft_seconds"] for s in summaries], 95),
+            "prefill_mean": statistics.mean(s["prefill_seconds"] for s in summaries),
+            "itl_p50": percentile(gaps, 50),
+            "itl_p95": percentile(gaps, 95),
+            "decode_tokens_per_second": statistics.mean(s["decode_tokens_per_second"] for s in summaries),
+        }
+        drafted = [s for s in summaries if "draft_proposed" in s]
+        if drafted:
+            proposed = sum(s["draft_proposed"] for s in drafted)
+            aggregate["draft_acceptance"] = sum(s["draft_accepted"] for s in drafted) / proposed if proposed else 0.0
+        return aggregate
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"label": self.label, "requests": self.summaries(), "aggregate": self.aggregate()}, f, indent=2)
+
+    def write_chrome_trace(self, path):
+        # One row (tid) per request: a queue span, a prefill span and a decode span with token markers
+        us = lambda t: (t - self.origin) * 1e6
+        events = []
+        for tid, trace in enumerate(self.traces):
+            if trace.finished is None:
+                continue
+            name = str(trace.request_id)
+            events.append({"ph": "M", "pid": os.getpid(), "tid": tid, "name": "thread_name", "args": {"name": name}})
+            start = trace.scheduled if trace.scheduled is not None else trace.submitted
+            first = trace.token_times[0] if trace.token_times else trace.finished
+            spans = [("queue", trace.submitted, start), ("prefill", start, first), ("decode", first, trace.finished)]
+            for span, begin, end in spans:
+                if end > begin:
+                    events.append({"ph": "X", "pid": os.getpid(), "tid": tid, "name": span, "cat": self.label,
+                                   "ts": us(begin), "dur": us(end) - us(begin), "args": {"request": name}})
+            for t in trace.token_times:
+                events.append({"ph": "i", "s": "t", "pid": os.getpid(), "tid": tid, "name": "token", "ts": us(t)})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
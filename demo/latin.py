@@ -0,0 +1,102 @@
+# Latin passthrough. The prompt asks to leave Latin unchanged, so there is no point in making the
+# model read and re-type it: Latin spans are cut out before prompting, replaced by a short
+# placeholder, and spliced back into the output afterwards.
+#
+# Detection scores every word on stopwords and letter patterns (Dutch has ij, oe, aa, sch, w, k
+# where Latin has none; Latin has its inflection endings), then takes runs of Latin-looking words.
+import re
+
+PLACEHOLDER = "[L{}]"
+PLACEHOLDER_PATTERN = re.compile(r'\[L(\d+)\]')
+MIN_LATIN_WORDS = 3     # fewer Latin-looking words than this is a loan word or a name, not a quotation
+MIN_LATIN_SHARE = 0.5   # of the words in a span
+
+WORD = re.compile(r'[^\W\d_]+')
+SENTENCE_END = re.compile(r'[.!?;:]')
+
+LATIN_STOPWORDS = {
+    "et", "est", "non", "ad", "quod", "ergo", "sed", "ut", "cum", "enim", "autem", "vel", "sicut", "quia",
+    "qui", "quae", "quam", "esse", "sunt", "ex", "ab", "nec", "neque", "etiam", "tamen", "dicendum",
+    "primum", "secundum", "igitur", "videtur", "unde", "hoc", "haec", "deus", "dei", "deo", "ipse",
+    "ipsa", "sive", "ita", "nisi", "contra", "respondeo", "ille", "illa", "omnis", "omnia", "inter",
+    "nos", "vos", "eius", "eorum", "sua", "suum", "fuit", "erit", "sit", "quo", "qua", "quidem",
+}
+DUTCH_STOPWORDS = {
+    "de", "het", "een", "en", "van", "is", "dat", "die", "te", "niet", "op", "zijn", "voor", "met",
+    "als", "ook", "er", "aan", "om", "door", "maar", "wordt", "naar", "bij", "of", "zo", "zoo", "dan",
+    "hij", "zij", "ze", "wat", "kan", "men", "dus", "echter", "tot", "deze", "dit", "uit", "over", "want",
+    "wel", "geen", "al", "wie", "waar", "omdat", "hem", "haar", "hun", "daar", "hier", "nog", "heeft",
+}
+DUTCH_LETTERS = re.compile(r'ij|oe|aa|ee|oo|uu|ui|ou|sch|w|k|z')
+LATIN_ENDING = re.compile(r'(orum|arum|ibus|ntur|tur|mus|que|ae|us|um|is|em|it|nt|am|ius|ii)$')
+
+
+def word_score(word):
+    # > 0 looks Latin, < 0 looks Dutch, 0 could be either (names, short words, 'in')
+    word = word.lower()
+    if word in LATIN_STOPWORDS:
+        return 2
+    if word in DUTCH_STOPWORDS:
+        return -2
+    if DUTCH_LETTERS.search(word):
+        return -1
+    return 1 if len(word) > 3 and LATIN_ENDING.search(word) else 0
+
+
+def latin_spans(text):
+    # (start, end) character offsets of Latin passages
+    spans = []
+    run = []  # (match, score) of the current run without Dutch words
+
+    def close():
+        latin = [i for i, (_, score) in enumerate(run) if score > 0]
+        if len(latin) >= MIN_LATIN_WORDS:
+            # From the first Latin word to the end of the run; a name just before a quotation stays Dutch
+            words = run[latin[0]:]
+            if len(latin) >= MIN_LATIN_SHARE * len(words):
+                spans.append((words[0][0].start(), words[-1][0].end()))
+        run.clear()
+
+    position = 0
+    for match in WORD.finditer(text):
+        score = word_score(match.group())
+        # Spans also end at sentence punctuation, so neighbouring Dutch sentences are never swallowed
+        if score < 0 or SENTENCE_END.search(text, position, match.start()):
+            close()
+        if score >= 0:
+            run.append((match, score))
+        position = match.end()
+    close()
+    return spans
+
+
+def mask_latin(text):
+    # Returns (masked text, originals); originals[i] belongs to PLACEHOLDER.format(i + 1)
+    originals = []
+    pieces = []
+    position = 0
+    for start, end in latin_spans(text):
+        originals.append(text[start:end])
+        pieces.append(text[position:start] + PLACEHOLDER.format(len(originals)))
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces), originals
+
+
+def unmask_latin(text, originals):
+    # Returns (text with the Latin back in, numbers of placeholders the output lost)
+    seen = set()
+
+    def restore(match):
+        number = int(match.group(1))
+        if 1 <= number <= len(originals):
+            seen.add(number)
+            return originals[number - 1]
+        return match.group()
+    text = PLACEHOLDER_PATTERN.sub(restore, text)
+    return text, [number for number in range(1, len(originals) + 1) if number not in seen]
+
+
+def lost_placeholders(source, output):
+    # Placeholders of source that the output dropped or garbled
+    return set(PLACEHOLDER_PATTERN.findall(source)) - set(PLACEHOLDER_PATTERN.findall(output))
@@ -0,0 +1,196 @@
+# Deterministic spelling pre-pass. Most of what prompt-prefix.txt asks for is mechanical
+# ('mededeeling' -> 'mededeling', '-sch' -> '-s', 'den' -> 'de'), so sentences whose every word is
+# either known or modern-looking are rewritten here and never reach the model. Only sentences with
+# an unknown word that looks archaic (see ARCHAIC) go to inference.
+#
+# The lexicon is a hash index of lowercase word -> {replacement: times seen}. It starts from the
+# examples in the prompt (SEED) and grows by word-aligning past input/output pairs:
+#
+#   python demo/lexicon.py learn --input-dir /hfcache/input --output-dir /hfcache/output [--output-prefix X]
+#   python demo/lexicon.py learn ../*-response.txt
+#   python demo/lexicon.py resolve "Het is echter duidelijk, dat de menschelijke vorm ..."
+import argparse
+import difflib
+import json
+import os
+import re
+
+from chunking import split_units
+from prompting import PASSAGE_MARKER, split_passage
+from run_index import split_transcript
+
+DEFAULT_LEXICON_PATH = "/hfcache/cache/lexicon.json"
+MIN_EVIDENCE = 2       # times a learned rewrite must have been seen before it is trusted
+MIN_AGREEMENT = 0.9    # share of sightings that must agree on the replacement
+MIN_SIMILARITY = 0.5   # aligned pairs less alike than this are alignment noise, not spelling changes
+
+WORD = re.compile(r'[^\W\d_]+')
+
+# The prompt's own examples; these win over anything learned
+SEED = {
+    "mededeeling": "mededeling", "behooren": "behoren", "mensch": "mens", "menschen": "mensen",
+    "den": "de", "iederen": "iedere", "welken": "welke", "dezen": "deze", "zijnen": "zijn",
+    "eenen": "een", "hunnen": "hun", "onzen": "onze", "mijnen": "mijn", "uwen": "uw",
+    "geenen": "geen", "zoo": "zo", "zooals": "zoals", "zeide": "zei",
+}
+
+# Rewrites that hold for every word they match; applied to lowercase-initial words (names keep their spelling)
+RULES = [
+    (re.compile(r'([^aeiou])sch$'), r'\1s'),                       # mensch, valsch, versch (not -isch: logisch, typisch)
+    (re.compile(r'([^aeiou])sch(e|en|er|es)$'), r'\1s\2'),         # menschen, wenschen, tusschen, valsche
+    (re.compile(r'([^aeiou])schelijk(e|er|heid)?$'), r'\1selijk\2'),  # menschelijke
+]
+
+# Unknown words matching these look archaic and need the model. Double vowels in an open syllable are
+# usually old spelling (deelen, hooren) but not always (tweede, vooral, meegaan), so they are only
+# rewritten once the lexicon has seen them.
+ARCHAIC = [
+    re.compile(r'(ee|oo)[bcdfgklmnprstvwz][aeiou]'),
+    re.compile(r'[^aeiou]sch(e|en|er|es)?$'),
+    re.compile(r'ph'),
+    re.compile(r'ae'),
+]
+# A vowel before -sch is old too (vleesch, visch, frisch), except in the -isch adjectives, where -isch
+# follows a syllable of its own (log-isch, typ-isch, histor-isch) rather than a bare onset (fr-isch)
+VOWEL_SCH = re.compile(r'[aeiouy]sch(e|en)?$')
+MODERN_ISCH = re.compile(r'[aeiouy][^aeiouy]*isch(e|en)?$')
+
+
+def looks_archaic(word):
+    if VOWEL_SCH.search(word) and not MODERN_ISCH.search(word):
+        return True
+    return any(pattern.search(word) for pattern in ARCHAIC)
+
+
+def match_case(word, replacement):
+    if word.isupper() and len(word) > 1:
+        return replacement.upper()
+    if word[0].isupper():
+        return replacement[0].upper() + replacement[1:]
+    return replacement
+
+
+def align_words(source, target):
+    # Word pairs (old, new) from an input text and its modernized output; unchanged words pair with themselves
+    source_words = [word.lower() for word in WORD.findall(source)]
+    target_words = [word.lower() for word in WORD.findall(target)]
+    matcher = difflib.SequenceMatcher(None, source_words, target_words, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal" or (op == "replace" and i2 - i1 == j2 - j1):
+            for old, new in zip(source_words[i1:i2], target_words[j1:j2]):
+                if old == new or difflib.SequenceMatcher(None, old, new).ratio() >= MIN_SIMILARITY:
+                    yield old, new
+
+
+class Lexicon:
+    def __init__(self, path=DEFAULT_LEXICON_PATH):
+        self.path = path
+        self.counts = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.counts = json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.counts, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def learn(self, source, target):
+        # Count the word pairs of one input/output pair; returns how many pairs were seen
+        pairs = 0
+        for old, new in align_words(source, target):
+            seen = self.counts.setdefault(old, {})
+            seen[new] = seen.get(new, 0) + 1
+            pairs += 1
+        return pairs
+
+    def lookup(self, word):
+        # Modern form of a lowercase word, or None when it is unknown or the evidence disagrees
+        if word in SEED:
+            return SEED[word]
+        seen = self.counts.get(word)
+        if not seen:
+            return None
+        replacement, count = max(seen.items(), key=lambda item: item[1])
+        if count < MIN_EVIDENCE or count < MIN_AGREEMENT * sum(seen.values()):
+            return None
+        # Past outputs also hold the model's own liberties ('groter' -> 'grotere'); only rewrites of
+        # old spellings and of old case endings ('goddelijken' -> 'goddelijke') are spelling
+        if replacement != word and not (looks_archaic(word) or (word.endswith("en") and replacement == word[:-1])):
+            return word
+        return replacement
+
+    def rewrite(self, word):
+        # (modern form, resolved): unknown modern-looking words are kept as they are
+        lower = word.lower()
+        replacement = self.lookup(lower)
+        if replacement is not None and replacement != lower and not word[0].islower():
+            # Names keep their spelling (Den Haag, Den Bosch), but a capital may also just start a
+            # sentence; the model decides
+            return word, False
+        if replacement is not None:
+            return match_case(word, replacement), True
+        if word[0].islower():
+            for pattern, substitution in RULES:
+                if pattern.search(lower):
+                    return pattern.sub(substitution, word), True
+        return word, not looks_archaic(lower)
+
+    def resolve(self, text):
+        # The modernized text, or None when some word still needs the model
+        unresolved = False
+
+        def replace(match):
+            nonlocal unresolved
+            word, resolved = self.rewrite(match.group())
+            unresolved = unresolved or not resolved
+            return word
+        text = WORD.sub(replace, text)
+        return None if unresolved else text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Learn and apply the spelling lexicon")
+    parser.add_argument("--lexicon", dest="lexicon", default=DEFAULT_LEXICON_PATH, help="Lexicon file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    learn = commands.add_parser("learn", help="Word-align past input/output pairs into the lexicon")
+    learn.add_argument("responses", nargs="*", help="*-response.txt files (prompt and output in one file)")
+    learn.add_argument("--input-dir", dest="input_dir", default=None, help="Inputs of an infer-batch.py run")
+    learn.add_argument("--output-dir", dest="output_dir", default=None, help="Outputs of the same run")
+    learn.add_argument("--output-prefix", dest="output_prefix", default="", help="Output prefix of that run (without the trailing _)")
+    resolve = commands.add_parser("resolve", help="Show how a text would be pre-processed")
+    resolve.add_argument("text")
+    args = parser.parse_args()
+
+    lexicon = Lexicon(args.lexicon)
+    if args.command == "resolve":
+        for unit in split_units(args.text):
+            resolved = lexicon.resolve(unit.text)
+            print(f"model   | {unit.text}" if resolved is None else f"lexicon | {resolved}")
+        return
+
+    pairs = []
+    for path in args.responses:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            prompts, output = split_transcript(f.read())
+        passages = [split_passage(segment)[1] for segment in prompts if PASSAGE_MARKER in segment]
+        if passages and output:
+            pairs.append(("\n".join(passages), output))
+    if args.input_dir and args.output_dir:
+        prefix = args.output_prefix + "_" if args.output_prefix else ""
+        for name in sorted(os.listdir(args.input_dir)):
+            output_path = os.path.join(args.output_dir, prefix + name)
+            if name.endswith(".txt") and os.path.exists(output_path):
+                with open(os.path.join(args.input_dir, name), "r", encoding="utf-8") as f:
+                    source = f.read()
+                with open(output_path, "r", encoding="utf-8") as f:
+                    pairs.append((source, f.read()))
+    words = sum(lexicon.learn(source, target) for source, target in pairs)
+    lexicon.save()
+    changed = sum(1 for word in lexicon.counts if lexicon.lookup(word) not in (None, word))
+    print(f"Learned {words} word pairs from {len(pairs)} documents; {len(lexicon.counts)} words known, {changed} trusted rewrites")
+
+if __name__ == "__main__":
+    main()
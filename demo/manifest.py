@@ -0,0 +1,63 @@
+# Run manifest: one JSON line per completed input file, appended as soon as its output is on disk,
+# so an interrupted run can be resumed and a growing corpus reprocessed incrementally.
+#
+# An entry is trusted on --resume when the input still hashes the same, the run settings (model,
+# prompt, switches that change the output) are the same and the output file still exists.
+import json
+import os
+
+from result_cache import content_hash
+
+
+def settings_hash(**settings):
+    return content_hash(json.dumps(settings, sort_keys=True, ensure_ascii=False))
+
+
+class Manifest:
+    def __init__(self, path, settings, resume=False):
+        self.path = path
+        self.settings = settings
+        self.entries = {}  # input name -> latest entry
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by a crash
+                    self.entries[entry["name"]] = entry
+        # Start from a compacted copy, replaced atomically; later entries are appended line by line
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def status(self, name, text_hash):
+        # "done", "changed" (input or settings differ from the recorded run) or "new"
+        entry = self.entries.get(name)
+        if entry is None:
+            return "new"
+        if entry["hash"] != text_hash or entry["settings"] != self.settings:
+            return "changed"
+        return "done" if os.path.exists(entry["output"]) else "new"
+
+    def record(self, name, text_hash, output, prompt_tokens, completion_tokens):
+        entry = {
+            "name": name,
+            "hash": text_hash,
+            "settings": self.settings,
+            "output": output,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        self.entries[name] = entry
+        # One write per line and an fsync, so a crash loses at most the entry being written
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
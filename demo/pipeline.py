@@ -0,0 +1,93 @@
+# Building blocks for streaming a corpus through an engine with bounded memory: a lazy reader,
+# per-file bookkeeping of chunk results, and a background writer so disk I/O overlaps inference.
+# infer-batch.py wires them around the vLLM engine loop.
+import os
+import queue
+import threading
+
+from chunking import reassemble
+from latin import lost_placeholders, unmask_latin
+
+WRITER_QUEUE = 64  # pending writes before the producer blocks
+
+
+def list_inputs(input_dir):
+    # Names only, so even a very large corpus is cheap to hold
+    return sorted(entry.name for entry in os.scandir(input_dir) if entry.name.endswith(".txt") and entry.is_file())
+
+
+def read_inputs(input_dir, names):
+    # One file in memory at a time
+    for name in names:
+        with open(os.path.join(input_dir, name), "r", encoding="utf-8") as f:
+            yield name, f.read().strip()
+
+
+def write_text(path, text):
+    # Written next to the target and renamed, so an interrupted run never leaves half a file behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class FileJob:
+    """The chunks of one input file and their results as they come in."""
+
+    def __init__(self, name, chunks, latin=None, source_hash=None):
+        self.name = name
+        self.source_hash = source_hash  # content hash of the input, for the run manifest
+        self.chunks = chunks
+        self.latin = latin or []
+        self.results = [None] * len(chunks)
+        self.fresh = set()   # chunks generated by the engine in this run (not resolved, cached or shared)
+        self.remaining = len(chunks)
+
+    def fill(self, index, result, fresh=False):
+        # Returns True once every chunk has its result
+        self.results[index] = result
+        if fresh:
+            self.fresh.add(index)
+        self.remaining -= 1
+        return self.remaining == 0
+
+    def output_text(self):
+        # Stitch the chunk outputs together and put the Latin back; a chunk whose output lost a
+        # placeholder keeps its input text, so no Latin goes missing
+        outputs = [result["text"] for result in self.results]
+        for index, chunk in enumerate(self.chunks):
+            if self.latin and lost_placeholders(chunk.text, outputs[index]):
+                print(f"Output of {self.name} chunk {index + 1} lost Latin placeholders, keeping its input text")
+                outputs[index] = chunk.text
+        text = reassemble(self.chunks, outputs)
+        return unmask_latin(text, self.latin)[0] if self.latin else text
+
+
+class Writer:
+    """Runs write tasks in order on a background thread; the first failure is raised in the caller."""
+
+    def __init__(self, max_pending=WRITER_QUEUE):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while (task := self.queue.get()) is not None:
+            function, args = task
+            if self.error is None:
+                try:
+                    function(*args)
+                except Exception as e:
+                    self.error = e
+
+    def submit(self, function, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((function, args))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
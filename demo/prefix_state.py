@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+# Saved states sit next to the GGUF files; like the models they are not tracked in git
+DEFAULT_STATE_DIR = os.path.join("models", "prefix-state")
+
+
+def prefix_tokens(llm, prefix_text):
+    # Same tokenization as Llama.create_completion and the chat handlers: BOS + special tokens parsed
+    return llm.tokenize(prefix_text.encode("utf-8"), add_bos=True, special=True)
+
+
+def state_path(llm, tokens, state_dir=DEFAULT_STATE_DIR):
+    # A state is only valid for the exact model file, context layout and prefix tokens
+    model_path = llm.model_path
+    stat = os.stat(model_path)
+    identity = [
+        os.path.basename(model_path), stat.st_size, int(stat.st_mtime),
+        llm.n_ctx(), llm.n_batch, bool(llm.context_params.logits_all),
+        hashlib.sha256(json.dumps(tokens).encode("utf-8")).hexdigest(),
+    ]
+    key = hashlib.sha256(json.dumps(identity).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(state_dir, f"{os.path.basename(model_path)}-{key}.state")
+
+
+def restore_prefix(llm, prefix_text, state_dir=DEFAULT_STATE_DIR):
+    """Make sure the KV cache of llm holds prefix_text, restoring it from disk when possible.
+
+    Llama.generate reuses the longest common token prefix of the loaded state, so any prompt that
+    starts with prefix_text only evaluates the remainder. Returns how the prefix got there.
+    """
+    start = time.time()
+    tokens = prefix_tokens(llm, prefix_text)
+    if llm.n_tokens >= len(tokens) and llm.input_ids[:len(tokens)].tolist() == tokens:
+        return "in memory", 0.0
+
+    path = state_path(llm, tokens, state_dir)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            llm.load_state(pickle.load(f))
+        return "restored", time.time() - start
+
+    llm.reset()
+    llm.eval(tokens)
+    state = llm.save_state()
+    os.makedirs(state_dir, exist_ok=True)
+    # Write to a temporary file first so a concurrent run never reads a half-written state
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return "computed", time.time() - start
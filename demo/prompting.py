@@ -0,0 +1,198 @@
+import argparse
+import functools
+import os
+import sys
+
+import jinja2
+import jinja2.sandbox
+
+# The prompt files end with the rules block, a "Tekst:" line and then the passage to modernize.
+PASSAGE_MARKER = "Tekst:"
+
+
+def split_passage(prompt: str):
+    # Returns (instruction, passage). Without a marker the whole prompt is treated as passage,
+    # which degrades to plain prompt lookup for the draft model.
+    marker = prompt.rfind(PASSAGE_MARKER)
+    if marker == -1:
+        return "", prompt.strip()
+    end = marker + len(PASSAGE_MARKER)
+    return prompt[:end].strip(), prompt[end:].strip()
+
+
+def join_passage(instruction: str, passage: str):
+    # Inverse of split_passage, used to build a prompt for one chunk of the passage
+    return f"{instruction}\n\n{passage}" if instruction else passage
+
+
+# Stand-in passage used to locate where the passage starts in a fully formatted prompt
+PASSAGE_SENTINEL = "\x00PASSAGE\x00"
+
+
+def prefix_before_passage(build_prompt, instruction: str):
+    # The formatted prompt text that is identical for every passage, e.g. for prefix KV reuse
+    prompt = build_prompt(join_passage(instruction, PASSAGE_SENTINEL))
+    return prompt[:prompt.index(PASSAGE_SENTINEL)]
+
+
+# Prompt templates per model, compiled once with Jinja2; system, instruction and input are filled in
+TEMPLATES = {
+    "Qwen/Qwen2.5-32B-Instruct-AWQ": """<|im_start|>system
+{{ system }}
+<|im_end|>
+<|im_start|>user
+{{ instruction }}
+
+{{ input }}
+<|im_end|>
+<|im_start|>assistant
+""",
+    "unsloth/gemma-3-27b-it-bnb-4bit": """<start_of_turn>user
+{{ system }}
+{{ instruction }}
+
+{{ input }}
+<end_of_turn>
+<start_of_turn>model
+""",
+}
+# Default to old Mistral style
+DEFAULT_TEMPLATE = "[INST] {{ system }}\n\n{{ instruction }}\n\n{{ input }} [/INST]"
+
+# Conversations for the single-prompt scripts (Mistral instruct: the system message goes in front of
+# the first user turn by the caller)
+MISTRAL_MESSAGES = (
+    "{%- for message in messages -%}"
+    "{%- if message.role == 'user' -%}"
+    "{%- if loop.index0 % 2 != 0 -%}{{ raise_exception('Conversation roles must alternate user/assistant/user/assistant/...') }}{%- endif -%}"
+    "[INST] {{ message.content }} [/INST]"
+    "{%- elif message.role == 'assistant' -%}"
+    "{%- if loop.index0 % 2 == 0 -%}{{ raise_exception('Conversation roles must alternate user/assistant/user/assistant/...') }}{%- endif -%}"
+    "{{ message.content }}{{ eos_token }}"
+    "{%- else -%}{{ raise_exception('Only user and assistant roles are supported!') }}{%- endif -%}"
+    "{%- endfor -%}"
+)
+
+
+def _raise_exception(message):
+    raise Exception(message)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(source):
+    # Same environment as transformers' chat templates, except that the trailing newline of a template
+    # is part of the prompt
+    environment = jinja2.sandbox.ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True)
+    environment.globals["raise_exception"] = _raise_exception
+    return environment.from_string(source)
+
+
+def get_template(model_name):
+    return TEMPLATES.get(model_name, DEFAULT_TEMPLATE)
+
+
+def format_prompt(system_message, instruction, input_text, model_name):
+    return compile_template(get_template(model_name)).render(system=system_message, instruction=instruction, input=input_text)
+
+
+def format_messages(messages, template=MISTRAL_MESSAGES, eos_token="</s>"):
+    return compile_template(template).render(messages=messages, eos_token=eos_token)
+
+
+def format_chat(template_source, messages, bos_token="", eos_token=""):
+    # A model's own chat template (GGUF tokenizer.chat_template, HF chat_template). The backends add BOS
+    # when they tokenize, so a BOS the template writes itself is dropped
+    prompt = compile_template(template_source).render(messages=messages, tools=None, bos_token=bos_token, eos_token=eos_token, add_generation_prompt=True)
+    return prompt[len(bos_token):] if bos_token and prompt.startswith(bos_token) else prompt
+
+
+# Inputs that start with the characters a passage can start with; a prefix split is only used when
+# concatenated token IDs equal full-string tokenization for all of them
+PROBES = ("Dit", "dit", " Dit", "\nDit", "«Dit»", "\"Dit\"", "(1)", "1.", "—", "[L1] Dit", "Art. 6°")
+
+
+class PromptTokens:
+    """Token IDs of prompts that differ only in their input.
+
+    template_text is a full prompt with PASSAGE_SENTINEL where the input goes, tokenize(text, bos) the
+    backend's tokenizer (special tokens parsed, BOS only when asked). The constant text before the
+    input is tokenized once; each prompt is that prefix's IDs plus the tokenization of the rest. Token
+    merges across the split or a tokenizer that adds a space in front of every text would make that
+    differ from tokenizing the whole prompt, so the split is moved back to the last line break (and
+    finally to the start) until every probe input tokenizes identically both ways.
+    """
+
+    def __init__(self, template_text, tokenize, probes=PROBES):
+        self.head, self.tail = template_text.split(PASSAGE_SENTINEL)
+        self.tokenize = tokenize
+        self.cut = 0
+        self.prefix_ids = []
+        cuts = [len(self.head)] + [i + 1 for i in range(len(self.head) - 1, -1, -1) if self.head[i] == "\n"]
+        for cut in cuts:
+            prefix_ids = tokenize(self.head[:cut], True)
+            if all(prefix_ids + tokenize(self.head[cut:] + probe + self.tail, False) == tokenize(self.text(probe), True) for probe in probes):
+                self.cut, self.prefix_ids = cut, prefix_ids
+                break
+
+    def text(self, input_text):
+        return self.head + input_text + self.tail
+
+    def ids(self, input_text):
+        if not self.cut:
+            return self.tokenize(self.text(input_text), True)
+        return self.prefix_ids + self.tokenize(self.head[self.cut:] + input_text + self.tail, False)
+
+
+def prompt_tokens(system_message, instruction, model_name, tokenize):
+    return PromptTokens(format_prompt(system_message, instruction, PASSAGE_SENTINEL, model_name), tokenize)
+
+
+def hf_tokenize(tokenizer):
+    # vLLM tokenizes text prompts with add_special_tokens=True
+    return lambda text, bos: tokenizer.encode(text, add_special_tokens=bos)
+
+
+def llama_cpp_tokenize(llm):
+    # Same as Llama.create_completion for a text prompt
+    return lambda text, bos: llm.tokenize(text.encode("utf-8"), add_bos=bos, special=True)
+
+
+def main():
+    # Check that concatenated token IDs are identical to tokenizing the full prompt for real inputs
+    parser = argparse.ArgumentParser(description="Check pre-tokenized prompts against full-string tokenization")
+    parser.add_argument("model", help="GGUF file (llama_cpp vocabulary) or Hugging Face model name")
+    parser.add_argument("--inputs", dest="inputs", default="/hfcache/input", help="Directory of .txt passages")
+    parser.add_argument("--system", dest="system", default="Je bent een tekstredacteur.", help="System message")
+    parser.add_argument("--prefix-file", dest="prefix_file", default=os.path.join(os.path.dirname(__file__), "..", "prompt-prefix.txt"), help="Instruction")
+    args = parser.parse_args()
+
+    if args.model.endswith(".gguf"):
+        from llama_cpp import Llama
+        tokenize = llama_cpp_tokenize(Llama(model_path=args.model, vocab_only=True, verbose=False))
+        model_name = os.path.basename(args.model)
+    else:
+        from transformers import AutoTokenizer
+        tokenize = hf_tokenize(AutoTokenizer.from_pretrained(args.model, cache_dir="/hfcache/hub/"))
+        model_name = args.model
+    with open(args.prefix_file, "r", encoding="utf-8") as f:
+        instruction = f.read().strip()
+    prompts = prompt_tokens(args.system, instruction, model_name, tokenize)
+    print(f"Prefix: {len(prompts.prefix_ids)} tokens tokenized once ({prompts.cut} of {len(prompts.head)} characters before the input)")
+
+    checked = mismatches = 0
+    for name in sorted(os.listdir(args.inputs)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(args.inputs, name), "r", encoding="utf-8") as f:
+            text = f.read().strip()
+        # The whole file and each paragraph, as chunks start at paragraph or sentence boundaries
+        for piece in [text] + [paragraph for paragraph in text.split("\n\n") if paragraph.strip()]:
+            checked += 1
+            if prompts.ids(piece) != tokenize(prompts.text(piece), True):
+                mismatches += 1
+                print(f"Mismatch in {name}: {piece[:60]!r}")
+    print(f"{checked} prompts checked, {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# Output quality of a spelling pass, so a speed option (speculative decoding, prefix caching, a
+# quantized model) is never judged on tokens/s alone. Input, output and an optional reference text
+# are aligned word by word and scored on:
+#   changed_word_rate     share of input words the output changed
+#   forbidden_edit_rate   share of input words with an edit a spelling pass must not make: a deleted
+#                         or inserted word, a replacement by a different word, a changed number or a
+#                         changed word inside a Latin passage
+#   reference_accuracy    1 - word error rate of the output against the reference
+#   correction_recall     share of the reference's changes the output made as well
+# Character and word edit distances are Levenshtein distances computed for the whole corpus at once
+# with NumPy, so scoring a full run takes seconds.
+#
+#   python demo/quality.py --outputs /hfcache/output --output-prefix X [--references DIR]
+#
+# benchmark.py attaches the corpus scores to every run record.
+import argparse
+import difflib
+import json
+import os
+import re
+
+import numpy as np
+
+from latin import latin_spans
+
+WORD = re.compile(r'\w+')
+MAX_WORD_EDIT_RATIO = 0.5  # character edits relative to the longer word; more is another word, not a respelling
+WORD_EDIT_SLACK = 2        # edits always tolerated, for short words ('hy' -> 'hij')
+BATCH_SIZE = 4096          # pairs per NumPy batch; pairs are sorted by length so padding stays small
+
+
+def _codes(sequence):
+    return [ord(c) for c in sequence] if isinstance(sequence, str) else list(sequence)
+
+
+def _batch_distances(pairs):
+    # Row by row over the first sequences, vectorized over the pairs and the columns: deletions and
+    # substitutions come from the previous row, insertions along the row are a running minimum of
+    # row[k] + (j - k), i.e. np.minimum.accumulate(row - j) + j
+    a_lengths = np.array([len(a) for a, _ in pairs])
+    b_lengths = np.array([len(b) for _, b in pairs])
+    rows = np.arange(len(pairs))
+    # Padding never matches: -1 in the first sequences, -2 in the second
+    a = np.full((len(pairs), a_lengths.max(initial=0)), -1, dtype=np.int64)
+    b = np.full((len(pairs), b_lengths.max(initial=0)), -2, dtype=np.int64)
+    for n, (x, y) in enumerate(pairs):
+        a[n, :len(x)] = _codes(x)
+        b[n, :len(y)] = _codes(y)
+    columns = np.arange(b.shape[1] + 1)
+    row = np.tile(columns, (len(pairs), 1))
+    distances = row[rows, b_lengths]
+    for i in range(a.shape[1]):
+        step = np.empty_like(row)
+        step[:, 0] = i + 1
+        step[:, 1:] = np.minimum(row[:, 1:] + 1, row[:, :-1] + (a[:, i:i + 1] != b))
+        row = np.minimum.accumulate(step - columns, axis=1) + columns
+        done = a_lengths == i + 1
+        distances[done] = row[done, b_lengths[done]]
+    return distances
+
+
+def edit_distances(pairs, batch_size=BATCH_SIZE):
+    """Levenshtein distance of every (a, b) pair, as a NumPy array.
+
+    a and b are strings or sequences of non-negative ints (e.g. word ids).
+    """
+    distances = np.zeros(len(pairs), dtype=np.int64)
+    order = sorted(range(len(pairs)), key=lambda n: (len(pairs[n][0]), len(pairs[n][1])))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        distances[batch] = _batch_distances([pairs[n] for n in batch])
+    return distances
+
+
+def words(text):
+    # [(word, inside a Latin passage)]
+    spans = latin_spans(text)
+    return [(match.group(), any(start <= match.start() < end for start, end in spans)) for match in WORD.finditer(text)]
+
+
+def align(source_words, target_words):
+    # (i, j) index pairs along difflib's word alignment; i or j is None for an inserted or deleted word
+    matcher = difflib.SequenceMatcher(None, source_words, target_words, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        for k in range(max(i2 - i1, j2 - j1)):
+            yield (i1 + k if i1 + k < i2 else None), (j1 + k if j1 + k < j2 else None)
+
+
+def score_corpus(sources, outputs, references=None):
+    """Scores of outputs against their sources (and references, when given).
+
+    Returns {"documents": [per document scores], "summary": corpus scores}; rates are word-weighted.
+    """
+    documents = []
+    substitutions = []  # (document, source word, output word, forbidden regardless of distance)
+    for number, (source, output) in enumerate(zip(sources, outputs)):
+        source_words = words(source)
+        output_words = [word for word, _ in words(output)]
+        counts = {"words": len(source_words), "changed": 0, "forbidden": 0}
+        for i, j in align([word for word, _ in source_words], output_words):
+            if i is None or j is None:
+                counts["changed"] += i is not None
+                counts["forbidden"] += 1
+            elif source_words[i][0] != output_words[j]:
+                counts["changed"] += 1
+                word, latin = source_words[i]
+                substitutions.append((number, word, output_words[j], latin or word.isdigit() or output_words[j].isdigit()))
+        documents.append(counts)
+
+    distances = edit_distances([(old, new) for _, old, new, _ in substitutions])
+    for (number, old, new, forbidden), distance in zip(substitutions, distances):
+        if forbidden or distance > max(WORD_EDIT_SLACK, MAX_WORD_EDIT_RATIO * max(len(old), len(new))):
+            documents[number]["forbidden"] += 1
+
+    if references is not None:
+        vocabulary = {}
+        pairs = []
+        for number, (source, output, reference) in enumerate(zip(sources, outputs, references)):
+            if reference is None:
+                continue
+            source_words = [word for word, _ in words(source)]
+            output_words = [word for word, _ in words(output)]
+            reference_words = [word for word, _ in words(reference)]
+            pairs.append(([vocabulary.setdefault(word, len(vocabulary)) for word in output_words],
+                          [vocabulary.setdefault(word, len(vocabulary)) for word in reference_words]))
+            # Which source words the reference changes, and whether the output changed them the same way
+            output_for = dict(align(source_words, output_words))
+            needed = made = 0
+            for i, j in align(source_words, reference_words):
+                if i is not None and j is not None and source_words[i] != reference_words[j]:
+                    needed += 1
+                    made += output_for.get(i) is not None and output_words[output_for[i]] == reference_words[j]
+            documents[number].update(reference_words=len(reference_words), reference_errors=0, needed=needed, made=made)
+        scored = [counts for counts in documents if "reference_words" in counts]
+        for counts, distance in zip(scored, edit_distances(pairs)):
+            counts["reference_errors"] = int(distance)
+
+    for counts in documents:
+        counts.update(_rates(counts))
+    total = {}
+    for counts in documents:
+        for key in ("words", "changed", "forbidden", "reference_words", "reference_errors", "needed", "made"):
+            if key in counts:
+                total[key] = total.get(key, 0) + counts[key]
+    return {"documents": documents, "summary": dict(total, **_rates(total))}
+
+
+def _rates(counts):
+    rates = {
+        "changed_word_rate": counts["changed"] / counts["words"] if counts["words"] else 0.0,
+        "forbidden_edit_rate": counts["forbidden"] / counts["words"] if counts["words"] else 0.0,
+    }
+    if "reference_words" in counts:
+        rates["reference_accuracy"] = max(0.0, 1 - counts["reference_errors"] / counts["reference_words"]) if counts["reference_words"] else 1.0
+        rates["correction_recall"] = counts["made"] / counts["needed"] if counts["needed"] else 1.0
+    return rates
+
+
+def load_references(reference_dir, names):
+    # Reference text per document name, None where there is none
+    references = []
+    for name in names:
+        path = os.path.join(reference_dir, name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                references.append(f.read().strip())
+        else:
+            references.append(None)
+    return references
+
+
+def format_summary(summary):
+    text = f"changed {summary['changed_word_rate']:.1%}, forbidden {summary['forbidden_edit_rate']:.2%}"
+    if "reference_accuracy" in summary:
+        text += f", reference accuracy {summary['reference_accuracy']:.1%}, correction recall {summary['correction_recall']:.1%}"
+    return text
+
+
+def main():
+    from prompting import split_passage
+
+    parser = argparse.ArgumentParser(description="Score spelling-pass outputs against their inputs and optional references")
+    parser.add_argument("--inputs", dest="inputs", default="/hfcache/input", help="Directory of input .txt passages")
+    parser.add_argument("--outputs", dest="outputs", default="/hfcache/output", help="Directory of outputs")
+    parser.add_argument("--output-prefix", dest="output_prefix", default="", help="Prefix of the output files (without the trailing _)")
+    parser.add_argument("--references", dest="references", default=None, help="Directory of reference outputs, named like the inputs")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the per-document scores to this file")
+    args = parser.parse_args()
+
+    prefix = args.output_prefix + "_" if args.output_prefix else ""
+    names, sources, outputs = [], [], []
+    for name in sorted(f for f in os.listdir(args.inputs) if f.endswith(".txt")):
+        output_path = os.path.join(args.outputs, prefix + name)
+        if not os.path.exists(output_path):
+            continue
+        with open(os.path.join(args.inputs, name), "r", encoding="utf-8") as f:
+            sources.append(split_passage(f.read().strip())[1])
+        with open(output_path, "r", encoding="utf-8") as f:
+            outputs.append(f.read().strip())
+        names.append(name)
+    if not names:
+        print(f"No outputs for the inputs in '{args.inputs}' found in '{args.outputs}'.")
+        return
+    references = load_references(args.references, names) if args.references else None
+
+    scores = score_corpus(sources, outputs, references)
+    for name, counts in zip(names, scores["documents"]):
+        print(f"{name}: {counts['words']} words, {format_summary(counts)}")
+    print(f"Total: {scores['summary']['words']} words, {format_summary(scores['summary'])}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(dict(scores, names=names), f, indent=2)
+
+if __name__ == "__main__":
+    main()
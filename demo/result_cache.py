@@ -0,0 +1,51 @@
+import hashlib
+import json
+
+import diskcache
+
+DEFAULT_CACHE_DIR = "/hfcache/cache/results"
+DEFAULT_SIZE_LIMIT_GB = 4
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Persistent chunk-level result cache.
+
+    Keys are content addresses: anything that can change the output of a chunk (model, chat
+    template, instruction prefix, sampling parameters, the chunk itself) is hashed into the key,
+    so editing one input file or one flag only invalidates the affected entries. Old entries are
+    evicted least-recently-used once the cache grows past size_limit bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, size_limit_gb=DEFAULT_SIZE_LIMIT_GB):
+        self.cache = diskcache.Cache(directory, size_limit=int(size_limit_gb * 2**30), eviction_policy="least-recently-used")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, template, prefix, sampling, chunk_text):
+        parts = {
+            "model": model,
+            "template": content_hash(template),
+            "prefix": content_hash(prefix),
+            "sampling": sampling,
+            "chunk": content_hash(chunk_text),
+        }
+        return content_hash(json.dumps(parts, sort_keys=True))
+
+    def get(self, key):
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, key, result):
+        self.cache.set(key, result)
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,126 @@
+# One entry point for the demo scripts, built to start fast: nothing heavy is imported before the
+# chosen command needs it, so --help and usage errors return at once, and model start-up is reported
+# phase by phase (startup.py).
+import argparse
+import os
+import runpy
+import sys
+import time
+
+DEMO_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = ("serve", "submit")
+USAGE = """usage:
+  python demo/run.py SCRIPT [args ...]        run demo/SCRIPT.py, e.g. infer-batch, benchmark, cascade
+  python demo/run.py serve [--model M.gguf] [--mlock] [--max-jobs N]   GGUF fork server (fork_server.py)
+  python demo/run.py submit FILE_OR_DIR ... [--output-prefix X]       send a job to the fork server
+  python demo/run.py --list                   list the commands and scripts"""
+
+
+def scripts():
+    # Runnable scripts: the hyphenated ones plus modules that have a command line of their own
+    names = []
+    for name in sorted(os.listdir(DEMO_DIR)):
+        if not name.endswith(".py") or name == "run.py":
+            continue
+        with open(os.path.join(DEMO_DIR, name), "r", encoding="utf-8") as f:
+            if "-" in name or "__main__" in f.read():
+                names.append(name[:-3])
+    return names
+
+
+def run_script(name, argv):
+    path = os.path.join(DEMO_DIR, name if name.endswith(".py") else name + ".py")
+    if not os.path.exists(path):
+        print(f"Unknown script '{name}'. Available: {', '.join(COMMANDS + tuple(scripts()))}")
+        sys.exit(2)
+    sys.argv = [path] + argv
+    runpy.run_path(path, run_name="__main__")
+
+
+def serve(argv):
+    from fork_server import MAX_JOBS, SOCKET_PATH, ForkServer
+    from startup import DEFAULT_LOG, Phases
+
+    parser = argparse.ArgumentParser(prog="run.py serve", description="Load a GGUF model once and fork a child per job")
+    parser.add_argument("--model", dest="model", default="./models/Mistral-7B-Instruct-v0.3-Q4_K_M.gguf", help="GGUF model file")
+    parser.add_argument("--socket", dest="socket", default=SOCKET_PATH, help="Unix socket to serve on")
+    parser.add_argument("--mlock", dest="mlock", action="store_true", help="Lock the mapped weights in RAM so they are never paged out between jobs")
+    parser.add_argument("--max-jobs", dest="max_jobs", type=int, default=MAX_JOBS, help="Jobs running at once; the rest wait")
+    parser.add_argument("--startup-log", dest="startup_log", default=DEFAULT_LOG, help="JSON-lines file the start-up phases are appended to")
+    args = parser.parse_args(argv)
+
+    phases = Phases("fork-server")
+    with phases.phase("import llama_cpp"):
+        import llama_cpp  # noqa: F401
+        from engines import create_engine
+        from prefix_state import restore_prefix
+        from tuning import load_profile
+    tuned = load_profile(args.model)
+    if tuned:
+        print(f"Using tuned parameters: {tuned}")
+    n_ctx = tuned.get("n_ctx", 4096)
+    with phases.phase("load weights"):
+        # mmap keeps the weights in the page cache, which every forked child shares
+        engine = create_engine("llama_cpp", args.model, n_ctx=n_ctx, n_threads=tuned.get("n_threads", 8), n_batch=tuned.get("n_batch", 512),
+                               draft_tokens=tuned.get("draft_tokens", 0), logits_all=tuned.get("logits_all", False),
+                               use_mmap=True, use_mlock=args.mlock)
+    with open(os.path.join(DEMO_DIR, "..", "prompt-prefix.txt"), "r", encoding="utf-8") as f:
+        instruction = f.read().strip()
+    server = ForkServer(engine, args.model, instruction, n_ctx, phases, args.max_jobs)
+    with phases.phase("prefix"):
+        prefix_status, _ = restore_prefix(engine.llm, server.prefix_text())
+    with phases.phase("warm-up"):
+        # Decodes past the prefix once, so every weight page is resident before the first child runs
+        engine.generate([server.prefix_text() + "Dit"], [{"temperature": 0, "max_tokens": 1}])
+    phases.report(args.startup_log, model=os.path.basename(args.model), backend="llama_cpp", mlock=args.mlock, prefix=prefix_status)
+    try:
+        server.serve(args.socket)
+    except KeyboardInterrupt:
+        print("Fork server stopped")
+
+
+def submit(argv):
+    from fork_server import DEFAULT_OUTPUT_DIR, SOCKET_PATH, submit as submit_job
+
+    parser = argparse.ArgumentParser(prog="run.py submit", description="Send input files to a running fork server")
+    parser.add_argument("inputs", nargs="+", help="Input .txt files or directories of them")
+    parser.add_argument("--socket", dest="socket", default=SOCKET_PATH, help="Unix socket of the fork server")
+    parser.add_argument("--output-dir", dest="output_dir", default=DEFAULT_OUTPUT_DIR, help="Where the outputs are written")
+    parser.add_argument("--output-prefix", dest="output_prefix", default=None, help="Prefix for the output files")
+    args = parser.parse_args(argv)
+
+    inputs = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            inputs.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".txt")))
+        else:
+            inputs.append(path)
+    start = time.time()
+    job = {"inputs": [os.path.abspath(path) for path in inputs], "output_dir": os.path.abspath(args.output_dir), "output_prefix": args.output_prefix}
+    for message in submit_job(job, args.socket):
+        if "error" in message:
+            print(f"Error: {message['error']}")
+            sys.exit(1)
+        if message.get("done"):
+            print(f"Done: {message['files']} files in {time.time() - start:.2f}s (fork {message['fork_seconds'] * 1000:.1f}ms, "
+                  f"first file after {message['first_file_seconds'] or 0:.2f}s; server start-up was {sum(message['startup'].values()):.2f}s)")
+        else:
+            print(f"{message['file']}: {message['chunks']} chunks in {message['seconds']:.2f}s, {message['completion_tokens']} completion tokens")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(USAGE)
+        return
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "--list":
+        print("\n".join(COMMANDS + tuple(scripts())))
+    elif command == "serve":
+        serve(argv)
+    elif command == "submit":
+        submit(argv)
+    else:
+        run_script(command, argv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# Index of past runs: the *-response.txt files the scripts leave in the project root and the
+# *_inference_log.txt lines infer-batch.py writes, parsed into one SQLite table so runs can be
+# compared per model and hardware, plus a regression check against the historical best.
+#
+#   python demo/run_index.py index [PATH ...]            (default: project root and /hfcache/output)
+#   python demo/run_index.py report
+#   python demo/run_index.py check NEW_FILE [--threshold 0.1]   exits 1 on a regression
+#
+# Response file names encode the run:
+#   2025-12-27-20-53-37-<model>-response.txt                  (no timings)
+#   2025-12-28-20-19-<model>-<init>-<infer>-response.txt
+#   infer[-raw]-<date>-<model>-<init>-<infer>-response.txt
+#   infer-vllm-<date>-<model>-<gpu>-<init>-<infer>[-<prompt file>]-response.txt
+# Token counts of response files are estimates (words, punctuation and newlines), consistent across
+# runs but not the model's own tokenizer; inference logs carry the engine's counts.
+import argparse
+import datetime
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+from prompting import PASSAGE_MARKER, split_passage
+from runaway import BLANK_RUN_STOP, RunawayDetector
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "runs.sqlite")
+DEFAULT_THRESHOLD = 0.10
+# Finished texts: share of word 8-grams (numbers as one word) seen earlier in the same answer, beyond
+# the input's own share. Sane outputs in the response files stay under 5%, loops are at 65% and up.
+REPEAT_NGRAM = 8
+MAX_REPEATED_SHARE = 0.3
+
+RESPONSE_NAME = re.compile(
+    r'^(?:(?P<script>infer(?:-raw|-vllm)?)-)?(?P<date>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}(?:-\d{2})?)-(?P<rest>.+)-response\.txt$'
+)
+TIMINGS = re.compile(r'^(?P<name>.+?)-(?P<init>\d+\.\d{2})-(?P<infer>\d+\.\d{2})(?:-(?P<tag>[A-Za-z0-9._-]+))?$')
+GPU_SUFFIX = re.compile(r'-(?P<gpu>(?:NVIDIA|AMD|Tesla|Quadro|CPU)[A-Za-z0-9._-]*)$')
+
+ASSISTANT_MARKERS = ("[/INST]", "<|assistant|>", "<|im_start|>assistant", "<start_of_turn>model")
+TURN_MARKERS = ("[INST]", "<|user|>", "<|system|>", "<|im_start|>user", "<|im_start|>system", "<start_of_turn>user")
+END_MARKERS = ("</s>", "<|im_end|>", "<end_of_turn>")
+MARKER = re.compile("|".join(re.escape(marker) for marker in ASSISTANT_MARKERS + TURN_MARKERS))
+TOKEN = re.compile(r'\w+|[^\w\s]|\n')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    source TEXT PRIMARY KEY,        -- file path, with :<line> for inference log lines
+    kind TEXT,                      -- 'response' or 'log'
+    script TEXT,
+    timestamp TEXT,
+    model TEXT,
+    hardware TEXT,
+    backend TEXT,
+    tag TEXT,
+    init_seconds REAL,
+    warmup_seconds REAL,
+    infer_seconds REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    tokens_per_second REAL,
+    flags TEXT,
+    cache_hits INTEGER,
+    cache_misses INTEGER,
+    runaway_chunks INTEGER,
+    degenerate TEXT                 -- reason, NULL when the output looks sane
+);
+CREATE INDEX IF NOT EXISTS runs_model_hardware ON runs (model, hardware);
+"""
+COLUMNS = ("source", "kind", "script", "timestamp", "model", "hardware", "backend", "tag", "init_seconds",
+           "warmup_seconds", "infer_seconds", "prompt_tokens", "completion_tokens", "tokens_per_second", "flags",
+           "cache_hits", "cache_misses", "runaway_chunks", "degenerate")
+
+
+def sanitize_filename(s: str, replacement: str = "_") -> str:
+    # Same as the scripts use for output names, so log lines group with the response files
+    return re.sub(r'[^A-Za-z0-9._-]', replacement, s)
+
+
+def count_tokens(text):
+    return len(TOKEN.findall(text))
+
+
+def split_transcript(text):
+    # Returns (prompt segments, output text): everything after an assistant marker up to the next turn is output
+    prompts, answers = split_answers(text)
+    return prompts, "\n".join(answers)
+
+
+def split_answers(text):
+    # Like split_transcript, with each assistant turn as a text of its own
+    prompts, outputs = [], []
+    current, position = prompts, 0
+    for match in MARKER.finditer(text):
+        current.append(text[position:match.start()])
+        current = outputs if match.group() in ASSISTANT_MARKERS else prompts
+        position = match.end()
+    current.append(text[position:])
+    if not outputs:
+        # No chat markup (e.g. a raw completion): treat the whole file as output
+        prompts, outputs = [], prompts
+    clean = []
+    for segment in outputs:
+        for marker in END_MARKERS:
+            segment = segment.replace(marker, "")
+        # Whitespace is kept: a run of blank lines is exactly what the degenerate check looks for
+        clean.append(segment.strip(" "))
+    return [segment for segment in prompts if segment.strip()], [segment for segment in clean if segment.strip(" ")]
+
+
+def repeated_share(text, n=REPEAT_NGRAM):
+    # Share of the word n-grams that occurred before; numbers count as one word, so a counting loop
+    # ("Question 3: What is 3 + 3?") repeats like any other
+    words = ["0" if token.isdigit() else token for token in TOKEN.findall(text.lower()) if token != "\n"]
+    grams = [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+    return 1 - len(set(grams)) / len(grams) if grams else 0.0
+
+
+def degenerate_reason(input_text, output_text):
+    # Same criteria as the live guard in runaway.py, applied to the finished text. input_text is the
+    # passage; without one (free-form questions) there is no expected length and only loops count.
+    if BLANK_RUN_STOP in output_text:
+        return "blank-line run"
+    ids = {}
+    token_ids = [ids.setdefault(token, len(ids)) for token in TOKEN.findall(output_text)]
+    # The detector looks at every position, so a loop in the middle of the output counts too
+    detector = RunawayDetector(count_tokens(input_text) if input_text is not None else len(token_ids))
+    if detector.check(token_ids):
+        return detector.reason
+    # Loops that vary (counting, or a sentence with a word swapped each time) have no fixed period
+    share = repeated_share(output_text) - (repeated_share(input_text) if input_text is not None else 0.0)
+    if share > MAX_REPEATED_SHARE:
+        return f"{share:.0%} of word {REPEAT_NGRAM}-grams repeated"
+    return None
+
+
+def parse_timestamp(text):
+    parts = [int(part) for part in text.split("-")]
+    return datetime.datetime(*parts).isoformat()
+
+
+def parse_response_file(path):
+    match = RESPONSE_NAME.match(os.path.basename(path))
+    if not match:
+        return None
+    run = dict.fromkeys(COLUMNS)
+    run.update(source=os.path.abspath(path), kind="response", script=match.group("script") or "",
+               timestamp=parse_timestamp(match.group("date")), hardware="")
+    rest = match.group("rest")
+    timings = TIMINGS.match(rest)
+    if timings:
+        rest = timings.group("name")
+        run.update(init_seconds=float(timings.group("init")), infer_seconds=float(timings.group("infer")), tag=timings.group("tag"))
+    gpu = GPU_SUFFIX.search(rest) if run["script"] == "infer-vllm" else None
+    if gpu:
+        rest = rest[:gpu.start()]
+        run["hardware"] = gpu.group("gpu")
+    run["model"] = rest
+    run["backend"] = "llama_cpp" if ".gguf" in rest.lower() else "vllm" if run["script"] == "infer-vllm" else ""
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    if text.startswith("# "):
+        text = text.partition("\n")[2]
+    prompts, answers = split_answers(text)
+    output = "\n".join(answers)
+    run["prompt_tokens"] = sum(count_tokens(segment) for segment in prompts)
+    run["completion_tokens"] = count_tokens(output)
+    if run["infer_seconds"]:
+        run["tokens_per_second"] = run["completion_tokens"] / run["infer_seconds"]
+    # Instructions are the same on every run; only the passages say how much output to expect
+    passages = [split_passage(segment)[1] for segment in prompts if PASSAGE_MARKER in segment]
+    # Per answer: files holding several answers to the same passage are not loops
+    passage = "\n".join(passages) if passages else None
+    run["degenerate"] = next(filter(None, (degenerate_reason(passage, answer) for answer in answers)), None)
+    return run
+
+
+def parse_log_line(path, line_number, line):
+    # datetime,model,gpu,init,warmup,infer,prompt_tokens,completion_tokens,flags[,cache_hits,cache_misses,runaway_chunks]
+    fields = line.strip().split(",")
+    if len(fields) < 9:
+        return None
+    run = dict.fromkeys(COLUMNS)
+    run.update(source=f"{os.path.abspath(path)}:{line_number}", kind="log", script="infer-batch", backend="vllm",
+               timestamp=datetime.datetime.fromisoformat(fields[0]).isoformat(), model=sanitize_filename(fields[1]), hardware=sanitize_filename(fields[2]),
+               tag=os.path.basename(path)[:-len("_inference_log.txt")].rstrip("_"),
+               init_seconds=float(fields[3]), warmup_seconds=float(fields[4]), infer_seconds=float(fields[5]),
+               prompt_tokens=int(fields[6]), completion_tokens=int(fields[7]), flags=fields[8])
+    # infer-batch-llama-cpp.py writes the same log with its backend among the flags
+    backend = re.search(r'(?:^|;)BACKEND=([^;]+)', run["flags"])
+    if backend:
+        run.update(script="infer-batch-llama-cpp", backend=backend.group(1))
+    if run["infer_seconds"]:
+        run["tokens_per_second"] = run["completion_tokens"] / run["infer_seconds"]
+    if len(fields) >= 12:
+        run.update(cache_hits=int(fields[9]), cache_misses=int(fields[10]), runaway_chunks=int(fields[11]))
+        if run["runaway_chunks"]:
+            run["degenerate"] = f"{run['runaway_chunks']} runaway chunk(s)"
+    return run
+
+
+def parse_path(path):
+    if path.endswith("_inference_log.txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [run for number, line in enumerate(f, 1) if line.strip() and (run := parse_log_line(path, number, line))]
+    run = parse_response_file(path)
+    return [run] if run else []
+
+
+def find_artifacts(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "*-response.txt")))
+            yield from sorted(glob.glob(os.path.join(path, "*_inference_log.txt")))
+        elif os.path.exists(path):
+            yield path
+
+
+def connect(db_path):
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    return db
+
+
+def store(db, runs):
+    db.executemany(
+        f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+        [tuple(run[column] for column in COLUMNS) for run in runs],
+    )
+    db.commit()
+
+
+def best_run(db, model, hardware, exclude=None):
+    # Fastest sane run with the same model and hardware; degenerate runs are fast for the wrong reason
+    return db.execute(
+        "SELECT * FROM runs WHERE model = ? AND hardware = ? AND source != ? AND degenerate IS NULL"
+        " AND tokens_per_second IS NOT NULL ORDER BY tokens_per_second DESC LIMIT 1",
+        (model, hardware, exclude or ""),
+    ).fetchone()
+
+
+def check_regression(db, run, threshold=DEFAULT_THRESHOLD):
+    # Returns (ok, message); throughput is compared because runs differ in input length
+    if run["tokens_per_second"] is None:
+        return True, f"{run['source']}: no timings, nothing to compare"
+    if run["degenerate"]:
+        return False, f"{run['source']}: degenerate output ({run['degenerate']})"
+    best = best_run(db, run["model"], run["hardware"], exclude=run["source"])
+    if best is None:
+        return True, f"{run['source']}: first run for {run['model']} on {run['hardware'] or 'unknown hardware'}"
+    slowdown = 1 - run["tokens_per_second"] / best["tokens_per_second"]
+    message = (f"{run['tokens_per_second']:.2f} tok/s vs best {best['tokens_per_second']:.2f} tok/s "
+               f"({os.path.basename(best['source'])}), {slowdown:+.1%} slower")
+    return slowdown <= threshold, message
+
+
+def print_report(db):
+    rows = db.execute(
+        "SELECT model, hardware, COUNT(*) AS runs, SUM(degenerate IS NOT NULL) AS degenerate,"
+        " MAX(tokens_per_second) AS best, AVG(tokens_per_second) AS mean, MIN(infer_seconds) AS fastest"
+        " FROM runs GROUP BY model, hardware ORDER BY model, hardware"
+    ).fetchall()
+    width = max([len("model / hardware")] + [len(f"{row['model']} / {row['hardware']}") for row in rows])
+    print(f"{'model / hardware':<{width}}  {'runs':>5}  {'degen':>5}  {'best tok/s':>10}  {'mean tok/s':>10}  {'fastest s':>9}")
+    for row in rows:
+        best = f"{row['best']:.2f}" if row["best"] is not None else "-"
+        mean = f"{row['mean']:.2f}" if row["mean"] is not None else "-"
+        fastest = f"{row['fastest']:.2f}" if row["fastest"] is not None else "-"
+        print(f"{row['model'] + ' / ' + row['hardware']:<{width}}  {row['runs']:>5}  {row['degenerate']:>5}  {best:>10}  {mean:>10}  {fastest:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index past inference runs and check new ones for regressions")
+    parser.add_argument("--db", dest="db", default=DEFAULT_DB, help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="Parse response files and inference logs into the database")
+    index.add_argument("paths", nargs="*", help="Files or directories (default: project root and /hfcache/output)")
+    commands.add_parser("report", help="Summarize indexed runs per model and hardware")
+    check = commands.add_parser("check", help="Compare new runs with the historical best; exits 1 on a regression")
+    check.add_argument("paths", nargs="+", help="New response files or inference logs")
+    check.add_argument("--threshold", dest="threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown as a fraction of the best throughput")
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.command == "index":
+        paths = args.paths or [os.path.dirname(DEFAULT_DB), "/hfcache/output"]
+        runs = [run for path in find_artifacts(paths) for run in parse_path(path)]
+        store(db, runs)
+        degenerate = sum(1 for run in runs if run["degenerate"])
+        print(f"Indexed {len(runs)} runs ({degenerate} degenerate) into {args.db}")
+    elif args.command == "report":
+        print_report(db)
+    else:
+        failed = False
+        for path in find_artifacts(args.paths):
+            for run in parse_path(path):
+                ok, message = check_regression(db, run, args.threshold)
+                print(f"{'OK  ' if ok else 'FAIL'} {message}")
+                failed = failed or not ok
+                store(db, [run])
+        sys.exit(1 if failed else 0)
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Detects degenerate generations (the model looping on blank lines or a short token pattern, or
+# writing far more than a spelling pass of the input can need) so they can be cut off early.
+from chunking import OUTPUT_MARGIN, OUTPUT_RATIO
+
+# A spelling pass never needs this many newlines in a row; used as a stop string on both backends,
+# which catches the blank-line loop even where no custom logits processor can run (vLLM V1).
+BLANK_RUN_STOP = "\n" * 8
+
+MAX_PERIOD = 64         # long enough for a repeated sentence
+MIN_REPEAT_TOKENS = 48
+MIN_REPEATS = 3         # a pattern longer than MIN_REPEAT_TOKENS / 3 must come three times in a row
+
+
+class RunawayDetector:
+    """Per-request detector; check() returns a reason string once the output looks degenerate."""
+
+    def __init__(self, input_tokens, max_ratio=OUTPUT_RATIO, min_budget=OUTPUT_MARGIN,
+                 max_period=MAX_PERIOD, min_repeat_tokens=MIN_REPEAT_TOKENS, whitespace_ids=None):
+        # The same length max_tokens_for (scheduling.py) gives the request, so an output that runs
+        # into max_tokens is reported as a runaway instead of being cut off silently
+        self.limit = int(input_tokens * max_ratio) + min_budget
+        self.max_period = max_period
+        self.min_repeat_tokens = min_repeat_tokens
+        self.whitespace_ids = whitespace_ids
+        self.reason = None
+        # Incremental state: runs[p] counts the latest tokens in a row equal to the token p before them
+        self._checked = 0
+        self._runs = [0] * (max_period + 1)
+
+    def _repeating(self, token_ids):
+        # Period of a pattern of up to max_period tokens repeated over max(min_repeat_tokens,
+        # MIN_REPEATS periods), else 0. Only tokens added since the last call are looked at, each
+        # against every period, so a step costs max_period comparisons however long the output is.
+        if len(token_ids) < self._checked:
+            self._checked, self._runs = 0, [0] * (self.max_period + 1)
+        runs = self._runs
+        for i in range(self._checked, len(token_ids)):
+            token = token_ids[i]
+            self._checked = i + 1
+            for period in range(1, min(self.max_period, i) + 1):
+                if token_ids[i - period] != token:
+                    runs[period] = 0
+                    continue
+                runs[period] += 1
+                if runs[period] + period >= max(self.min_repeat_tokens, MIN_REPEATS * period):
+                    return period
+        return 0
+
+    def _blank_run(self, token_ids):
+        # Mixed runs of whitespace-only tokens (" \n", "\n\n", ...) don't have to be periodic
+        if not self.whitespace_ids:
+            return False
+        tail = token_ids[-self.min_repeat_tokens:]
+        return len(tail) == self.min_repeat_tokens and all(int(t) in self.whitespace_ids for t in tail)
+
+    def check(self, token_ids):
+        # token_ids are the output tokens generated so far
+        if self.reason is None:
+            period = self._repeating(token_ids)
+            if len(token_ids) >= self.limit:
+                self.reason = f"output reached the limit of {self.limit} tokens"
+            elif period:
+                self.reason = f"pattern of {period} token(s) repeated over {max(self.min_repeat_tokens, MIN_REPEATS * period)} tokens"
+            elif self._blank_run(token_ids):
+                self.reason = f"{self.min_repeat_tokens} whitespace-only tokens in a row"
+        return self.reason
+
+    def llama_cpp_stopping_criteria(self):
+        # llama_cpp passes the prompt plus the output so far; the first call marks where the output starts
+        prompt_len = None
+
+        def criteria(input_ids, logits):
+            nonlocal prompt_len
+            if prompt_len is None:
+                prompt_len = len(input_ids)
+            return self.check(input_ids[prompt_len:]) is not None
+        return criteria
+
+    def eos_logits_processor(self, eos_token_id, includes_prompt=False):
+        # Once degenerate, force EOS so the sequence ends and its slot is freed. vLLM V0 passes only the
+        # output tokens; llama_cpp passes the prompt too (includes_prompt=True), like the stopping criteria.
+        prompt_len = None if includes_prompt else 0
+
+        def processor(token_ids, logits):
+            nonlocal prompt_len
+            if prompt_len is None:
+                prompt_len = len(token_ids)
+            if self.check(token_ids[prompt_len:]) is not None:
+                logits[:] = float("-inf")
+                logits[eos_token_id] = 0.0
+            return logits
+        return processor
+
+
+def whitespace_token_ids(pieces):
+    # Ids of the tokens whose text (pieces[i]) is whitespace only; computed once per tokenizer
+    return {i for i, piece in enumerate(pieces) if piece and not piece.strip()}
+
+
+def hf_whitespace_token_ids(tokenizer):
+    return whitespace_token_ids(tokenizer.batch_decode([[i] for i in range(len(tokenizer))]))
+
+
+def llama_cpp_whitespace_token_ids(llm):
+    return whitespace_token_ids([llm.detokenize([i]).decode("utf-8", errors="replace") for i in range(llm.n_vocab())])
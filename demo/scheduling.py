@@ -0,0 +1,25 @@
+from chunking import OUTPUT_MARGIN, OUTPUT_RATIO
+
+
+def max_tokens_for(input_tokens, cap):
+    # A spelling pass writes about as many tokens as it reads; anything far beyond is a runaway anyway.
+    # A tight limit also keeps the engine from reserving KV cache for output that never comes.
+    return min(cap, int(input_tokens * OUTPUT_RATIO) + OUTPUT_MARGIN)
+
+
+def length_order(lengths):
+    # Longest requests first: they set the length of the run, and requests admitted together then have
+    # similar lengths, so short ones don't sit in a batch waiting on a single long one
+    return sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+
+
+def windowed_length_order(items, length, window):
+    # length_order over a stream: buffer `window` items at a time and yield each buffer longest first,
+    # so scheduling stays close to a global sort while memory stays bounded
+    buffer = []
+    for item in items:
+        buffer.append(item)
+        if len(buffer) >= window:
+            yield from (buffer[i] for i in length_order([length(item) for item in buffer]))
+            buffer = []
+    yield from (buffer[i] for i in length_order([length(item) for item in buffer]))
@@ -0,0 +1,146 @@
+# Warm inference service: one process keeps the engine loaded and serves spelling requests over a
+# Unix socket (or TCP). Requests arriving within a short window are micro-batched into one
+# engine.generate call; results are streamed back one JSON line per request as soon as its batch ends.
+#
+# Protocol (newline-delimited JSON, any number of requests per connection):
+#   -> {"id": "a", "text": "<passage>"}            optional: "instruction", "max_tokens", "echo"
+#   <- {"id": "a", "text": "<output>", "prompt_tokens": ..., "completion_tokens": ..., "queue_seconds": ..., "batch_seconds": ..., "batch_size": ...}
+#      plus the server's info fields (model, init_seconds, ...) and "prompt" when echo was requested
+#   <- {"id": "a", "error": "..."}                 for malformed requests
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from runaway import BLANK_RUN_STOP
+from scheduling import max_tokens_for
+
+BATCH_WINDOW_SECONDS = 0.05
+MAX_BATCH_SIZE = 64
+MAX_TOKENS = 2048
+
+
+class MicroBatcher:
+    """Collects concurrent requests and runs them through the engine in batches.
+
+    The engine runs on a single worker thread (model objects are not thread-safe) while the event
+    loop keeps accepting requests; whatever arrives during a batch goes into the next one.
+    """
+
+    def __init__(self, engine, build_prompt, window=BATCH_WINDOW_SECONDS, max_batch=MAX_BATCH_SIZE, info=None):
+        self.engine = engine
+        self.build_prompt = build_prompt
+        self.info = info or {}
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, text, instruction=None, max_tokens=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, instruction, max_tokens, time.time(), future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _generate(self, batch):
+        prompts = [self.build_prompt(text, instruction) for text, instruction, _, _, _ in batch]
+        sampling = []
+        for text, _, max_tokens, _, _ in batch:
+            if max_tokens is None:
+                max_tokens = max_tokens_for(self.engine.count_tokens(text), MAX_TOKENS)
+            sampling.append({"temperature": 0, "max_tokens": max_tokens, "stop": [BLANK_RUN_STOP]})
+        return prompts, self.engine.generate(prompts, sampling)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            start = time.time()
+            try:
+                prompts, results = await loop.run_in_executor(self.executor, self._generate, batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            end = time.time()
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, _, _, queued, future), prompt, result in zip(batch, prompts, results):
+                if not future.done():
+                    future.set_result(dict(result, **self.info, prompt=prompt, queue_seconds=start - queued, batch_seconds=end - start, batch_size=len(batch)))
+
+
+async def _handle_request(batcher, line, writer, lock):
+    message = {}
+    try:
+        message = json.loads(line)
+        result = await batcher.submit(message["text"], message.get("instruction"), message.get("max_tokens"))
+        response = dict(result, id=message.get("id"))
+        if not message.get("echo"):
+            del response["prompt"]
+    except Exception as e:
+        response = {"id": message.get("id") if isinstance(message, dict) else None, "error": str(e)}
+    async with lock:
+        writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+
+def _connection_handler(batcher):
+    async def handle(reader, writer):
+        # Every line becomes its own task, so one connection can have many requests in flight
+        lock = asyncio.Lock()
+        tasks = []
+        while line := await reader.readline():
+            if line.strip():
+                tasks.append(asyncio.create_task(_handle_request(batcher, line, writer, lock)))
+        await asyncio.gather(*tasks)
+        writer.close()
+    return handle
+
+
+async def serve(batcher, socket_path=None, host="127.0.0.1", port=None):
+    handler = _connection_handler(batcher)
+    if port is not None:
+        server = await asyncio.start_server(handler, host, port)
+    else:
+        server = await asyncio.start_unix_server(handler, socket_path)
+    batch_task = asyncio.create_task(batcher.run())
+    async with server:
+        await server.serve_forever()
+    batch_task.cancel()
+
+
+async def request(texts, socket_path=None, host="127.0.0.1", port=None, instruction=None, echo=False):
+    # Client side: send all texts on one connection and yield responses as they stream back
+    if port is not None:
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    for i, text in enumerate(texts):
+        message = {"id": i, "text": text, "echo": echo}
+        if instruction is not None:
+            message["instruction"] = instruction
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    await writer.drain()
+    writer.write_eof()
+    for _ in texts:
+        line = await reader.readline()
+        if not line:
+            break
+        yield json.loads(line)
+    writer.close()
@@ -0,0 +1,72 @@
+# Start-up time by phase. The response file names record init_seconds of 100-170 s as one number;
+# this splits it into interpreter start and imports, backend import, weight loading, warm-up and
+# prefix evaluation, prints the breakdown and appends it to a JSON-lines log so it can be tracked
+# across runs and machines.
+import contextlib
+import datetime
+import json
+import os
+import platform
+import time
+
+DEFAULT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "startup-log.jsonl")
+
+
+def process_age():
+    # Seconds since this process started (interpreter start-up and module imports so far); None off Linux
+    try:
+        with open("/proc/self/stat", "r") as f:
+            stat = f.read()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return None
+    # Field 22 is the start time in clock ticks after boot; the command name in field 2 may hold spaces
+    start_ticks = int(stat.rsplit(")", 1)[1].split()[19])
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class Phases:
+    """Named start-up phases in the order they ran, each with its duration in seconds."""
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []
+        age = process_age()
+        if age is not None:
+            self.phases.append(("interpreter", age))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def seconds(self, *names):
+        return sum(seconds for name, seconds in self.phases if name in names)
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases) + f"; total {self.total():.2f}s"
+
+    def report(self, log_path=DEFAULT_LOG, **fields):
+        # Prints the breakdown and appends it to log_path (skipped when log_path is None)
+        print(f"Start-up ({self.name}): {self.summary()}")
+        if log_path is None:
+            return
+        record = dict({
+            "timestamp": datetime.datetime.now().isoformat(),
+            "host": platform.node(),
+            "name": self.name,
+            "phases": dict(self.phases),
+            "total_seconds": self.total(),
+        }, **fields)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
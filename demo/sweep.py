@@ -0,0 +1,178 @@
+# Prompt variant sweep: every instruction file x every input on one loaded model. Comparing the
+# instruction files used to cost one infer-batch.py run each, model init and warm-up included; here
+# the model loads once and all variant x chunk requests go to the engine as one batch.
+#
+#   python demo/sweep.py --variants prompt-prefix.txt prompt-spelling.txt prompt-lookup.txt prompt.txt \
+#       [--backend vllm --model Qwen/Qwen2.5-32B-Instruct-AWQ] [--output-dir /hfcache/output/sweep]
+#
+# A variant's instruction is the text before "Tekst:" or, in files without the marker, every
+# paragraph but the last (the sample passage). Variants with the same instruction run once and share
+# their outputs. Each variant gets its own output directory; sweep_summary.json holds tokens, timing
+# and output quality (quality.py) per variant. Latin is not masked, since keeping Latin unchanged is
+# one of the things the instructions differ on.
+import argparse
+import datetime
+import json
+import os
+import statistics
+import time
+
+from benchmark import MAX_TOKENS, SYSTEM_MESSAGE, load_documents
+from chunking import chunk_budget, chunk_text
+from engines import create_engine
+from latency import TraceRecorder
+from pipeline import FileJob, write_text
+from prompting import PASSAGE_MARKER, format_prompt, split_passage
+from quality import format_summary, score_corpus
+from runaway import BLANK_RUN_STOP
+from scheduling import max_tokens_for
+
+PREFIX_CACHING = True
+PREFIX_ORDER = True
+DEFAULT_VARIANTS = ["prompt-prefix.txt", "prompt-spelling.txt", "prompt-lookup.txt", "prompt.txt"]
+DEFAULT_OUTPUT_DIR = "/hfcache/output/sweep"
+MAX_MODEL_LEN = 8192
+
+
+def variant_instruction(text):
+    if PASSAGE_MARKER in text:
+        return split_passage(text)[0]
+    paragraphs = [paragraph.strip() for paragraph in text.strip().split("\n\n") if paragraph.strip()]
+    return "\n\n".join(paragraphs[:-1]) if len(paragraphs) > 1 else text.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every prompt variant over every input on one loaded model")
+    parser.add_argument("--variants", dest="variants", nargs="+", default=DEFAULT_VARIANTS, help="Instruction files, relative to the project root")
+    parser.add_argument("--backend", dest="backend", default="vllm", choices=["vllm", "llama_cpp", "mock"], help="Inference backend")
+    parser.add_argument("--model", dest="model", default="Qwen/Qwen2.5-32B-Instruct-AWQ", help="Model name or GGUF file")
+    parser.add_argument("--inputs", dest="inputs", default="/hfcache/input", help="Directory of .txt passages")
+    parser.add_argument("--max-documents", dest="max_documents", type=int, default=None, help="Use only the first N inputs")
+    parser.add_argument("--output-dir", dest="output_dir", default=DEFAULT_OUTPUT_DIR, help="One subdirectory per variant is written here")
+    parser.add_argument("--max-model-len", dest="max_model_len", type=int, default=MAX_MODEL_LEN, help="Context length; chunks are sized so every variant's prompt fits")
+
+    parser.add_argument("--prefix-caching", dest="prefix_caching", action="store_true", help="Enable prefix caching (vLLM)")
+    parser.add_argument("--no-prefix-caching", dest="prefix_caching", action="store_false", help="Disable prefix caching (vLLM)")
+    parser.set_defaults(prefix_caching=PREFIX_CACHING)
+
+    parser.add_argument("--prefix-order", dest="prefix_order", action="store_true", help="Submit requests sorted by prompt so shared prefixes are adjacent")
+    parser.add_argument("--no-prefix-order", dest="prefix_order", action="store_false", help="Submit requests input by input, variants interleaved")
+    parser.set_defaults(prefix_order=PREFIX_ORDER)
+    args = parser.parse_args()
+
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    variants = {}  # name -> instruction
+    for path in args.variants:
+        with open(os.path.join(base_dir, path), "r", encoding="utf-8") as f:
+            variants[os.path.splitext(os.path.basename(path))[0]] = variant_instruction(f.read())
+    instructions = list(dict.fromkeys(variants.values()))
+    for instruction in instructions:
+        same = [name for name, text in variants.items() if text == instruction]
+        if len(same) > 1:
+            print(f"Variants {', '.join(same)} have the same instruction and run once")
+    documents = load_documents({"inputs": args.inputs, "max_documents": args.max_documents}, base_dir)
+    if not documents:
+        print(f"No .txt files found in '{args.inputs}'.")
+        return
+
+    # 1. Initialize the Model, once for all variants
+    options = {}
+    if args.backend == "vllm":
+        options = {"prefix_caching": args.prefix_caching, "max_model_len": args.max_model_len}
+    elif args.backend == "llama_cpp":
+        from tuning import load_profile
+        options = dict(load_profile(args.model), n_ctx=args.max_model_len)
+    start_init = time.time()
+    engine = create_engine(args.backend, args.model, **options)
+    init_seconds = time.time() - start_init
+    warmup_start = time.time()
+    engine.generate(["Warm-up request"], [{"temperature": 0, "max_tokens": 1}])
+    warmup_seconds = time.time() - warmup_start
+    print(f"Model initialized in {init_seconds:.2f} seconds, warmed up in {warmup_seconds:.2f} seconds")
+
+    # 2. Chunk once, small enough for the longest instruction, so every variant sees the same chunks
+    overhead_tokens = max(engine.count_tokens(format_prompt(SYSTEM_MESSAGE, instruction, "", args.model)) for instruction in instructions)
+    budget = chunk_budget(args.max_model_len, overhead_tokens, MAX_TOKENS)
+    chunked = [(name, chunk_text(text, engine.count_tokens, budget)) for name, text in documents]
+
+    # 3. The cross product of variants and chunks
+    requests = []  # (instruction index, document index, chunk index, prompt)
+    for document, (_, chunks) in enumerate(chunked):
+        for index, chunk in enumerate(chunks):
+            for number, instruction in enumerate(instructions):
+                requests.append((number, document, index, format_prompt(SYSTEM_MESSAGE, instruction, chunk.text, args.model)))
+    # ----
+    # PERFORMANCE IMPROVEMENT: PREFIX-ORDERED BATCH (overridable via CLI)
+    # Sorted by prompt text, requests that share a prefix are adjacent: vLLM's prefix cache keeps each
+    # variant's blocks hot while its requests are scheduled, and llama_cpp, which reuses the common
+    # prefix with the previous prompt, only evaluates the system message and instruction once per variant
+    if args.prefix_order:
+        requests.sort(key=lambda request: request[3])
+    # ------
+    chunk_of = lambda request: chunked[request[1]][1][request[2]]
+    sampling = [{"temperature": 0, "max_tokens": max_tokens_for(chunk_of(request).tokens, MAX_TOKENS), "stop": [BLANK_RUN_STOP]} for request in requests]
+
+    # 4. Run Inference: one batch for everything
+    print(f"Running {len(requests)} requests ({len(instructions)} instructions x {sum(len(chunks) for _, chunks in chunked)} chunks) in one batch...")
+    recorder = TraceRecorder("sweep")
+    start_infer = time.perf_counter()
+    results = engine.generate_traced([request[3] for request in requests], sampling, recorder, [chunk_of(request).text for request in requests])
+    infer_seconds = time.perf_counter() - start_infer
+
+    # 5. Per-variant outputs and summary
+    jobs = [[FileJob(name, chunks) for name, chunks in chunked] for _ in instructions]
+    for request, result in zip(requests, results):
+        jobs[request[0]][request[1]].fill(request[2], result)
+    total_tokens = sum(result["prompt_tokens"] + result["completion_tokens"] for result in results) or 1
+    per_instruction = []
+    for number in range(len(instructions)):
+        mine = [(trace, result) for request, trace, result in zip(requests, recorder.traces, results) if request[0] == number]
+        tokens = sum(result["prompt_tokens"] + result["completion_tokens"] for _, result in mine)
+        outputs = [job.output_text() for job in jobs[number]]
+        per_instruction.append({
+            "requests": len(mine),
+            "prompt_tokens": sum(result["prompt_tokens"] for _, result in mine),
+            "completion_tokens": sum(result["completion_tokens"] for _, result in mine),
+            # The batch is shared, so a variant's time is its share of the tokens processed
+            "seconds": infer_seconds * tokens / total_tokens,
+            "done_after_seconds": max(trace.finished for trace, _ in mine) - start_infer,
+            "ttft_mean": statistics.mean(trace.summary()["ttft_seconds"] for trace, _ in mine),
+            "quality": score_corpus([text for _, text in documents], outputs)["summary"],
+            "outputs": outputs,
+        })
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = {}
+    for name, instruction in variants.items():
+        scores = per_instruction[instructions.index(instruction)]
+        variant_dir = os.path.join(args.output_dir, name)
+        os.makedirs(variant_dir, exist_ok=True)
+        for (document, _), output in zip(documents, scores["outputs"]):
+            write_text(os.path.join(variant_dir, document), output)
+        summary[name] = {key: value for key, value in scores.items() if key != "outputs"}
+        print(f"{name}: {scores['requests']} requests, Prompt: {scores['prompt_tokens']}, Completion: {scores['completion_tokens']}, "
+              f"{scores['seconds']:.2f}s of the batch, done after {scores['done_after_seconds']:.2f}s; {format_summary(scores['quality'])}")
+
+    # Separate runs would each pay init and warm-up; their inference is counted as this batch's
+    separate_seconds = len(instructions) * (init_seconds + warmup_seconds) + infer_seconds
+    sweep_seconds = init_seconds + warmup_seconds + infer_seconds
+    print(f"Sweep: {sweep_seconds:.2f}s in total, about {separate_seconds:.2f}s as {len(instructions)} separate runs ({sweep_seconds / separate_seconds:.0%})")
+    summary_path = os.path.join(args.output_dir, "sweep_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": datetime.datetime.now().isoformat(),
+            "backend": args.backend,
+            "model": args.model,
+            "prefix_caching": args.prefix_caching,
+            "prefix_order": args.prefix_order,
+            "documents": [name for name, _ in documents],
+            "init_seconds": init_seconds,
+            "warmup_seconds": warmup_seconds,
+            "infer_seconds": infer_seconds,
+            "separate_runs_seconds": separate_seconds,
+            "variants": summary,
+        }, f, indent=2)
+    print(f"Summary written to {summary_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# Auto-tuner for the llama_cpp runtime parameters. The scripts used to hard-code n_threads, n_ctx and
+# the draft length, each a little differently, and the best values depend on the machine: core count,
+# memory bandwidth and cache sizes. This searches them on a small calibration sample and keeps the
+# fastest configuration whose output is identical to the baseline's (thread count and batch size can
+# change float rounding, and with it a greedy decode).
+#
+#   python demo/tuning.py --model ./models/Mistral-7B-Instruct-v0.3-Q4_K_M.gguf --max-documents 3
+#
+# The result is stored per machine in models/profiles/<machine>.json, keyed by model file.
+# infer.py, infer-raw-llama-cpp.py and infer-batch-llama-cpp.py pick it up with load_profile() and
+# fall back to their own defaults when there is none.
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import time
+
+# Profiles sit next to the GGUF files and the prefix states; like those they are not tracked in git
+DEFAULT_PROFILE_DIR = os.path.join("models", "profiles")
+
+# Starting point and reference output: infer-raw-llama-cpp.py's settings
+BASELINE = {"n_threads": 8, "n_batch": 512, "n_ctx": 4096, "draft_tokens": 3, "logits_all": True}
+PASSES = 2
+
+
+def machine_id():
+    # CPU model and CPU count rather than the host name, which changes with every container
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return re.sub(r'[^A-Za-z0-9._-]+', "_", f"{cpu}-{os.cpu_count()}cpu").strip("_")
+
+
+def profile_path(profile_dir=DEFAULT_PROFILE_DIR):
+    return os.path.join(profile_dir, f"{machine_id()}.json")
+
+
+def load_profile(model_path, profile_dir=DEFAULT_PROFILE_DIR):
+    # Tuned parameters for this machine and model file, {} when it was never tuned here
+    path = profile_path(profile_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    return profile.get("models", {}).get(os.path.basename(model_path), {}).get("params", {})
+
+
+def save_profile(model_path, entry, profile_dir=DEFAULT_PROFILE_DIR):
+    path = profile_path(profile_dir)
+    profile = {"machine": machine_id(), "models": {}}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    profile["models"][os.path.basename(model_path)] = entry
+    os.makedirs(profile_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def search_space(physical_cores):
+    threads = sorted({max(1, physical_cores // 4), max(1, physical_cores // 2), physical_cores, BASELINE["n_threads"]})
+    return {
+        "n_threads": threads,
+        "n_batch": [128, 256, 512, 1024, 2048],
+        "n_ctx": [2048, 4096, 8192],
+        "draft_tokens": [0, 3, 5, 10],
+        "logits_all": [False, True],
+    }
+
+
+def valid(params):
+    # Verifying drafted tokens needs the logits of every position
+    return params["logits_all"] or not params["draft_tokens"]
+
+
+def calibrate(model_path, params, documents, instruction, repeats=1):
+    # (seconds of the fastest repeat, outputs per document, completion tokens)
+    from chunking import chunk_budget, chunk_text, reassemble
+    from benchmark import MAX_TOKENS, SYSTEM_MESSAGE
+    from engines import create_engine
+    from prompting import format_prompt
+    from runaway import BLANK_RUN_STOP
+    from scheduling import max_tokens_for
+
+    engine = create_engine("llama_cpp", model_path, **params)
+    model = os.path.basename(model_path)
+    overhead_tokens = engine.count_tokens(format_prompt(SYSTEM_MESSAGE, instruction, "", model))
+    budget = chunk_budget(params["n_ctx"], overhead_tokens, MAX_TOKENS)
+    work = []
+    for _, text in documents:
+        chunks = chunk_text(text, engine.count_tokens, budget)
+        prompts = [format_prompt(SYSTEM_MESSAGE, instruction, chunk.text, model) for chunk in chunks]
+        sampling = [{"temperature": 0, "max_tokens": max_tokens_for(chunk.tokens, MAX_TOKENS), "stop": [BLANK_RUN_STOP]} for chunk in chunks]
+        work.append((chunks, prompts, sampling))
+    # Warm-up: page the weights in and settle the thread pool
+    engine.generate(work[0][1][:1], [dict(work[0][2][0], max_tokens=8)], [work[0][0][0].text])
+    best = None
+    for _ in range(repeats):
+        outputs = []
+        completion_tokens = 0
+        start = time.time()
+        for chunks, prompts, sampling in work:
+            results = engine.generate(prompts, sampling, [chunk.text for chunk in chunks])
+            outputs.append(reassemble(chunks, [result["text"] for result in results]))
+            completion_tokens += sum(result["completion_tokens"] for result in results)
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    del engine
+    return best, outputs, completion_tokens
+
+
+def tune(model_path, documents, instruction, space, baseline=BASELINE, passes=PASSES, repeats=1):
+    """Coordinate descent from the baseline: one parameter at a time, every value tried with the
+    others at their best so far, keeping the fastest whose output equals the baseline output.
+    Returns (best params, best seconds, baseline seconds, trials)."""
+    trials = {}
+
+    def trial(params):
+        key = json.dumps(params, sort_keys=True)
+        if key not in trials:
+            try:
+                seconds, outputs, tokens = calibrate(model_path, params, documents, instruction, repeats)
+                trials[key] = {"params": params, "seconds": seconds, "outputs": outputs, "tokens": tokens}
+            except Exception as e:  # out of memory, context too small for the documents, ...
+                trials[key] = {"params": params, "seconds": None, "outputs": None, "error": str(e)}
+            result = trials[key]
+            status = f"{result['seconds']:.2f}s" if result["seconds"] is not None else f"failed: {result['error']}"
+            print(f"  {key}: {status}")
+        return trials[key]
+
+    reference = trial(dict(baseline))
+    if reference["seconds"] is None:
+        raise RuntimeError(f"Baseline configuration failed: {reference['error']}")
+    best = reference
+    for _ in range(passes):
+        improved = False
+        for name, values in space.items():
+            for value in values:
+                params = dict(best["params"], **{name: value})
+                if not valid(params):
+                    continue
+                result = trial(params)
+                if result["seconds"] is None:
+                    continue
+                if result["outputs"] != reference["outputs"]:
+                    print("  output differs from the baseline, rejected")
+                    continue
+                if result["seconds"] < best["seconds"]:
+                    best = result
+                    improved = True
+        if not improved:
+            break
+    return best["params"], best["seconds"], reference["seconds"], list(trials.values())
+
+
+def main():
+    from benchmark import load_documents
+    from cpus import available_cpus, physical_cpus
+
+    parser = argparse.ArgumentParser(description="Tune llama_cpp runtime parameters on a calibration sample")
+    parser.add_argument("--model", dest="model", default="./models/Mistral-7B-Instruct-v0.3-Q4_K_M.gguf", help="GGUF model file")
+    parser.add_argument("--inputs", dest="inputs", default="/hfcache/input", help="Directory of .txt passages to calibrate on")
+    parser.add_argument("--max-documents", dest="max_documents", type=int, default=3, help="Calibration sample size")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=1, help="Timed runs per configuration (the fastest counts)")
+    parser.add_argument("--passes", dest="passes", type=int, default=PASSES, help="Rounds over all parameters")
+    parser.add_argument("--profile-dir", dest="profile_dir", default=DEFAULT_PROFILE_DIR, help="Where per-machine profiles are stored")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Print the result without saving the profile")
+    args = parser.parse_args()
+
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    with open(os.path.join(base_dir, "prompt-prefix.txt"), "r", encoding="utf-8") as f:
+        instruction = f.read().strip()
+    documents = load_documents({"inputs": args.inputs, "max_documents": args.max_documents}, base_dir)
+    if not documents:
+        print(f"No .txt files found in '{args.inputs}'.")
+        return
+
+    space = search_space(len(physical_cpus(available_cpus())))
+    print(f"Tuning {os.path.basename(args.model)} on {machine_id()} with {len(documents)} documents")
+    params, seconds, baseline_seconds, trials = tune(args.model, documents, instruction, space, passes=args.passes, repeats=args.repeats)
+    print(f"Best: {json.dumps(params, sort_keys=True)} in {seconds:.2f}s, baseline {baseline_seconds:.2f}s ({baseline_seconds / seconds:.2f}x), {len(trials)} configurations tried")
+    if args.dry_run:
+        return
+    path = save_profile(args.model, {
+        "params": params,
+        "seconds": seconds,
+        "baseline_seconds": baseline_seconds,
+        "documents": [name for name, _ in documents],
+        "tuned": datetime.datetime.now().isoformat(),
+    }, args.profile_dir)
+    print(f"Profile written to {path}")
+
+if __name__ == "__main__":
+    main()
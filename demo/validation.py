@@ -0,0 +1,74 @@
+# Cheap checks on the output of a spelling pass, used by the model cascade (cascade.py) to decide
+# whether a small model's output can be kept or the chunk has to go to the next model. Every check
+# is text-only and takes a few milliseconds per chunk, next to seconds of inference.
+import difflib
+import re
+
+from latin import PLACEHOLDER_PATTERN, latin_spans, lost_placeholders
+from lexicon import RULES, SEED, WORD
+from run_index import degenerate_reason
+
+# Modernizing spelling keeps every word; allow a little for split or merged compounds
+MIN_WORD_RATIO = 0.9
+MAX_WORD_RATIO = 1.1
+WORD_SLACK = 2           # absolute difference always tolerated, for short chunks
+MAX_EDIT_RATIO = 0.25    # character edits relative to the input length
+
+TOKEN = re.compile(r'\s*\S+')  # a word with its punctuation and the whitespace before it
+
+
+def character_edits(source, output):
+    # Characters inserted, deleted or replaced along difflib's alignment; close to the Levenshtein
+    # distance for texts that differ in scattered small edits, which is what a spelling pass produces
+    matcher = difflib.SequenceMatcher(None, source, output, autojunk=False)
+    return sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal")
+
+
+def edit_distance(source, output):
+    # Align words (with the whitespace before them) first, then count characters only inside the
+    # spans that differ: a character-level alignment of a whole 5 kB chunk takes up to a second, the
+    # word alignment a few milliseconds, and the spans a spelling pass changes are single words
+    source_tokens = TOKEN.findall(source)
+    output_tokens = TOKEN.findall(output)
+    matcher = difflib.SequenceMatcher(None, source_tokens, output_tokens, autojunk=False)
+    return sum(character_edits("".join(source_tokens[i1:i2]), "".join(output_tokens[j1:j2]))
+               for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal")
+
+
+def certainly_archaic(word):
+    # Old spellings every model must fix (the prompt's examples and the -sch rules); looks_archaic in
+    # lexicon.py casts a wider net that also catches modern words
+    return word in SEED or (word[:1].islower() and any(pattern.search(word) for pattern, _ in RULES))
+
+
+def validate(source, output):
+    """Reason the output of source fails ("<check>: <detail>"), or None when it passes.
+
+    source may contain Latin placeholders (latin.py); those must all survive. Latin that was left in
+    the text must come back verbatim.
+    """
+    output = output.strip()
+    if not output:
+        return "empty: no output"
+    degenerate = degenerate_reason(source, output)
+    if degenerate:
+        return f"runaway: {degenerate}"
+    source_words = WORD.findall(source)
+    output_words = WORD.findall(output)
+    if abs(len(output_words) - len(source_words)) > WORD_SLACK and not (
+            MIN_WORD_RATIO * len(source_words) <= len(output_words) <= MAX_WORD_RATIO * len(source_words)):
+        return f"word count: {len(output_words)} for {len(source_words)} input words"
+    if PLACEHOLDER_PATTERN.search(source):
+        lost = lost_placeholders(source, output)
+        if lost:
+            return f"latin: lost placeholder(s) {', '.join(sorted(lost))}"
+    for start, end in latin_spans(source):
+        if source[start:end] not in output:
+            return "latin: passage changed"
+    distance = edit_distance(source, output)
+    if distance > MAX_EDIT_RATIO * len(source):
+        return f"edit distance: {distance} character edits for {len(source)} input characters"
+    kept = set(word for word in source_words if certainly_archaic(word)) & set(output_words)
+    if kept:
+        return f"archaic: left unchanged {', '.join(sorted(kept)[:3])}"
+    return None